@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Per-chunk commit ledger so an interrupted ingest can resume.
+
+Each chunk is written in the same transaction as its ledger row, so the
+ledger never claims a chunk that did not land, and a landed chunk is never
+missing from the ledger. `chunk_index` is whatever unit the caller iterates
+over: the read_csv chunk number here, a row-group index for parquet.
+"""
+
+import hashlib
+
+import pandas as pd
+from sqlalchemy import text
+
+
+LEDGER_TABLE = 'ingest_ledger'
+
+
+def ensure_ledger(engine):
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {LEDGER_TABLE} (
+                source_file  text        NOT NULL,
+                target_table text        NOT NULL,
+                chunk_index  integer     NOT NULL,
+                rows         bigint      NOT NULL,
+                checksum     text        NOT NULL,
+                loaded_at    timestamptz NOT NULL DEFAULT now(),
+                PRIMARY KEY (source_file, target_table, chunk_index)
+            )
+        """))
+
+
+def completed_chunks(engine, source_file, target_table):
+    """Return {chunk_index: (rows, checksum)} already committed for this file and table."""
+    with engine.connect() as conn:
+        result = conn.execute(
+            text(f"SELECT chunk_index, rows, checksum FROM {LEDGER_TABLE} "
+                 "WHERE source_file = :source_file AND target_table = :target_table"),
+            {'source_file': source_file, 'target_table': target_table},
+        )
+        return {index: (rows, checksum) for index, rows, checksum in result}
+
+
+def forget_table(conn, target_table, source_file=None):
+    """
+    Drop every ledger row for `target_table`; call when the table is replaced.
+    With `source_file`, only that file's rows (a month partition was replaced).
+    """
+    if source_file is None:
+        conn.execute(text(f"DELETE FROM {LEDGER_TABLE} WHERE target_table = :target_table"),
+                     {'target_table': target_table})
+    else:
+        conn.execute(text(f"DELETE FROM {LEDGER_TABLE} WHERE target_table = :target_table "
+                          "AND source_file = :source_file"),
+                     {'target_table': target_table, 'source_file': source_file})
+
+
+def chunk_checksum(df):
+    """Content hash of a chunk, independent of its index."""
+    return hashlib.md5(pd.util.hash_pandas_object(df, index=False).values.tobytes()).hexdigest()
+
+
+def record_chunk(conn, source_file, target_table, chunk_index, df):
+    """Add the ledger row for a chunk inside the caller's transaction."""
+    record_rows(conn, source_file, target_table, chunk_index, len(df), chunk_checksum(df))
+
+
+def record_rows(conn, source_file, target_table, chunk_index, rows, checksum):
+    """Same as record_chunk, for units the caller checksums itself (e.g. raw byte ranges)."""
+    conn.execute(
+        text(f"INSERT INTO {LEDGER_TABLE} (source_file, target_table, chunk_index, rows, checksum) "
+             "VALUES (:source_file, :target_table, :chunk_index, :rows, :checksum)"),
+        {'source_file': source_file, 'target_table': target_table, 'chunk_index': chunk_index,
+         'rows': rows, 'checksum': checksum},
+    )
@@ -2,36 +2,65 @@
 # coding: utf-8
 
 
+import csv
+import io
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import pandas as pd
 from sqlalchemy import create_engine
 from tqdm.auto import tqdm
 import click
 
+# batching, partitions, schemas and telemetry are shared with the ingestion scripts;
+# the image copies them in beside this file (see Dockerfile)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'self-develop', 'ingestion'))
+from batching import AdaptiveBatcher, csv_chunks
+from checkpoint import (chunk_checksum, completed_chunks, ensure_ledger,
+                        forget_table, record_chunk)
+from parallel_csv import decompress, discard, line_ranges, load_range, range_checksum
+from partitions import (INDEX_MODES, PARTITION_KEYS, build_indexes, drop_indexes, ensure_parent, finish_month,
+                        month_table, require_partitioned, split_month)
+from schemas import compact_frame, csv_dtypes
+from telemetry import Telemetry
+
+
+# compact TLC types (int16 IDs, categories, ...) from the shared registry; surcharges
+# are read as float64 and narrowed to float32 by compact_frame(), which checks they fit
+dtype, parse_dates = csv_dtypes('yellow')
+
 
-dtype = {
-    "VendorID": "Int64",
-    "passenger_count": "Int64",
-    "trip_distance": "float64",
-    "RatecodeID": "Int64",
-    "store_and_fwd_flag": "string",
-    "PULocationID": "Int64",
-    "DOLocationID": "Int64",
-    "payment_type": "Int64",
-    "fare_amount": "float64",
-    "extra": "float64",
-    "mta_tax": "float64",
-    "tip_amount": "float64",
-    "tolls_amount": "float64",
-    "improvement_surcharge": "float64",
-    "total_amount": "float64",
-    "congestion_surcharge": "float64"
+def psql_insert_copy(table, conn, keys, data_iter):
+    """to_sql `method` that loads a chunk with COPY ... FROM STDIN instead of INSERTs."""
+    dbapi_conn = conn.connection
+    with dbapi_conn.cursor() as cur:
+        buf = io.StringIO()
+        csv.writer(buf).writerows(data_iter)
+        buf.seek(0)
+
+        columns = ', '.join(f'"{k}"' for k in keys)
+        table_name = f'"{table.schema}"."{table.name}"' if table.schema else f'"{table.name}"'
+        cur.copy_expert(f'COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT csv)', buf)
+
+
+load_methods = {
+    'insert': None,
+    'copy': psql_insert_copy,
 }
 
-parse_dates = [
-    "tpep_pickup_datetime",
-    "tpep_dropoff_datetime"
-]
 
+def finish_load(engine, target_table, year, month, partitioned, indexes, telemetry):
+    """Attach the month's load table as its partition, or build the flat table's indexes."""
+    if partitioned:
+        print(f"Attaching '{month_table(target_table, year, month)}' to '{target_table}'...")
+        with telemetry.stage('attach'):
+            finish_month(engine, target_table, 'yellow', year, month, indexes)
+    elif indexes != 'none':
+        print(f"Building indexes on '{target_table}'...")
+        with telemetry.stage('index'):
+            build_indexes(engine, target_table, 'yellow', indexes)
 
 
 @click.command()
@@ -44,12 +73,82 @@ parse_dates = [
 @click.option('--month', default=1, type=int, help='Month of the data')
 @click.option('--target_table', default='yellow_taxi_data', help='Target table name')
 @click.option('--chunksize', default=100000, type=int, help='Chunk size for reading CSV')
-def run(pg_user, pg_pass, pg_host, pg_port, pg_db, year, month, target_table, chunksize):
+@click.option('--load_method', default='insert', type=click.Choice(list(load_methods)), help='insert (to_sql) or copy (COPY FROM STDIN)')
+@click.option('--resume/--no-resume', default=True, help='Skip chunks already recorded in the ingest ledger')
+@click.option('--workers', default=1, type=int, help='Parse and load byte ranges of the decompressed CSV in this many processes')
+@click.option('--range_mb', default=64, type=int, help='Size of each byte range with --workers > 1')
+@click.option('--memory_budget', default=None, type=int, help='MB for in-flight chunks (shared by --workers); sizes chunks from measured row width and commit time instead of --chunksize')
+@click.option('--partitioned', is_flag=True, help='Load the month as its own partition of a table range-partitioned by pickup month (trips picked up outside the month are dropped)')
+@click.option('--indexes', default='none', type=click.Choice(INDEX_MODES), help='Pickup time and PU/DO indexes: none, after (dropped for the load, built at the end) or concurrently (CREATE INDEX CONCURRENTLY, blocking nobody)')
+def run(pg_user, pg_pass, pg_host, pg_port, pg_db, year, month, target_table, chunksize, load_method, resume,
+        workers, range_mb, memory_budget, partitioned, indexes):
     """Ingest NYC taxi data into PostgreSQL database."""
-    prefix = 'https://github.com/DataTalksClub/nyc-tlc-data/releases/download/yellow/'
+    # overridable so tests and bench_ingest.py can serve the CSV locally
+    prefix = os.environ.get('TLC_BASE_URL', 'https://github.com/DataTalksClub/nyc-tlc-data/releases/download/yellow/')
     url = prefix + f'yellow_tripdata_{year}-{month:02d}.csv.gz'
 
-    engine = create_engine(f'postgresql://{pg_user}:{pg_pass}@{pg_host}:{pg_port}/{pg_db}')
+    db_url = f'postgresql://{pg_user}:{pg_pass}@{pg_host}:{pg_port}/{pg_db}'
+    engine = create_engine(db_url)
+    telemetry = Telemetry('ingest_data', month=f'{year}-{month:02d}', table=target_table)
+    budget = memory_budget * 1024 * 1024 if memory_budget else None
+
+    if partitioned:
+        with engine.connect() as conn:
+            require_partitioned(conn, target_table)
+        # rows of the month go to a table of their own, attached as its partition at the end
+        write_table = month_table(target_table, year, month)
+    else:
+        write_table = target_table
+        drop_indexes(engine, target_table, 'yellow', indexes)
+
+    if workers > 1:
+        with telemetry.stage('download') as step:
+            csv_file = decompress(url, f'yellow_tripdata_{year}-{month:02d}.csv')
+            step['bytes'] = os.path.getsize(csv_file)
+        header, ranges = line_ranges(csv_file, range_mb * 1024 * 1024)
+        # ledger indexes are range numbers, which depend on the range size
+        source_file = f'{url}#range_mb={range_mb}'
+
+        ensure_ledger(engine)
+        done = completed_chunks(engine, source_file, target_table) if resume else {}
+        if done:
+            print(f"Resuming: {len(done)} of {len(ranges)} range(s) already in '{target_table}'")
+        else:
+            with engine.begin() as conn:
+                sample = compact_frame(pd.read_csv(csv_file, dtype=dtype, parse_dates=parse_dates, nrows=100), 'yellow')
+                sample.head(0).to_sql(name=write_table, con=conn, if_exists='replace')
+                if partitioned:
+                    ensure_parent(conn, target_table, write_table, 'yellow')
+                    forget_table(conn, target_table, source_file)
+                else:
+                    forget_table(conn, target_table)
+
+        with open(csv_file, 'rb') as f:
+            for i, (start, end, _) in enumerate(ranges):
+                if i in done:
+                    f.seek(start)
+                    if done[i][1] != range_checksum(f.read(end - start)):
+                        raise click.ClickException(
+                            f"Range {i} of {csv_file} differs from the ledger; rerun with --no-resume")
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(load_range, db_url, csv_file, header, i, start, end, first_row, source_file,
+                            target_table, chunksize, dtype, parse_dates, load_methods[load_method],
+                            budget / workers if budget else None, (year, month) if partitioned else None): i
+                for i, (start, end, first_row) in enumerate(ranges) if i not in done
+            }
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                rows, decode, write = future.result()
+                start, end, _ = ranges[futures[future]]
+                # busy time inside the workers, so these add up to more than the wall clock
+                telemetry.record('decode', decode, chunk=futures[future], rows=rows, nbytes=end - start)
+                telemetry.record('write', write, chunk=futures[future], rows=rows)
+        finish_load(engine, target_table, year, month, partitioned, indexes, telemetry)
+        # loaded: a later run starts from the source again, so the month's CSV can go
+        discard(csv_file)
+        telemetry.close()
+        return
 
     df_iter = pd.read_csv(
         url,
@@ -58,19 +157,55 @@ def run(pg_user, pg_pass, pg_host, pg_port, pg_db, year, month, target_table, ch
         iterator = True,
         chunksize = chunksize,
     )
-    first = True
-    for df_chunk in tqdm(df_iter):
-        if first:
-            df_chunk.head(0).to_sql(
-                name='yellow_taxi_data',
-                con=engine,
-                if_exists='replace'
-            )
-            first = False
-        df_chunk.to_sql(
-            name= target_table,
-            con=engine,
-            if_exists='append')
+
+    ensure_ledger(engine)
+    done = completed_chunks(engine, url, target_table) if resume else {}
+    if done:
+        print(f"Resuming: {len(done)} chunk(s) already in '{target_table}'")
+
+    first = not done
+    batcher = AdaptiveBatcher(budget, rows=chunksize)
+    # committed chunks are re-cut at their recorded sizes, whatever the batcher would pick now
+    chunks = (compact_frame(df_chunk, 'yellow')
+              for df_chunk in csv_chunks(df_iter, batcher, sizes={i: rows for i, (rows, _) in done.items()}))
+    # read_csv fetches the file as it parses, so 'decode' includes the download
+    for i, df_chunk in enumerate(tqdm(telemetry.iterate('decode', chunks))):
+        if i in done:
+            # the CSV still has to be parsed to move past this chunk, but make
+            # sure it is the same data we committed last time
+            if done[i] != (len(df_chunk), chunk_checksum(df_chunk)):
+                raise click.ClickException(
+                    f"Chunk {i} of {url} differs from the ledger; rerun with --no-resume")
+            continue
+
+        start = time.perf_counter()
+        with telemetry.stage('write', chunk=i, rows=len(df_chunk)), engine.begin() as conn:
+            if first:
+                df_chunk.head(0).to_sql(
+                    name=write_table,
+                    con=conn,
+                    if_exists='replace'
+                )
+                if partitioned:
+                    ensure_parent(conn, target_table, write_table, 'yellow')
+                    forget_table(conn, target_table, url)
+                else:
+                    forget_table(conn, target_table)
+                first = False
+            month_rows = df_chunk
+            if partitioned:
+                # the ledger keeps the whole chunk; pickups outside the month are dropped (see partitions.py)
+                month_rows, _ = split_month(df_chunk, PARTITION_KEYS['yellow'], year, month)
+            month_rows.to_sql(
+                name= write_table,
+                con=conn,
+                if_exists='append',
+                method=load_methods[load_method])
+            record_chunk(conn, url, target_table, i, df_chunk)
+        batcher.observe(len(df_chunk), df_chunk.memory_usage(deep=True).sum(), time.perf_counter() - start)
+
+    finish_load(engine, target_table, year, month, partitioned, indexes, telemetry)
+    telemetry.close()
 
 if __name__ == '__main__':
     run()
\ No newline at end of file
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Multi-core CSV ingestion by byte range.
+
+The .csv.gz is decompressed once to a plain CSV, then cut into line-aligned
+byte ranges. The CSV is kept only while a load of it is unfinished: a
+resumed run reuses it if the source still has the same ETag/size, and a
+successful load deletes it. Each range is parsed by a worker process
+with the same dtype/parse_dates as the serial path and written over the
+worker's own connection, in one transaction with its ledger row, so
+--resume skips whole ranges. TLC CSVs never quote a newline, so every
+newline is a record boundary.
+"""
+
+import gzip
+import hashlib
+import io
+import os
+import shutil
+import time
+import urllib.request
+
+import pandas as pd
+from sqlalchemy import create_engine
+
+from batching import AdaptiveBatcher, csv_chunks
+from checkpoint import record_rows
+from partitions import PARTITION_KEYS, month_table, split_month
+from schemas import compact_frame
+
+
+def source_version(url):
+    """ETag, else size and Last-Modified, of `url` from a HEAD; None if the server won't say."""
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, method='HEAD')) as response:
+            headers = response.headers
+    except OSError:
+        return None
+    return headers.get('ETag') or '|'.join(filter(None, [headers.get('Content-Length'),
+                                                         headers.get('Last-Modified')])) or None
+
+
+def decompress(url, csv_file):
+    """
+    Download and gunzip `url` to `csv_file`, unless an unfinished run left it
+    there from the same version of the source (recorded beside it in
+    `csv_file`.source).
+    """
+    version = source_version(url)
+    stamp = csv_file + '.source'
+    if version and os.path.exists(csv_file) and os.path.exists(stamp):
+        with open(stamp) as f:
+            if f.read() == version:
+                return csv_file
+    discard(csv_file)
+    part = csv_file + '.part'
+    with urllib.request.urlopen(url) as response, gzip.GzipFile(fileobj=response) as src, open(part, 'wb') as dest:
+        shutil.copyfileobj(src, dest, 1024 * 1024)
+    os.replace(part, csv_file)
+    if version:
+        with open(stamp, 'w') as f:
+            f.write(version)
+    return csv_file
+
+
+def discard(csv_file):
+    """Remove a decompressed CSV and its version stamp, once no resume needs them."""
+    for path in (csv_file, csv_file + '.source'):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def line_ranges(csv_file, range_bytes):
+    """
+    Split the body of `csv_file` into ranges of about `range_bytes` that end on
+    a newline. Returns (header, [(start, end, first_row), ...]); first_row is
+    the row number the serial reader would give the range's first line.
+    """
+    size = os.path.getsize(csv_file)
+    ranges = []
+    with open(csv_file, 'rb') as f:
+        header = f.readline()
+        start, first_row = f.tell(), 0
+        while start < size:
+            f.seek(min(start + range_bytes, size))
+            f.readline()
+            end = f.tell()
+            ranges.append((start, end, first_row))
+
+            f.seek(start)
+            first_row += f.read(end - start).count(b'\n')
+            start = end
+    return header, ranges
+
+
+def load_range(db_url, csv_file, header, index, start, end, first_row, source_file, target_table,
+               chunksize, dtype, parse_dates, method, memory_budget=None, month=None):
+    """
+    Worker: parse one byte range and append it, plus its ledger row, in a
+    single transaction. With `month` (year, month) the rows of that month go
+    to its load table and the rest are dropped (see partitions.py).
+    Returns (rows, decode seconds, write seconds).
+    """
+    with open(csv_file, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    engine = create_engine(db_url)
+    rows, decode, write = 0, 0.0, 0.0
+    try:
+        with engine.begin() as conn:
+            df_iter = pd.read_csv(io.BytesIO(header + data), dtype=dtype, parse_dates=parse_dates,
+                                  iterator=True, chunksize=chunksize)
+            # a range is resumed as a whole, so its chunks are free to change size
+            batcher = AdaptiveBatcher(memory_budget, rows=chunksize)
+            chunks = (compact_frame(df_chunk, 'yellow') for df_chunk in csv_chunks(df_iter, batcher))
+            while True:
+                t0 = time.perf_counter()
+                df_chunk = next(chunks, None)
+                t1 = time.perf_counter()
+                decode += t1 - t0
+                if df_chunk is None:
+                    break
+                # keep the index column identical to a serial load
+                df_chunk.index += first_row
+                if month:
+                    inside, _ = split_month(df_chunk, PARTITION_KEYS['yellow'], *month)
+                    inside.to_sql(name=month_table(target_table, *month), con=conn, if_exists='append', method=method)
+                else:
+                    df_chunk.to_sql(name=target_table, con=conn, if_exists='append', method=method)
+                write += time.perf_counter() - t1
+                batcher.observe(len(df_chunk), df_chunk.memory_usage(deep=True).sum(), time.perf_counter() - t1)
+                rows += len(df_chunk)
+            record_rows(conn, source_file, target_table, index, rows, range_checksum(data))
+    finally:
+        engine.dispose()
+    return rows, decode, write
+
+
+def range_checksum(data):
+    """md5 of the raw bytes, so a resumed run can check a range without parsing it."""
+    return hashlib.md5(data).hexdigest()
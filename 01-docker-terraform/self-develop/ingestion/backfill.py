@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Parallel backfill of a range of TLC months.
+
+Each month is downloaded and loaded in its own process (--workers), while
+--max_db_writers caps how many of them write to PostgreSQL at once, so
+downloads overlap with loads without piling up connections. A month that
+fails is reported and the rest carry on; the command fails at the end if
+any did. --incremental records what was loaded in the manifest table
+(manifest.py) and only loads months that are new or changed since.
+
+    python backfill.py --service yellow --from 2019-01 --to 2021-07 --workers 4
+"""
+
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+
+import click
+from click.core import ParameterSource
+import pyarrow.parquet as pq
+from sqlalchemy import create_engine, inspect, text
+
+from batching import AdaptiveBatcher, parquet_batches
+from download_cache import shared_cache
+from manifest import MANIFEST_TABLE, PgManifest, plan
+from loader import ARROW_METHODS, LOAD_METHODS, create_table, write_batch, write_chunk
+from parquet_footer import validate_schema
+from partitions import (INDEX_MODES, build_indexes, drop_indexes, ensure_parent, finish_month, month_table,
+                        require_partitioned)
+from rollups import Rollup, rollup_table
+from schemas import quote_ident, to_pandas
+from telemetry import Telemetry
+from transforms import Feed, chain
+from upsert import KEY_COLUMNS, prepare_upsert, upsert_batch
+
+
+# TLC_BASE_URL swaps in another mirror with the same file names
+prefix = os.environ.get('TLC_BASE_URL', 'https://d37ci6vzurychx.cloudfront.net/trip-data/')
+
+# set in each pool worker; limits how many months write to Postgres at once
+_db_slots = None
+
+
+def _init_worker(db_slots):
+    global _db_slots
+    _db_slots = db_slots
+
+
+def parse_month(ctx, param, value):
+    """click callback: 'YYYY-MM' -> (year, month)."""
+    try:
+        year, month = (int(part) for part in value.split('-'))
+    except ValueError:
+        raise click.BadParameter("expected YYYY-MM")
+    if not 1 <= month <= 12:
+        raise click.BadParameter("month must be between 01 and 12")
+    return year, month
+
+
+def month_range(start, end):
+    """Yield (year, month) pairs from start to end inclusive."""
+    year, month = start
+    while (year, month) <= end:
+        yield year, month
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def load_month(service, year, month, db_url, target_table, load_method, upsert=False, batch_size=100000,
+               memory_budget=None, partitioned=False, indexes='none', rollup=False):
+    """
+    Download one month and load it; returns a dict of timings in seconds.
+    With `partitioned` the month goes to its own load table and is attached
+    as a partition of `target_table` at the end (see partitions.py). With
+    `rollup` the month's rows of <target_table>_rollup are replaced too.
+    """
+    file_name = f'{service}_tripdata_{year}-{month:02d}.parquet'
+    result = {'month': f'{year}-{month:02d}', 'rows': 0}
+
+    start = time.perf_counter()
+    cache = shared_cache()
+    local_file = cache.fetch(prefix + file_name)
+    result['download'] = time.perf_counter() - start
+    # the version actually loaded, for the manifest (the month may have changed since plan() probed it)
+    result['source'] = cache.version(prefix + file_name)
+    result['bytes'] = os.path.getsize(local_file)
+    validate_schema(pq.read_metadata(local_file), service)
+
+    engine = create_engine(db_url)
+    try:
+        start = time.perf_counter()
+        with _db_slots or nullcontext():
+            result['wait'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            parquet_file = pq.ParquetFile(local_file)
+            batcher = AdaptiveBatcher(memory_budget, rows=batch_size)
+            write_table = month_table(target_table, year, month) if partitioned else target_table
+            first = True
+            # a partition holds its own month only, so reloading it can't touch any other (see partitions.py)
+            transform = chain(Feed(service, year, month), ['in_month'] if partitioned else [])
+            month_rollup = Rollup(service, file_name) if rollup else None
+            for batch in parquet_batches(parquet_file, batcher):
+                batch = transform(batch)
+                if month_rollup is not None:
+                    month_rollup.add(batch)
+
+                if first and partitioned:
+                    # a fresh load table per month, so no lock needed until the parent
+                    if load_method in ARROW_METHODS:
+                        create_table(engine, write_table, batch.schema, if_exists='replace')
+                    else:
+                        to_pandas(batch.schema.empty_table()).to_sql(
+                            name=write_table, con=engine, if_exists='replace', index=False)
+                    with engine.begin() as conn:
+                        ensure_parent(conn, target_table, write_table, service)
+                    first = False
+                elif first:
+                    # months run in parallel; serialise the CREATE TABLE between them
+                    with engine.begin() as conn:
+                        conn.execute(text('SELECT pg_advisory_xact_lock(hashtext(:t))'), {'t': target_table})
+                        if upsert:
+                            prepare_upsert(conn, target_table, batch.schema)
+                        elif load_method in ARROW_METHODS:
+                            create_table(conn, target_table, batch.schema)
+                        else:
+                            to_pandas(batch.schema.empty_table()).to_sql(
+                                name=target_table, con=conn, if_exists='append', index=False)
+                    first = False
+
+                written = time.perf_counter()
+                if upsert:
+                    upsert_batch(batch, engine, target_table, KEY_COLUMNS[service], file_name)
+                    nbytes = batch.nbytes
+                elif load_method in ARROW_METHODS:
+                    write_batch(batch, engine, write_table, if_exists='append', method=load_method)
+                    nbytes = batch.nbytes
+                else:
+                    df_chunk = to_pandas(batch)
+                    write_chunk(df_chunk, engine, write_table, if_exists='append', method=load_method)
+                    nbytes = int(df_chunk.memory_usage(deep=True).sum())
+                batcher.observe(batch.num_rows, nbytes, time.perf_counter() - written)
+                result['rows'] += batch.num_rows
+            if partitioned:
+                finish_month(engine, target_table, service, year, month, indexes)
+            if month_rollup is not None:
+                month_rollup.write(engine, rollup_table(target_table))
+            result['load'] = time.perf_counter() - start
+    finally:
+        engine.dispose()
+
+    return result
+
+
+@click.command()
+@click.option('--pg_user', default='root', help='PostgreSQL user')
+@click.option('--pg_pass', default='root', help='PostgreSQL password')
+@click.option('--pg_host', default='localhost', help='PostgreSQL host')
+@click.option('--pg_port', default=5432, type=int, help='PostgreSQL port')
+@click.option('--pg_db', default='ny_taxi', help='PostgreSQL database name')
+@click.option('--service', default='yellow', type=click.Choice(['yellow', 'green', 'fhv']), help='TLC service')
+@click.option('--from', 'start', required=True, callback=parse_month, help='First month, YYYY-MM')
+@click.option('--to', 'end', required=True, callback=parse_month, help='Last month, YYYY-MM')
+@click.option('--target_table', default=None, help='Target table name (default: <service>_taxi_data)')
+@click.option('--workers', default=4, type=int, help='Months processed in parallel')
+@click.option('--max_db_writers', default=2, type=int, help='Months allowed to write to PostgreSQL at once')
+@click.option('--load_method', default='copy', type=click.Choice(LOAD_METHODS), help='insert (to_sql), copy (COPY FROM STDIN) or arrow/adbc (COPY from Arrow, no pandas)')
+@click.option('--upsert', is_flag=True, help='Skip rows already in the table (unique_row_id MERGE, safe to rerun); loads with its own COPY, so no --load_method')
+@click.option('--memory_budget', default=None, type=int, help='MB for in-flight batches, shared by the months writing at once (default: 100000-row batches)')
+@click.option('--partitioned', is_flag=True, help='Load each month as its own partition of a table range-partitioned by pickup month (trips picked up outside it are dropped)')
+@click.option('--indexes', default='none', type=click.Choice(INDEX_MODES), help='Pickup time and PU/DO indexes: none, after (dropped for the load, built at the end) or concurrently (CREATE INDEX CONCURRENTLY, blocking nobody)')
+@click.option('--rollup', is_flag=True, help='Also maintain <target_table>_rollup: trips and fare/tip/total/distance sums by pickup date and PU/DO zone, per source file')
+@click.option('--incremental', is_flag=True, help=f'Only load months that are new or changed at the source since the last load ({MANIFEST_TABLE}); a plain table already loaded without it is refused')
+def run(pg_user, pg_pass, pg_host, pg_port, pg_db, service, start, end, target_table, workers,
+        max_db_writers, load_method, upsert, memory_budget, partitioned, indexes, rollup, incremental):
+    """Backfill a range of months in parallel with a process pool."""
+    db_url = f'postgresql://{pg_user}:{pg_pass}@{pg_host}:{pg_port}/{pg_db}'
+    target_table = target_table or f'{service}_taxi_data'
+    months = list(month_range(start, end))
+    if partitioned and upsert:
+        # a unique index on a partitioned table must include the pickup time; unique_row_id alone can't be one
+        raise click.UsageError("--partitioned cannot be combined with --upsert")
+    if upsert and click.get_current_context().get_parameter_source('load_method') is not ParameterSource.DEFAULT:
+        # the merge always COPYs its Arrow batches into a staging table
+        raise click.UsageError("--upsert cannot be combined with --load_method")
+
+    engine = create_engine(db_url)
+    if partitioned:
+        with engine.connect() as conn:
+            require_partitioned(conn, target_table)
+
+    manifest, probes = None, {}
+    if incremental:
+        # one HEAD per month; only new or changed months are downloaded
+        manifest = PgManifest(engine, target_table)
+        if not (partitioned or upsert) and not manifest.names():
+            with engine.connect() as conn:
+                loaded = inspect(conn).has_table(target_table) and conn.execute(
+                    text(f'SELECT EXISTS (SELECT FROM {quote_ident(target_table)})')).scalar()
+            if loaded:
+                # its months aren't in the manifest, so every one would look new and be appended a second time
+                raise click.ClickException(
+                    f"'{target_table}' already holds rows loaded without --incremental ({MANIFEST_TABLE} has no "
+                    f"entries for it); load it with --partitioned or --upsert, or into a new --target_table")
+        sources = {(year, month): f'{service}_tripdata_{year}-{month:02d}.parquet' for year, month in months}
+        todo, unchanged, missing = plan(manifest, [(name, prefix + name) for name in sources.values()])
+        probes = {name: probe for name, _, probe in todo}
+        if not (partitioned or upsert):
+            # appending a changed month again would duplicate it; a partition swap or a merge replaces it
+            reloads = [name for name in probes if manifest.get(name) is not None]
+            for name in reloads:
+                print(f"{name} changed at the source; skipped, as appending it again would duplicate it "
+                      f"(a --partitioned table swaps a month whole, --upsert merges it)")
+                del probes[name]
+        months = [key for key in months if sources[key] in probes]
+        print(f"{len(months)} new or changed, {len(unchanged)} unchanged, {len(missing)} not published")
+        if not months:
+            engine.dispose()
+            print("Up to date.")
+            return
+    if not partitioned and months:
+        # months are indexed as they are attached; a flat table once, after all of them
+        drop_indexes(engine, target_table, service, indexes)
+    print(f"Backfilling {len(months)} month(s) of {service} into '{target_table}' "
+          f"with {workers} worker(s), {max_db_writers} DB writer(s)...")
+
+    telemetry = Telemetry('backfill', service=service, table=target_table)
+    # batches only exist while a month holds a DB slot, so split the budget between the slots
+    month_budget = memory_budget * 1024 * 1024 / min(workers, max_db_writers) if memory_budget else None
+    db_slots = multiprocessing.BoundedSemaphore(max_db_writers)
+    results, failed = [], []
+    wall_start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(db_slots,)) as pool:
+        futures = {
+            pool.submit(load_month, service, year, month, db_url, target_table, load_method, upsert,
+                        memory_budget=month_budget, partitioned=partitioned, indexes=indexes,
+                        rollup=rollup): (year, month)
+            for year, month in months
+        }
+        for future in as_completed(futures):
+            year, month = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"{year}-{month:02d} failed: {e}")
+                failed.append(f'{year}-{month:02d}')
+                continue
+            print(f"{result['month']} loaded {result['rows']:,} rows")
+            if manifest is not None:
+                name = f'{service}_tripdata_{year}-{month:02d}.parquet'
+                manifest.put(name, result['source'], result['rows'])
+            results.append(result)
+            telemetry.record('download', result['download'], chunk=result['month'], nbytes=result['bytes'])
+            telemetry.record('wait', result['wait'], chunk=result['month'])
+            telemetry.record('load', result['load'], chunk=result['month'], rows=result['rows'])
+    if not partitioned and indexes != 'none' and months:
+        print(f"Building indexes on '{target_table}'...")
+        index_start = time.perf_counter()
+        build_indexes(engine, target_table, service, indexes)
+        telemetry.record('index', time.perf_counter() - index_start)
+    engine.dispose()
+    wall = time.perf_counter() - wall_start
+
+    print(f"\n{'month':<8} {'rows':>12} {'download':>9} {'wait':>7} {'load':>7}")
+    for r in sorted(results, key=lambda r: r['month']):
+        print(f"{r['month']:<8} {r['rows']:>12,} {r['download']:>8.1f}s {r['wait']:>6.1f}s {r['load']:>6.1f}s")
+    total_rows = sum(r['rows'] for r in results)
+    print(f"\n{total_rows:,} rows in {wall:.1f}s ({total_rows / max(wall, 1e-9):,.0f} rows/sec)")
+    telemetry.close()
+
+    if failed:
+        raise click.ClickException(f"{len(failed)} month(s) failed: {', '.join(sorted(failed))}")
+    print("Done!")
+
+
+if __name__ == '__main__':
+    run()
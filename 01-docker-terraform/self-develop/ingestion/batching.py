@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Batch sizes picked at runtime instead of a fixed 100000 rows.
+
+AdaptiveBatcher starts with a small probe batch and, after every committed
+batch, looks at what it cost: bytes per row in memory, and seconds to
+commit. The next batch is the largest that
+  * keeps COPIES batches' worth of rows under the memory budget (a batch is
+    alive as Arrow, as a DataFrame or CSV buffer, and in the driver at once),
+  * commits within max_commit_seconds, so a failed batch is cheap to redo,
+  * doesn't make writes slower: the size doubles while rows/s stays within
+    TOLERANCE of the best seen, and settles on the last size that did once
+    it falls off (bigger batches mean fewer commits, so with COPY, where the
+    cost is mostly per row, growth stops at the budget instead).
+A narrow table ends up in a few huge batches and a wide month in whatever
+fits the budget. Without a budget the batcher keeps a fixed size, as before.
+"""
+
+import pyarrow as pa
+
+
+COPIES = 3
+TOLERANCE = 0.1
+# parquet is read in steps of this many rows and regrouped to the batcher's size
+STEP = 16384
+
+
+class AdaptiveBatcher:
+    """Next batch size from the rows, bytes and commit seconds of the batches so far."""
+
+    def __init__(self, memory_budget=None, rows=100000, probe_rows=STEP, min_rows=1000,
+                 max_rows=10_000_000, max_commit_seconds=30.0):
+        self.memory_budget = memory_budget
+        self.rows = rows if memory_budget is None else probe_rows
+        self.min_rows = min_rows
+        self.max_rows = max_rows
+        self.max_commit_seconds = max_commit_seconds
+        self.bytes_per_row = None
+        self.best_rate = 0.0
+        self.last_good = None
+        self.settled = False
+
+    @property
+    def adaptive(self):
+        return self.memory_budget is not None
+
+    def observe(self, rows, nbytes, seconds):
+        """Record one committed batch: its rows, in-memory bytes and write seconds."""
+        if not self.adaptive or rows == 0:
+            return
+        per_row = nbytes / rows
+        # wider rows take effect at once, narrower ones only gradually
+        self.bytes_per_row = per_row if self.bytes_per_row is None else max(per_row, (self.bytes_per_row + per_row) / 2)
+        rate = rows / max(seconds, 1e-6)
+
+        target = self.rows
+        if not self.settled:
+            if rate >= self.best_rate * (1 - TOLERANCE):
+                self.best_rate = max(self.best_rate, rate)
+                self.last_good = rows
+                target = rows * 2
+            else:
+                self.settled = True
+                target = self.last_good
+
+        limit = min(self.max_rows,
+                    self.memory_budget / (COPIES * self.bytes_per_row),
+                    self.max_commit_seconds * rate)
+        self.rows = int(max(self.min_rows, min(target, limit)))
+
+
+def parquet_batches(parquet_file, batcher):
+    """Yield RecordBatches of a ParquetFile, each as many rows as the batcher asks for at the time."""
+    if not batcher.adaptive:
+        yield from parquet_file.iter_batches(batch_size=batcher.rows)
+        return
+
+    yield from regroup(parquet_file.iter_batches(batch_size=STEP), batcher)
+
+
+def regroup(batches, batcher):
+    """Re-cut a stream of RecordBatches (parquet steps, CSV blocks) into batches of the batcher's size."""
+    pending, rows = [], 0
+    for batch in batches:
+        pending.append(batch)
+        rows += batch.num_rows
+        while rows >= batcher.rows:
+            # cut exactly batcher.rows; the remainder (a zero-copy slice) starts the next batch
+            combined = pa.concat_batches(pending)
+            size = batcher.rows
+            yield combined.slice(0, size)
+            rest = combined.slice(size)
+            pending, rows = ([rest] if rest.num_rows else []), rest.num_rows
+    if pending:
+        yield pa.concat_batches(pending)
+
+
+def csv_chunks(reader, batcher, sizes=None):
+    """
+    Yield DataFrames from a read_csv(iterator=True) reader. `sizes` maps chunk
+    index to row count for chunks already committed, so a resumed run cuts
+    them exactly as the first run did.
+    """
+    sizes = sizes or {}
+    i = 0
+    while True:
+        try:
+            chunk = reader.get_chunk(sizes.get(i, batcher.rows))
+        except StopIteration:
+            return
+        yield chunk
+        i += 1
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+End-to-end benchmark of the ingest CLIs.
+
+Synthetic yellow and green months (bench_loader.synthetic_trips) are written
+as parquet and csv.gz under their TLC file names, served from a local HTTP
+server that honours range requests like the TLC CDN does, and loaded into
+PostgreSQL by each CLI variant below, pointed at the server through
+TLC_BASE_URL. Every variant runs in its own process; the report has wall
+time, rows/sec, the peak RSS of its largest process and the seconds per
+telemetry stage, and checks that every row landed.
+
+--output keeps the results as JSON; --baseline compares against such a file
+and fails when a variant got slower or bigger by more than --tolerance, so
+a regression shows up before a production run. The data is seeded, so the
+same --rows and --months always load the same trips.
+
+Start PostgreSQL first, e.g. `docker compose up -d pgdatabase` in self-develop/.
+"""
+
+import functools
+import io
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import click
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import create_engine, inspect, text
+
+from bench_loader import synthetic_trips
+from loader import LOAD_METHODS
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PIPELINE = os.path.join(HERE, '..', '..', 'pipeline')
+YEAR = 2021
+
+# name -> (service, script, arguments). Single-month scripts load the first
+# month (each run replaces its table); backfill loads all of them.
+VARIANTS = {
+    'pipeline-insert': ('yellow', os.path.join(PIPELINE, 'ingest_data.py'), ['--load_method', 'insert']),
+    'pipeline-copy': ('yellow', os.path.join(PIPELINE, 'ingest_data.py'), ['--load_method', 'copy']),
+    'pipeline-copy-workers': ('yellow', os.path.join(PIPELINE, 'ingest_data.py'),
+                              ['--load_method', 'copy', '--workers', '2', '--range_mb', '16']),
+    'pipeline-copy-budget': ('yellow', os.path.join(PIPELINE, 'ingest_data.py'),
+                             ['--load_method', 'copy', '--memory_budget', '256']),
+    'yellow-insert': ('yellow', 'ingest_yellow_data.py', ['--load_method', 'insert']),
+    'yellow-copy': ('yellow', 'ingest_yellow_data.py', ['--load_method', 'copy']),
+    'yellow-arrow': ('yellow', 'ingest_yellow_data.py', ['--load_method', 'arrow']),
+    'yellow-adbc': ('yellow', 'ingest_yellow_data.py', ['--load_method', 'adbc']),
+    'yellow-copy-overlap': ('yellow', 'ingest_yellow_data.py', ['--load_method', 'copy', '--overlap']),
+    'yellow-arrow-overlap': ('yellow', 'ingest_yellow_data.py', ['--load_method', 'arrow', '--overlap']),
+    'yellow-arrow-budget': ('yellow', 'ingest_yellow_data.py', ['--load_method', 'arrow', '--memory_budget', '256']),
+    'yellow-arrow-writers': ('yellow', 'ingest_yellow_data.py', ['--load_method', 'arrow', '--writers', '4']),
+    'yellow-copy-staging': ('yellow', 'ingest_yellow_data.py', ['--load_method', 'copy', '--writers', '4', '--staging']),
+    'yellow-upsert': ('yellow', 'ingest_yellow_data.py', ['--load_method', 'copy', '--upsert']),
+    'yellow-copy-indexed': ('yellow', 'ingest_yellow_data.py', ['--load_method', 'copy', '--indexes', 'after']),
+    'yellow-copy-partitioned': ('yellow', 'ingest_yellow_data.py',
+                                ['--load_method', 'copy', '--partitioned', '--indexes', 'after']),
+    'green-copy': ('green', 'ingest_green_data.py', ['--load_method', 'copy']),
+    'green-arrow': ('green', 'ingest_green_data.py', ['--load_method', 'arrow']),
+    'backfill-copy': ('yellow', 'backfill.py', ['--load_method', 'copy', '--workers', '2']),
+    'backfill-arrow': ('yellow', 'backfill.py', ['--load_method', 'arrow', '--workers', '2']),
+    'backfill-arrow-partitioned': ('yellow', 'backfill.py',
+                                   ['--load_method', 'arrow', '--workers', '2', '--partitioned', '--indexes', 'after']),
+}
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Static files with single byte-range GETs (bytes=a-b, a-, -n), enough for footer and row group fetches."""
+
+    def send_head(self):
+        match = re.fullmatch(r'bytes=(\d*)-(\d*)', self.headers.get('Range', ''))
+        path = self.translate_path(self.path)
+        if match is None or match.groups() == ('', '') or not os.path.isfile(path):
+            return super().send_head()
+
+        size = os.path.getsize(path)
+        first, last = match.groups()
+        if first:
+            start, end = int(first), min(int(last) if last else size - 1, size - 1)
+        else:
+            start, end = max(size - int(last), 0), size - 1
+        with open(path, 'rb') as f:
+            f.seek(start)
+            body = f.read(end - start + 1)
+        self.send_response(206)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        return io.BytesIO(body)
+
+    def end_headers(self):
+        self.send_header('Accept-Ranges', 'bytes')
+        super().end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(directory):
+    """Serve `directory` on a free localhost port from a background thread; returns the server."""
+    handler = functools.partial(RangeRequestHandler, directory=directory)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def generate(data_dir, services, months, rows):
+    """Write each service's months as parquet and csv.gz, skipping files already there (same seed, same data)."""
+    for service in services:
+        for i, month in enumerate(months):
+            parquet_path = os.path.join(data_dir, f'{service}_tripdata_{month}.parquet')
+            csv_path = os.path.join(data_dir, f'{service}_tripdata_{month}.csv.gz')
+            if os.path.exists(parquet_path) and os.path.exists(csv_path) \
+                    and pq.read_metadata(parquet_path).num_rows == rows:
+                continue
+            print(f"Generating {rows:,} {service} trips for {month}...")
+            df = synthetic_trips(rows, seed=i, service=service, month=month)
+            pq.write_table(pa.Table.from_pandas(df, preserve_index=False), parquet_path)
+            df.to_csv(csv_path, index=False, compression='gzip', date_format='%Y-%m-%d %H:%M:%S')
+
+
+def run_cli(argv, env, cwd, log):
+    """Run one CLI to completion; returns (exit code, wall seconds, peak RSS MB of its largest process)."""
+    start = time.perf_counter()
+    child = subprocess.Popen(argv, env=env, cwd=cwd, stdout=log, stderr=subprocess.STDOUT)
+    # wait4 reports the child's own rusage, and ru_maxrss covers the children it waited for
+    _, status, usage = os.wait4(child.pid, 0)
+    child.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is reported in KB on Linux
+    return child.returncode, time.perf_counter() - start, usage.ru_maxrss / 1024
+
+
+def stage_seconds(telemetry_file):
+    """Seconds per stage summed over the summary events a run left in its telemetry file."""
+    seconds = {}
+    if not os.path.exists(telemetry_file):
+        return seconds
+    with open(telemetry_file) as f:
+        for line in f:
+            event = json.loads(line)
+            if event.get('event') == 'summary':
+                for stage, totals in event['stages'].items():
+                    seconds[stage] = round(seconds.get(stage, 0) + totals['seconds'], 3)
+    return seconds
+
+
+def count_rows(engine, table):
+    with engine.connect() as conn:
+        if not inspect(conn).has_table(table):
+            return 0
+        return conn.execute(text(f'SELECT count(*) FROM "{table}"')).scalar()
+
+
+def drop(engine, table):
+    with engine.begin() as conn:
+        conn.execute(text(f'DROP TABLE IF EXISTS "{table}"'))
+        if inspect(conn).has_table('ingest_ledger'):
+            conn.execute(text("DELETE FROM ingest_ledger WHERE target_table = :table"), {'table': table})
+
+
+def compare(results, baseline, tolerance):
+    """Lines describing each variant more than `tolerance` slower or bigger than in `baseline`."""
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        # only like for like: a different --rows or --months moves both numbers
+        if not before or result.get('failed') or before.get('failed') or before['rows'] != result['rows']:
+            continue
+        if result['rows_per_sec'] < before['rows_per_sec'] * (1 - tolerance):
+            regressions.append(f"{name}: {result['rows_per_sec']:,.0f} rows/sec, was {before['rows_per_sec']:,.0f}")
+        if result['peak_rss_mb'] > before['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(f"{name}: peak RSS {result['peak_rss_mb']:,.0f} MB, was {before['peak_rss_mb']:,.0f}")
+    return regressions
+
+
+@click.command()
+@click.option('--pg_user', default='root', help='PostgreSQL user')
+@click.option('--pg_pass', default='root', help='PostgreSQL password')
+@click.option('--pg_host', default='localhost', help='PostgreSQL host')
+@click.option('--pg_port', default=5432, type=int, help='PostgreSQL port')
+@click.option('--pg_db', default='ny_taxi', help='PostgreSQL database name')
+@click.option('--rows', default=1000000, type=int, help='Synthetic trips per month')
+@click.option('--months', default=2, type=click.IntRange(1, 12), help='Months generated per service (backfill loads all of them)')
+@click.option('--variant', 'variants', multiple=True, type=click.Choice(list(VARIANTS)), help='Variant to run, repeatable (default: all)')
+@click.option('--repeat', default=1, type=int, help='Runs per variant; the median wall time is reported')
+@click.option('--data_dir', default=None, help='Keep the generated files here and reuse them (default: a temporary directory)')
+@click.option('--output', default=None, help='Write the results to this JSON file')
+@click.option('--baseline', default=None, help='Results JSON of an earlier run to compare against')
+@click.option('--tolerance', default=0.15, type=float, help='Allowed drop in rows/sec (and growth in peak RSS) against --baseline')
+def run(pg_user, pg_pass, pg_host, pg_port, pg_db, rows, months, variants, repeat, data_dir, output, baseline, tolerance):
+    """Load synthetic TLC months through every ingest CLI and report rows/sec, peak RSS and wall time."""
+    engine = create_engine(f'postgresql://{pg_user}:{pg_pass}@{pg_host}:{pg_port}/{pg_db}')
+    selected = []
+    for name in variants or VARIANTS:
+        load_method = VARIANTS[name][2][VARIANTS[name][2].index('--load_method') + 1]
+        if load_method in LOAD_METHODS:
+            selected.append(name)
+        else:
+            print(f"Skipping {name}: the {load_method} load method is not installed")
+    variants = selected
+    month_names = [f'{YEAR}-{m:02d}' for m in range(1, months + 1)]
+    pg_args = ['--pg_user', pg_user, '--pg_pass', pg_pass, '--pg_host', pg_host,
+               '--pg_port', str(pg_port), '--pg_db', pg_db]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = data_dir or os.path.join(tmp, 'data')
+        os.makedirs(data_dir, exist_ok=True)
+        generate(data_dir, sorted({VARIANTS[name][0] for name in variants}), month_names, rows)
+
+        server = serve(data_dir)
+        env = dict(os.environ,
+                   TLC_BASE_URL=f'http://127.0.0.1:{server.server_address[1]}/',
+                   TLC_CACHE_DIR=os.path.join(tmp, 'cache'))
+
+        for name in variants:
+            service, script, args = VARIANTS[name]
+            table = 'bench_' + name.replace('-', '_')
+            if script == 'backfill.py':
+                args = args + ['--service', service, '--from', month_names[0], '--to', month_names[-1]]
+                expected = rows * months
+            else:
+                args = args + ['--year', str(YEAR), '--month', '1']
+                expected = rows
+            if script.endswith('ingest_data.py'):
+                args = args + ['--no-resume']
+            argv = [sys.executable, os.path.join(HERE, script)] + pg_args + args + ['--target_table', table]
+
+            runs = []
+            for i in range(repeat):
+                drop(engine, table)
+                telemetry_file = os.path.join(tmp, f'{name}-{i}.jsonl')
+                log_file = os.path.join(tmp, f'{name}-{i}.log')
+                with open(log_file, 'w') as log:
+                    code, wall, peak_mb = run_cli(argv, dict(env, INGEST_TELEMETRY=telemetry_file), tmp, log)
+                landed = count_rows(engine, table)
+                if code != 0 or landed != expected:
+                    with open(log_file) as log:
+                        tail = log.read()[-2000:]
+                    print(f"{name:>22}: FAILED (exit code {code}, {landed:,} of {expected:,} rows)\n{tail}")
+                    results[name] = {'failed': True, 'exit_code': code, 'rows': landed}
+                    break
+                runs.append({'wall_seconds': wall, 'peak_rss_mb': peak_mb, 'stages': stage_seconds(telemetry_file)})
+            drop(engine, table)
+            if len(runs) < repeat:
+                continue
+
+            wall = statistics.median(r['wall_seconds'] for r in runs)
+            median_run = min(runs, key=lambda r: abs(r['wall_seconds'] - wall))
+            results[name] = {
+                'rows': expected,
+                'wall_seconds': round(wall, 3),
+                'rows_per_sec': round(expected / wall, 1),
+                'peak_rss_mb': round(max(r['peak_rss_mb'] for r in runs), 1),
+                'stages': median_run['stages'],
+            }
+            print(f"{name:>22}: {expected:,} rows in {wall:.2f}s "
+                  f"({results[name]['rows_per_sec']:,.0f} rows/sec, peak RSS {results[name]['peak_rss_mb']:,.0f} MB)")
+
+        server.shutdown()
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump({'rows': rows, 'months': months, 'variants': results}, f, indent=2)
+        print(f"Results written to {output}")
+
+    failed = [name for name, result in results.items() if result.get('failed')]
+    regressions = []
+    if baseline:
+        with open(baseline) as f:
+            regressions = compare(results, json.load(f)['variants'], tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+    if failed or regressions:
+        raise click.ClickException(f"{len(failed)} variant(s) failed, {len(regressions)} regression(s)")
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Benchmark of the load methods in loader.py.
+
+Writes --rows synthetic yellow trips (synthetic_trips, also used by the
+tests and bench_ingest.py) to a parquet file, then loads it with every
+load method, each in its own process so its peak RSS is its own, and
+prints rows/sec and peak RSS per method and each speedup over `insert`.
+
+    python bench_loader.py --rows 500000
+
+Start PostgreSQL first, e.g. `docker compose up -d pgdatabase` in self-develop/.
+"""
+
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+import click
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import create_engine, text
+
+from loader import ARROW_METHODS, LOAD_METHODS, normalize_column, write_batch, write_chunk
+from schemas import SCHEMAS
+
+
+# rough shape of a 2021 month: share of pickups per hour of day (from midnight),
+# and the zones an airport fee applies to (JFK, LaGuardia)
+HOURLY = np.array([2.2, 1.4, 0.9, 0.6, 0.6, 0.9, 2.0, 3.6, 4.6, 4.7, 4.8, 5.0,
+                   5.3, 5.5, 5.8, 6.0, 6.0, 6.3, 6.6, 6.2, 5.4, 4.9, 4.4, 3.3])
+AIRPORTS = [132, 138]
+
+
+def synthetic_trips(rows, seed=42, service='yellow', month='2021-01'):
+    """
+    Build a `service` ('yellow' or 'green') trip DataFrame with `rows` random
+    rows in `month`, columns named and ordered as TLC publishes them. Pickups
+    follow the daily rush hours, durations are lognormal, fares follow the
+    meter, a handful of zones take most trips, tips go on card payments and
+    ~3% of rows have no passenger count, rate code or payment type, as in the
+    real files.
+    """
+    rng = np.random.default_rng(seed)
+    first = pd.Timestamp(f'{month}-01')
+    seconds = (rng.integers(0, first.days_in_month, rows) * 86400
+               + rng.choice(24, rows, p=HOURLY / HOURLY.sum()) * 3600
+               + rng.integers(0, 3600, rows))
+    pickup = first + pd.to_timedelta(seconds, unit='s')
+    minutes = np.clip(rng.lognormal(2.4, 0.6, rows), 1, 180)
+    mph = np.clip(rng.lognormal(2.4, 0.35, rows), 2, 60)
+    distance = (minutes / 60 * mph).round(2)
+
+    # zone popularity falls off like a power law, with the airports near the top
+    zones = np.insert(rng.permutation(np.setdiff1d(np.arange(1, 266), AIRPORTS)), [4, 9], AIRPORTS)
+    popularity = 1 / np.arange(1, 266) ** 0.7
+    popularity /= popularity.sum()
+    pickup_zone = rng.choice(zones, rows, p=popularity)
+
+    ratecode = rng.choice([1, 2, 3, 4, 5], rows, p=[0.96, 0.02, 0.005, 0.005, 0.01])
+    # $2.50 flag drop, $2.50 a mile, $0.20 a minute in traffic, in 50 cent steps; JFK is flat
+    fare = np.where(ratecode == 2, 52.0, np.round((2.5 + 2.5 * distance + 0.2 * minutes) * 2) / 2)
+    payment = rng.choice([1, 2, 3, 4], rows, p=[0.72, 0.25, 0.02, 0.01])
+    tip = np.where(payment == 1, fare * rng.choice([0.0, 0.15, 0.2, 0.25, 0.3], rows), 0.0).round(2)
+    extra = rng.choice([0.0, 0.5, 1.0, 2.5, 3.0], rows, p=[0.35, 0.3, 0.1, 0.2, 0.05])
+    mta_tax = np.where(rng.random(rows) < 0.99, 0.5, 0.0)
+    tolls = np.where(rng.random(rows) < 0.05, 6.12, 0.0)
+    improvement = np.full(rows, 0.3)
+    congestion = np.where(rng.random(rows) < (0.9 if service == 'yellow' else 0.3), 2.5 if service == 'yellow' else 2.75, 0.0)
+    airport = np.where(np.isin(pickup_zone, AIRPORTS), 1.25, 0.0)
+    total = fare + extra + mta_tax + tip + tolls + improvement + congestion
+    if service == 'yellow':
+        total = total + airport
+
+    unknown = rng.random(rows) < 0.03
+    def nullable(values):
+        return pd.Series(values).astype('Int64').mask(unknown)
+
+    prefix = 'tpep' if service == 'yellow' else 'lpep'
+    df = pd.DataFrame({
+        'VendorID': rng.choice([1, 2], rows, p=[0.3, 0.7]),
+        f'{prefix}_pickup_datetime': pickup,
+        f'{prefix}_dropoff_datetime': pickup + pd.to_timedelta(np.round(minutes * 60), unit='s'),
+        'passenger_count': nullable(rng.choice([1, 2, 3, 4, 5, 6], rows, p=[0.7, 0.15, 0.05, 0.03, 0.04, 0.03])),
+        'trip_distance': distance,
+        'RatecodeID': nullable(ratecode),
+        'store_and_fwd_flag': pd.Series(rng.choice(['N', 'Y'], rows, p=[0.99, 0.01])).mask(unknown),
+        'PULocationID': pickup_zone,
+        'DOLocationID': rng.choice(zones, rows, p=popularity),
+        'payment_type': nullable(payment),
+        'fare_amount': fare,
+        'extra': extra,
+        'mta_tax': mta_tax,
+        'tip_amount': tip,
+        'tolls_amount': tolls,
+        'improvement_surcharge': improvement,
+        'total_amount': total.round(2),
+        'congestion_surcharge': pd.Series(congestion).mask(unknown),
+        'Airport_fee': pd.Series(airport).mask(unknown),
+        'ehail_fee': np.full(rows, np.nan),
+        'trip_type': nullable(rng.choice([1, 2], rows, p=[0.97, 0.03])),
+    })
+    return df[[name for name in SCHEMAS[service] if name in df]]
+
+
+def load_parquet(db_url, parquet_path, table, method, chunksize, results):
+    """Child process body: load the file the way the ingesters do, report time and peak RSS."""
+    engine = create_engine(db_url)
+    start = time.perf_counter()
+    parquet_file = pq.ParquetFile(parquet_path)
+    for i, batch in enumerate(parquet_file.iter_batches(batch_size=chunksize)):
+        mode = 'replace' if i == 0 else 'append'
+        if method in ARROW_METHODS:
+            batch = batch.rename_columns([normalize_column(name) for name in batch.schema.names])
+            write_batch(batch, engine, table, if_exists=mode, method=method)
+        else:
+            df_chunk = batch.to_pandas()
+            df_chunk.columns = df_chunk.columns.str.replace('"', '').str.lower()
+            write_chunk(df_chunk, engine, table, if_exists=mode, method=method)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is reported in KB on Linux
+    results.put((elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+@click.command()
+@click.option('--pg_user', default='root', help='PostgreSQL user')
+@click.option('--pg_pass', default='root', help='PostgreSQL password')
+@click.option('--pg_host', default='localhost', help='PostgreSQL host')
+@click.option('--pg_port', default=5432, type=int, help='PostgreSQL port')
+@click.option('--pg_db', default='ny_taxi', help='PostgreSQL database name')
+@click.option('--rows', default=500000, type=int, help='Number of synthetic rows to load')
+@click.option('--chunksize', default=100000, type=int, help='Rows per batch')
+def run(pg_user, pg_pass, pg_host, pg_port, pg_db, rows, chunksize):
+    """Compare rows/sec and peak memory of each load method against a local PostgreSQL."""
+    db_url = f'postgresql://{pg_user}:{pg_pass}@{pg_host}:{pg_port}/{pg_db}'
+    engine = create_engine(db_url)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        parquet_path = os.path.join(tmp, 'synthetic_trips.parquet')
+        pq.write_table(pa.Table.from_pandas(synthetic_trips(rows), preserve_index=False), parquet_path)
+
+        for method in LOAD_METHODS:
+            table = f'bench_load_{method}'
+            # one process per method so peak RSS is not polluted by the previous run
+            queue = multiprocessing.Queue()
+            child = multiprocessing.Process(target=load_parquet,
+                                            args=(db_url, parquet_path, table, method, chunksize, queue))
+            child.start()
+            child.join()
+            if child.exitcode != 0:
+                raise click.ClickException(f"{method} run failed (exit code {child.exitcode})")
+            elapsed, peak_mb = queue.get()
+            results[method] = rows / elapsed
+            print(f"{method:>8}: {rows:,} rows in {elapsed:.2f}s "
+                  f"({results[method]:,.0f} rows/sec, peak RSS {peak_mb:,.0f} MB)")
+
+            with engine.begin() as conn:
+                conn.execute(text(f'DROP TABLE IF EXISTS "{table}"'))
+
+    for method in LOAD_METHODS[1:]:
+        print(f"{method} vs insert: {results[method] / results['insert']:.1f}x")
+
+
+if __name__ == '__main__':
+    run()
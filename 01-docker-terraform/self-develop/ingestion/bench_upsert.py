@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Benchmark of upsert.py against the Kestra 04_postgres_taxi flow.
+
+Loads --months synthetic months one after another, then reruns the last
+one, once with the flow's SQL-side dedup (md5 UPDATE over staging, MERGE
+without an index) and once with the client-side upsert, printing new rows
+and rows/sec for each run. It also checks that both paths computed the
+same unique_row_id for every row.
+
+    python bench_upsert.py --rows 500000 --months 4
+
+Start PostgreSQL first, e.g. `docker compose up -d pgdatabase` in self-develop/.
+"""
+
+import time
+
+import click
+import pyarrow as pa
+from sqlalchemy import create_engine, text
+
+from bench_loader import synthetic_trips
+from loader import copy_batch, create_table, normalize_column, quote_ident
+from upsert import KEY_COLUMNS, prepare_upsert, upsert_batch
+
+
+FILENAME = 'yellow_tripdata_2021-01.parquet'
+
+
+def flow_load(engine, table, batches):
+    """The 04_postgres_taxi flow: COPY raw rows to staging, md5 UPDATE every row, MERGE (no index)."""
+    staging = table + '_staging'
+    schema = pa.schema([('unique_row_id', pa.string()), ('filename', pa.string())] + list(batches[0].schema))
+    create_table(engine, table, schema)
+    create_table(engine, staging, schema)
+    row_id = ' || '.join(f"COALESCE(CAST({quote_ident(c)} AS text), '')" for c in KEY_COLUMNS['yellow'])
+    columns = ', '.join(quote_ident(name) for name in schema.names)
+    values = ', '.join('S.' + quote_ident(name) for name in schema.names)
+
+    with engine.begin() as conn:
+        conn.execute(text(f'TRUNCATE TABLE {quote_ident(staging)}'))
+        for batch in batches:
+            copy_batch(batch, conn, staging)
+        conn.execute(text(f'UPDATE {quote_ident(staging)} SET unique_row_id = md5({row_id}), filename = :f'),
+                     {'f': FILENAME})
+        inserted = conn.execute(text(f'MERGE INTO {quote_ident(table)} AS T USING {quote_ident(staging)} AS S '
+                                     f'ON T.unique_row_id = S.unique_row_id '
+                                     f'WHEN NOT MATCHED THEN INSERT ({columns}) VALUES ({values})')).rowcount
+    return inserted
+
+
+def client_load(engine, table, batches):
+    """This repo's upsert: row keys joined in Arrow, COPY into a temp staging table, md5 + MERGE on the unique index."""
+    prepare_upsert(engine, table, batches[0].schema)
+    return sum(upsert_batch(batch, engine, table, KEY_COLUMNS['yellow'], FILENAME) for batch in batches)
+
+
+@click.command()
+@click.option('--pg_user', default='root', help='PostgreSQL user')
+@click.option('--pg_pass', default='root', help='PostgreSQL password')
+@click.option('--pg_host', default='localhost', help='PostgreSQL host')
+@click.option('--pg_port', default=5432, type=int, help='PostgreSQL port')
+@click.option('--pg_db', default='ny_taxi', help='PostgreSQL database name')
+@click.option('--rows', default=500000, type=int, help='Synthetic rows per month')
+@click.option('--months', default=4, type=int, help='Months loaded one after another before the rerun')
+@click.option('--chunksize', default=100000, type=int, help='Rows per batch')
+def run(pg_user, pg_pass, pg_host, pg_port, pg_db, rows, months, chunksize):
+    """
+    Load several months, then rerun the last one, with the Kestra flow's
+    SQL-side dedup and with the client-side upsert. The flow's MERGE has no
+    index to probe, so its cost grows with the table; the upsert's doesn't.
+    """
+    engine = create_engine(f'postgresql://{pg_user}:{pg_pass}@{pg_host}:{pg_port}/{pg_db}')
+    month_batches = []
+    for month in range(months):
+        table = pa.Table.from_pandas(synthetic_trips(rows, seed=month), preserve_index=False)
+        table = table.rename_columns([normalize_column(name) for name in table.schema.names])
+        month_batches.append(table.to_batches(max_chunksize=chunksize))
+
+    tables = {'flow': 'bench_upsert_flow', 'client': 'bench_upsert_client'}
+    with engine.begin() as conn:
+        for name in tables.values():
+            conn.execute(text(f'DROP TABLE IF EXISTS {quote_ident(name)}, {quote_ident(name + "_staging")}'))
+
+    for label, load in (('flow', flow_load), ('client', client_load)):
+        runs = [(f'month {m + 1}', batches) for m, batches in enumerate(month_batches)]
+        runs.append(('rerun', month_batches[-1]))
+        for attempt, batches in runs:
+            start = time.perf_counter()
+            inserted = load(engine, tables[label], batches)
+            elapsed = time.perf_counter() - start
+            print(f"{label:>6} {attempt:<8}: {inserted:>9,} new rows in {elapsed:6.2f}s "
+                  f"({rows / elapsed:,.0f} rows/sec)")
+
+    # both paths hash the same way, so they must agree on every unique_row_id
+    with engine.connect() as conn:
+        mismatched = conn.execute(text(
+            f'SELECT count(*) FROM {tables["flow"]} F FULL JOIN {tables["client"]} C USING (unique_row_id) '
+            f'WHERE F.unique_row_id IS NULL OR C.unique_row_id IS NULL')).scalar()
+    print(f"unique_row_id mismatches between flow and client tables: {mismatched}")
+
+    with engine.begin() as conn:
+        for name in tables.values():
+            conn.execute(text(f'DROP TABLE IF EXISTS {quote_ident(name)}, {quote_ident(name + "_staging")}'))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+On-disk cache for TLC source files, shared by the ingest and upload scripts.
+
+Blobs are stored by the sha256 of their content; a small JSON record per URL
+remembers which blob it points at along with the ETag/Last-Modified the server
+sent. A cached URL is revalidated with a conditional GET (If-None-Match /
+If-Modified-Since), so a 304 costs one round trip instead of hundreds of MB.
+When the cache grows past `max_bytes` the least recently used entries go first.
+Downloads go through fetcher.Fetcher: pooled connections, retries, and big
+files in parallel ranges; fetch_many() keeps several months downloading
+while the caller works on the first.
+
+Location and size come from TLC_CACHE_DIR (default ~/.cache/nyc_tlc) and
+TLC_CACHE_MAX_BYTES (default 10 GB).
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import requests
+
+from fetcher import RETRY_ERRORS, Fetcher
+
+
+DEFAULT_MAX_BYTES = 10 * 1024 ** 3
+DOWNLOAD_CHUNK = 1024 * 1024
+
+_shared = None
+
+
+def _source_unavailable(error):
+    # a 4xx is the source's answer (the month is gone, or not there yet), not an outage
+    if isinstance(error, requests.exceptions.HTTPError):
+        return error.response is not None and error.response.status_code >= 500
+    return isinstance(error, RETRY_ERRORS)
+
+
+class DownloadCache:
+
+    def __init__(self, root=None, max_bytes=None, timeout=30, connections=8):
+        self.root = Path(root or os.environ.get('TLC_CACHE_DIR', Path.home() / '.cache' / 'nyc_tlc'))
+        self.max_bytes = int(max_bytes or os.environ.get('TLC_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES))
+        self.fetcher = Fetcher(connections=connections, timeout=timeout)
+        self.hits = 0
+        self.misses = 0
+        for sub in ('blobs', 'meta', 'tmp'):
+            (self.root / sub).mkdir(parents=True, exist_ok=True)
+
+    def _meta_path(self, url):
+        return self.root / 'meta' / (hashlib.sha256(url.encode()).hexdigest() + '.json')
+
+    def _load_meta(self, url):
+        path = self._meta_path(url)
+        try:
+            meta = json.loads(path.read_text())
+        except (OSError, ValueError):
+            return None
+        if not (self.root / 'blobs' / meta['blob']).exists():
+            return None
+        return meta
+
+    def _save_meta(self, url, meta):
+        path = self._meta_path(url)
+        tmp = path.with_suffix(f'.{uuid.uuid4().hex}.tmp')
+        tmp.write_text(json.dumps(meta))
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _digest(path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    async def fetch_async(self, url, revalidate=True):
+        """fetch() for asyncio code; many can run at once on one cache."""
+        meta = self._load_meta(url)
+        if meta and not revalidate:
+            return self._hit(url, meta)
+
+        tmp = self.root / 'tmp' / uuid.uuid4().hex
+        try:
+            try:
+                fetched = await self.fetcher.download(url, tmp, etag=meta and meta.get('etag'),
+                                                      last_modified=meta and meta.get('last_modified'))
+            except requests.exceptions.RequestException as e:
+                if meta and _source_unavailable(e):
+                    # offline or failing source: a stale copy beats no copy
+                    return self._hit(url, meta)
+                raise
+            if fetched is None and meta:
+                return self._hit(url, meta)
+
+            # parts land out of order, so the blob is hashed once the file is whole
+            blob = await asyncio.get_running_loop().run_in_executor(None, self._digest, tmp)
+            os.replace(tmp, self.root / 'blobs' / blob)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+        self.misses += 1
+        meta = {
+            'url': url,
+            'blob': blob,
+            'size': fetched['size'],
+            'etag': fetched['etag'],
+            'last_modified': fetched['last_modified'],
+            'last_used': time.time(),
+        }
+        self._save_meta(url, meta)
+        self.evict(keep=blob)
+        return self.root / 'blobs' / blob
+
+    def fetch(self, url, revalidate=True):
+        """Return a local path holding the current content of `url`.
+
+        The returned file belongs to the cache: read it, don't delete it.
+        """
+        return asyncio.run(self.fetch_async(url, revalidate))
+
+    def version(self, url):
+        """
+        Size, etag and last_modified (as Fetcher.stat() reports them) of the
+        copy of `url` fetch() last returned, so a manifest records what was
+        actually loaded rather than an earlier HEAD; None if it isn't cached.
+        """
+        meta = self._load_meta(url)
+        return meta and {key: meta[key] for key in ('size', 'etag', 'last_modified')}
+
+    def fetch_many(self, urls, revalidate=True):
+        """
+        Yield fetch()'s path for each of `urls`, in order. All of them start
+        downloading at once, sharing the fetcher's connections, so later months
+        arrive while the caller is still busy with the first.
+        """
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        futures = [asyncio.run_coroutine_threadsafe(self.fetch_async(url, revalidate), loop) for url in urls]
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+    def _hit(self, url, meta):
+        self.hits += 1
+        meta['last_used'] = time.time()
+        self._save_meta(url, meta)
+        return self.root / 'blobs' / meta['blob']
+
+    def evict(self, keep=None):
+        """Drop least recently used entries until the blobs fit in max_bytes."""
+        entries = []
+        for path in (self.root / 'meta').glob('*.json'):
+            try:
+                entries.append((path, json.loads(path.read_text())))
+            except (OSError, ValueError):
+                path.unlink(missing_ok=True)
+        entries.sort(key=lambda entry: entry[1].get('last_used', 0))
+
+        sizes = {meta['blob']: meta['size'] for _, meta in entries}
+        total = sum(sizes.values())
+        for path, meta in entries:
+            if total <= self.max_bytes:
+                break
+            if meta['blob'] == keep:
+                continue
+            path.unlink(missing_ok=True)
+            # the same bytes can sit behind several URLs
+            if not any(other['blob'] == meta['blob'] for p, other in entries if p.exists()):
+                (self.root / 'blobs' / meta['blob']).unlink(missing_ok=True)
+                total -= sizes.pop(meta['blob'], 0)
+
+
+def shared_cache():
+    """One DownloadCache per process, created (directories, fetcher pool) on first use."""
+    global _shared
+    if _shared is None:
+        _shared = DownloadCache()
+    return _shared
+
+
+def _forget_shared():
+    # a forked worker (backfill's months) has none of the parent's fetcher threads
+    global _shared
+    _shared = None
+
+
+os.register_at_fork(after_in_child=_forget_shared)
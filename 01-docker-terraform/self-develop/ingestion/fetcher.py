@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Concurrent HTTP downloads for the TLC files.
+
+Fetcher drives downloads from asyncio: any number of files can be in flight
+at once, and a file of at least two parts that the server serves by range is
+split into part_size ranges fetched side by side and written in place into
+one preallocated file. Every request, whichever file it belongs to, goes
+through one requests.Session whose connection pool is as big as the worker
+pool running the (blocking) requests, so `connections` bounds the sockets
+open to the server and they are reused across files. A request that fails
+on the connection, times out or gets 429/5xx is retried with exponential
+backoff; a range part picks up after the bytes it already wrote.
+
+Ranges carry If-Range, so a file that changes mid-download is refetched
+whole instead of being stitched together from two versions.
+"""
+
+import asyncio
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+PART_SIZE = 32 * 1024 * 1024
+CHUNK = 1024 * 1024
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RETRY_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                requests.exceptions.ChunkedEncodingError)
+
+
+class SourceChanged(requests.exceptions.RequestException):
+    """The file changed between the probe and a range request."""
+
+
+def _retryable(error):
+    if isinstance(error, requests.exceptions.HTTPError):
+        return error.response is not None and error.response.status_code in RETRY_STATUSES
+    return isinstance(error, RETRY_ERRORS)
+
+
+class Fetcher:
+    """Pooled, retrying downloads, with big files split into parallel ranges."""
+
+    def __init__(self, connections=8, part_size=PART_SIZE, retries=4, backoff=0.5, timeout=30):
+        self.part_size = part_size
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=connections)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.pool = ThreadPoolExecutor(max_workers=connections, thread_name_prefix='fetch')
+
+    def close(self):
+        self.pool.shutdown()
+        self.session.close()
+
+    async def _retry(self, fn, *args):
+        """Run blocking fn(*args) in the pool, retrying transient failures with backoff and jitter."""
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.retries + 1):
+            try:
+                return await loop.run_in_executor(self.pool, partial(fn, *args))
+            except requests.exceptions.RequestException as e:
+                if attempt == self.retries or not _retryable(e):
+                    raise
+                await asyncio.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+    def _probe(self, url, headers):
+        response = self.session.head(url, headers=headers, allow_redirects=True, timeout=self.timeout)
+        if response.status_code in RETRY_STATUSES:
+            response.raise_for_status()
+        return response
+
+    def _get_whole(self, url, dest, headers):
+        """GET `url` into `dest`; returns the response (304 has no body written)."""
+        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+            if response.status_code == 304:
+                return response
+            response.raise_for_status()
+            with open(dest, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=CHUNK):
+                    f.write(chunk)
+        return response
+
+    def _get_part(self, url, fd, start, end, validator, progress):
+        """Write bytes [start + progress[start], end] of `url` at their offset in `fd`."""
+        offset = start + progress[start]
+        if offset > end:
+            return
+        headers = {'Range': f'bytes={offset}-{end}'}
+        if validator:
+            headers['If-Range'] = validator
+        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                # If-Range failed (the file changed) or the range was ignored
+                raise SourceChanged(f"{url} changed during the download")
+            for chunk in response.iter_content(chunk_size=CHUNK):
+                os.pwrite(fd, chunk, offset)
+                offset += len(chunk)
+                progress[start] += len(chunk)
+        if offset != end + 1:
+            raise requests.exceptions.ChunkedEncodingError(f"{url}: range {start}-{end} ended at {offset}")
+
+    async def _get_ranges(self, url, dest, size, validator):
+        parts = [(start, min(start + self.part_size, size) - 1) for start in range(0, size, self.part_size)]
+        progress = {start: 0 for start, _ in parts}
+        fd = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            # wait for every part, failed or not, before the descriptor is closed under them
+            results = await asyncio.gather(*(self._retry(self._get_part, url, fd, start, end, validator, progress)
+                                             for start, end in parts), return_exceptions=True)
+        finally:
+            os.close(fd)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    async def stat(self, url):
+        """Size, etag and last_modified of `url` from a HEAD, or None if it isn't published (403/404)."""
+        head = await self._retry(self._probe, url, {})
+        if head.status_code in (403, 404):
+            # CloudFront answers 403 for a month that isn't there yet
+            return None
+        head.raise_for_status()
+        return {'size': int(head.headers.get('Content-Length') or 0), 'etag': head.headers.get('ETag'),
+                'last_modified': head.headers.get('Last-Modified')}
+
+    async def download(self, url, dest, etag=None, last_modified=None):
+        """
+        Download `url` into `dest`. With `etag`/`last_modified` from an earlier
+        download the request is conditional: returns None (dest untouched) if
+        the file hasn't changed, else a dict of size, etag and last_modified.
+        """
+        conditional = {}
+        if etag:
+            conditional['If-None-Match'] = etag
+        if last_modified:
+            conditional['If-Modified-Since'] = last_modified
+
+        head = await self._retry(self._probe, url, conditional)
+        if head.status_code == 304:
+            return None
+        size = int(head.headers.get('Content-Length') or 0) if head.ok else 0
+        validator = head.headers.get('ETag') or head.headers.get('Last-Modified')
+        ranged = head.ok and head.headers.get('Accept-Ranges') == 'bytes' and size >= 2 * self.part_size
+
+        if ranged:
+            try:
+                await self._get_ranges(url, dest, size, validator)
+                return {'size': size, 'etag': head.headers.get('ETag'),
+                        'last_modified': head.headers.get('Last-Modified')}
+            except SourceChanged:
+                pass
+        # one stream: a small file, no ranges, no usable HEAD, or the file changed under the ranges
+        response = await self._retry(self._get_whole, url, dest, conditional)
+        if response.status_code == 304:
+            return None
+        return {'size': os.path.getsize(dest), 'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified')}
+
+    async def download_many(self, jobs):
+        """Download (url, dest) pairs concurrently; returns download()'s results in order."""
+        return await asyncio.gather(*(self.download(url, dest) for url, dest in jobs))
+
+
+def download(url, dest, **kwargs):
+    """Download one file from synchronous code; keyword arguments go to Fetcher."""
+    fetcher = Fetcher(**kwargs)
+    try:
+        return asyncio.run(fetcher.download(url, dest))
+    finally:
+        fetcher.close()
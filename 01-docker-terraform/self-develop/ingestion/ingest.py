@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+One ingest entry point for every TLC feed.
+
+`--service yellow|green|fhv|zones` picks the feed, `--source` the format it
+is read from (sources.py) and `--transform` adds hooks to the transform
+chain (transforms.py); everything after the reader is shared, so a loader
+change lands once for all feeds. ingest_yellow_data.py, ingest_green_data.py
+and ingest_zone_data.py are this command with the service fixed.
+"""
+
+import os
+import time
+from contextlib import nullcontext
+
+import click
+from click.core import ParameterSource
+import requests
+from sqlalchemy import create_engine, inspect
+
+from batching import AdaptiveBatcher
+from download_cache import shared_cache
+from fetcher import download
+from loader import ARROW_METHODS, LOAD_METHODS, write_batch, write_chunk
+from parquet_footer import read_footer, validate_schema
+from partitions import (INDEX_MODES, build_indexes, drop_indexes, ensure_parent, finish_month, month_table,
+                        require_partitioned)
+from rollups import Rollup, rollup_table
+from schemas import to_pandas
+from sources import DEFAULT_SOURCES, SOURCES
+from stages import WriterPool, load_overlapped
+from telemetry import Telemetry
+from transforms import DEFAULTS, TRANSFORMS, Feed, chain
+from upsert import KEY_COLUMNS, prepare_upsert, upsert_batch
+from zones import checksum, mark_version, table_version
+
+
+OPTIONS = [
+    click.option('--pg_user', default='root', help='PostgreSQL user'),
+    click.option('--pg_pass', default='root', help='PostgreSQL password'),
+    click.option('--pg_host', default='localhost', help='PostgreSQL host'),
+    click.option('--pg_port', default=5432, type=int, help='PostgreSQL port'),
+    click.option('--pg_db', default='ny_taxi', help='PostgreSQL database name'),
+    click.option('--year', default=2025, type=int, help='Year of the data (trip services)'),
+    click.option('--month', default=11, type=int, help='Month of the data (trip services)'),
+    click.option('--target_table', default=None, help='Target table name (default: <service>_taxi_data, or zones)'),
+    click.option('--source', default=None, type=click.Choice(list(SOURCES)), help='Format to read: parquet (TLC) or csv (the DataTalksClub mirror, csv.gz); default parquet for trips, csv for zones'),
+    click.option('--transform', 'transforms', multiple=True, help=f'Extra transform after the defaults, repeatable: {", ".join(name for name in TRANSFORMS if name not in ("normalize", "compact"))} or module:function'),
+    click.option('--load_method', default='insert', type=click.Choice(LOAD_METHODS), help='insert (to_sql), copy (COPY FROM STDIN) or arrow/adbc (COPY from Arrow, no pandas)'),
+    click.option('--overlap', is_flag=True, help='Overlap download, decode and write stages'),
+    click.option('--writers', default=None, type=int, help='Connections writing batches in parallel, round-robin, one transaction per batch (default: 4 with --overlap, else 1)'),
+    click.option('--staging', is_flag=True, help='With --writers > 1: each writer appends to an UNLOGGED table of its own, moved into the target in one transaction at the end (a failed load leaves the target untouched)'),
+    click.option('--cache/--no-cache', default=True, help='Keep the download in the local TLC cache (TLC_CACHE_DIR)'),
+    click.option('--upsert', is_flag=True, help='Skip rows already in the table (unique_row_id MERGE, safe to rerun); loads with its own COPY, so no --load_method'),
+    click.option('--memory_budget', default=None, type=int, help='MB for in-flight batches; sizes batches from measured row width and commit time (default: 100000 rows)'),
+    click.option('--partitioned', is_flag=True, help='Load the month as its own partition of a table range-partitioned by pickup month (trips picked up outside the month are dropped)'),
+    click.option('--indexes', default='none', type=click.Choice(INDEX_MODES), help='Pickup time and PU/DO indexes: none, after (dropped for the load, built at the end) or concurrently (CREATE INDEX CONCURRENTLY, blocking nobody)'),
+    click.option('--rollup', is_flag=True, help='Also maintain <target_table>_rollup: trips and fare/tip/total/distance sums by pickup date and PU/DO zone, per source file'),
+]
+
+
+def ingest_options(f):
+    """Apply the options shared by `ingest.py` and the per-service scripts."""
+    for option in reversed(OPTIONS):
+        f = option(f)
+    return f
+
+
+def ingest(service, pg_user, pg_pass, pg_host, pg_port, pg_db, year, month, target_table, source, transforms,
+           load_method, overlap, writers, staging, cache, upsert, memory_budget, partitioned, indexes, rollup=False, name='ingest'):
+    """Load one month of `service` (the whole lookup for zones) into `target_table`."""
+    trips = service != 'zones'
+    if target_table is None:
+        target_table = f'{service}_taxi_data' if trips else 'zones'
+    source = source or DEFAULT_SOURCES[service]
+    reader = SOURCES[source]
+    url = reader.url(service, year, month)
+    local_file = os.path.basename(url)
+    if partitioned and 'in_month' not in transforms:
+        # a partition holds its own month only, so reloading it can't touch any other (see partitions.py)
+        transforms = ('in_month', *transforms)
+    try:
+        transform = chain(Feed(service, year, month), transforms)
+    except (ImportError, AttributeError, ValueError) as e:
+        raise click.BadParameter(str(e), param_hint='--transform')
+    if trips:
+        telemetry = Telemetry(name, month=f'{year}-{month:02d}', table=target_table)
+    else:
+        telemetry = Telemetry(name, table=target_table)
+
+    writers = writers or (4 if overlap else 1)
+    if overlap and upsert:
+        raise click.UsageError("--upsert cannot be combined with --overlap")
+    if upsert and click.get_current_context().get_parameter_source('load_method') is not ParameterSource.DEFAULT:
+        # the merge always COPYs its Arrow batches into a staging table
+        raise click.UsageError("--upsert cannot be combined with --load_method")
+    if writers > 1 and not overlap and (upsert or memory_budget):
+        # the merge and the batcher's timings both assume one batch committed at a time
+        raise click.UsageError("--writers cannot be combined with --upsert or --memory_budget")
+    if staging and (overlap or writers == 1):
+        raise click.UsageError("--staging needs --writers > 1 (without --overlap)")
+    if overlap and memory_budget:
+        # the overlapped stages hand whole row groups to the writers
+        raise click.UsageError("--memory_budget cannot be combined with --overlap")
+    if overlap and source != 'parquet':
+        # the fetch stage streams parquet row groups
+        raise click.UsageError("--overlap needs --source parquet")
+    if partitioned and (overlap or upsert):
+        # both write the target itself; a month is only swapped in whole from its own load table
+        raise click.UsageError("--partitioned cannot be combined with --overlap or --upsert")
+    if not trips and (overlap or upsert or partitioned or indexes != 'none' or rollup):
+        raise click.UsageError("zones is a small lookup, replaced whole: no --overlap, --upsert, --partitioned, --indexes or --rollup")
+
+    if rollup:
+        # every batch leaving the transform chain is also aggregated, whichever path loads it
+        rollup = Rollup(service, os.path.basename(url))
+        load_transform = transform
+
+        def transform(batch):
+            batch = load_transform(batch)
+            rollup.add(batch)
+            return batch
+
+    if overlap:
+        engine = create_engine(f'postgresql://{pg_user}:{pg_pass}@{pg_host}:{pg_port}/{pg_db}',
+                               pool_size=writers + 1)
+        print(f"Streaming {url} into '{target_table}' with {writers} writer(s)...")
+        try:
+            # footer only: refuse a month with the wrong shape before any rows are written
+            metadata = read_footer(url)
+            validate_schema(metadata, service)
+            print(f"{metadata.num_rows:,} rows in {metadata.num_row_groups} row group(s)")
+            drop_indexes(engine, target_table, service, indexes)
+            load_overlapped(url, local_file, engine, target_table,
+                            writers=writers, load_method=load_method, telemetry=telemetry,
+                            service=service, transform=transform)
+            if indexes != 'none':
+                print(f"Building indexes on '{target_table}'...")
+                with telemetry.stage('index'):
+                    build_indexes(engine, target_table, service, indexes)
+            if rollup:
+                write_rollup(engine, target_table, rollup, telemetry)
+        except requests.exceptions.RequestException as e:
+            raise click.ClickException(f"could not download file: {e}")
+        except ValueError as e:
+            raise click.ClickException(f"invalid file: {e}")
+        finally:
+            if os.path.exists(local_file):
+                os.remove(local_file)
+
+        telemetry.close()
+        print("Done!")
+        return
+
+    print(f"Downloading {url}...")
+    try:
+        with telemetry.stage('download') as step:
+            if cache:
+                local_file = shared_cache().fetch(url)
+            else:
+                # pooled, retried, and in parallel ranges for a big month
+                download(url, local_file)
+            step['bytes'] = os.path.getsize(local_file)
+    except requests.exceptions.RequestException as e:
+        raise click.ClickException(f"could not download file: {e}")
+
+    print(f"Reading {source} file...")
+    try:
+        rows = reader.open(local_file, service)
+    except ValueError as e:
+        raise click.ClickException(f"invalid file: {e}")
+    if rows is not None:
+        print(f"{rows:,} rows")
+
+    engine = create_engine(f'postgresql://{pg_user}:{pg_pass}@{pg_host}:{pg_port}/{pg_db}',
+                           pool_size=writers + 1)
+
+    # Check if table exists
+    inspector = inspect(engine)
+    table_exists = inspector.has_table(target_table)
+
+    if not trips:
+        # the lookup is replaced whole, so only when the source (or the chain it goes through) changed
+        version = ' '.join([checksum(local_file), *transforms])
+        if table_exists:
+            with engine.connect() as conn:
+                if table_version(conn, target_table) == version:
+                    print(f"'{target_table}' already holds this lookup ({version[:19]}...), skipping.")
+                    telemetry.close()
+                    if not cache:
+                        os.remove(local_file)
+                    return
+
+    if partitioned:
+        with engine.connect() as conn:
+            require_partitioned(conn, target_table)
+        # the month is loaded into a table of its own, indexed and attached at the end
+        write_table = month_table(target_table, year, month)
+        print(f"Loading into '{write_table}', to become a partition of '{target_table}'...")
+    else:
+        write_table = target_table
+        drop_indexes(engine, target_table, service, indexes)
+        if not trips:
+            print(f"Replacing table '{target_table}'...")
+        elif table_exists:
+            print(f"Appending to existing table '{target_table}'...")
+        else:
+            print(f"Creating new table '{target_table}'...")
+
+    # a fixed 100000 rows per batch unless a memory budget lets the batcher size them
+    batcher = AdaptiveBatcher(memory_budget * 1024 * 1024 if memory_budget else None)
+    batch_num = 0
+    filtered = 0
+    # with --writers, a pool of connections writes the batches while the next ones decode
+    pool = WriterPool(engine, write_table, writers, load_method, staging, telemetry) if writers > 1 else None
+    with pool or nullcontext():
+        for batch in telemetry.iterate('decode', reader.batches(local_file, service, batcher)):
+            batch_num += 1
+
+            mode = 'append'
+            if (partitioned or not trips or not table_exists) and batch_num == 1:
+                mode = 'replace'
+
+            try:
+                with telemetry.stage('transform', chunk=batch_num, rows=batch.num_rows):
+                    # the service's defaults (lowercase names, compact types), then any --transform
+                    rows_read = batch.num_rows
+                    batch = transform(batch)
+                    filtered += rows_read - batch.num_rows
+                    df_chunk = None if upsert or load_method in ARROW_METHODS else to_pandas(batch)
+            except ValueError as e:
+                raise click.ClickException(f"invalid file: {e}")
+            nbytes = batch.nbytes if df_chunk is None else int(df_chunk.memory_usage(deep=True).sum())
+
+            start = time.perf_counter()
+            if pool is not None:
+                print(f"Queueing batch {batch_num} ({batch.num_rows:,} rows)...")
+                pool.submit(batch if df_chunk is None else df_chunk, if_exists=mode)
+            elif upsert:
+                with telemetry.stage('write', chunk=batch_num, rows=batch.num_rows):
+                    if batch_num == 1:
+                        prepare_upsert(engine, target_table, batch.schema)
+                    added = upsert_batch(batch, engine, target_table, KEY_COLUMNS[service], os.path.basename(url))
+                print(f"Merged batch {batch_num}: {added:,} new of {batch.num_rows:,} rows")
+            elif load_method in ARROW_METHODS:
+                # load straight from Arrow, no pandas frame
+                print(f"Inserting batch {batch_num} ({batch.num_rows:,} rows)...")
+                with telemetry.stage('write', chunk=batch_num, rows=batch.num_rows):
+                    write_batch(batch, engine, write_table, if_exists=mode, method=load_method)
+            else:
+                print(f"Inserting batch {batch_num} ({len(df_chunk):,} rows)...")
+                with telemetry.stage('write', chunk=batch_num, rows=len(df_chunk)):
+                    write_chunk(df_chunk, engine, write_table, if_exists=mode, method=load_method)
+            if partitioned and batch_num == 1:
+                with engine.begin() as conn:
+                    ensure_parent(conn, target_table, write_table, service)
+            if pool is None:
+                batcher.observe(batch.num_rows, nbytes, time.perf_counter() - start)
+        if pool is not None:
+            print(f"Waiting for {writers} writers...")
+            pool.close()
+
+    if filtered:
+        print(f"{filtered:,} row(s) filtered out by {', '.join(transforms)}")
+    if partitioned:
+        print(f"Attaching '{write_table}' to '{target_table}'...")
+        with telemetry.stage('attach'):
+            finish_month(engine, target_table, service, year, month, indexes)
+    elif indexes != 'none':
+        print(f"Building indexes on '{target_table}'...")
+        with telemetry.stage('index'):
+            build_indexes(engine, target_table, service, indexes)
+    if rollup:
+        write_rollup(engine, target_table, rollup, telemetry)
+    if not trips:
+        with engine.begin() as conn:
+            mark_version(conn, target_table, version)
+
+    telemetry.close()
+    print("Done!")
+
+    # Remove file (cached downloads are kept for the next run)
+    if not cache and os.path.exists(local_file):
+        os.remove(local_file)
+
+
+def write_rollup(engine, target_table, rollup, telemetry):
+    """Replace the file's rows of the rollup table, once all of its trips are loaded."""
+    print(f"Updating '{rollup_table(target_table)}'...")
+    with telemetry.stage('rollup') as step:
+        step['rows'] = rollup.write(engine, rollup_table(target_table))
+    print(f"{step['rows']:,} rollup rows for {rollup.source_file}")
+
+
+def service_command(service, name, help):
+    """The ingest command with --service fixed, for the per-service scripts."""
+    @click.command(name=name, help=help)
+    @ingest_options
+    def command(**options):
+        ingest(service, name=name, **options)
+    return command
+
+
+@click.command()
+@click.option('--service', default='yellow', type=click.Choice(list(DEFAULTS)), help='TLC feed: yellow, green, fhv or zones (the taxi zone lookup)')
+@ingest_options
+def run(service, **options):
+    """Ingest a month of a TLC feed (or the zone lookup) into PostgreSQL database."""
+    ingest(service, **options)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Months rewritten as a Hive-partitioned Parquet dataset (the "lake").
+
+    <root>/service=yellow/year=2024/month=1/part-0.parquet
+    <root>/service=yellow/year=2024/month=1/pickup_date=2024-01-05/part-0.parquet   (by_day)
+
+Readers that understand Hive paths (BigQuery external tables, DuckDB's
+read_parquet(hive_partitioning=true), pyarrow.dataset) skip whole months or
+days from the path alone. Inside a file the rows are sorted by pickup time
+and cut into ROW_GROUP_ROWS row groups, so each row group's min/max pickup
+statistics cover a narrow window and a time filter skips most of them; the
+sort is also recorded in the footer (sorting_columns). Columns carry the
+registry's compact types, low-cardinality ones dictionary-encoded, and pages
+are zstd-compressed.
+
+year/month are the month of the source file, like TLC's file names; with
+by_day the few trips picked up outside it get pickup_date directories of
+their own under that month. Rewriting a month replaces its directory.
+
+A BigQuery external table over one service:
+
+    CREATE OR REPLACE EXTERNAL TABLE nyc_taxi.external_yellow_lake
+    WITH PARTITION COLUMNS (year INT64, month INT64)
+    OPTIONS (format = 'PARQUET',
+             uris = ['gs://<bucket>/lake/service=yellow/*'],
+             hive_partition_uri_prefix = 'gs://<bucket>/lake/service=yellow');
+"""
+
+import os
+import shutil
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from partitions import PARTITION_KEYS
+from schemas import compact
+
+
+# ~10 row groups in a big yellow month, each a few days of pickups
+ROW_GROUP_ROWS = 500_000
+COMPRESSION = 'zstd'
+# written once, read many times: a little more CPU for smaller files
+COMPRESSION_LEVEL = 6
+# Hive's name for a partition value that is null
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+
+def lake_root(root=None):
+    """`root`, else TLC_LAKE_DIR, else ./lake."""
+    return Path(root or os.environ.get('TLC_LAKE_DIR', 'lake'))
+
+
+def month_dir(service, year, month):
+    return f'service={service}/year={int(year)}/month={int(month)}'
+
+
+def partitioning(by_day=False):
+    """Typed Hive partitioning to read the lake back with: ds.dataset(lake_root(), partitioning=partitioning())."""
+    fields = [('service', pa.string()), ('year', pa.int16()), ('month', pa.int8())]
+    if by_day:
+        fields.append(('pickup_date', pa.date32()))
+    return ds.partitioning(pa.schema(fields), flavor='hive')
+
+
+def _dictionary_columns(schema):
+    # times and amounts are nearly all distinct: a dictionary would only be thrown away
+    return [field.name for field in schema
+            if not (pa.types.is_timestamp(field.type) or pa.types.is_floating(field.type))]
+
+
+def _write(table, path, sort_column, row_group_size):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    pq.write_table(table, path, row_group_size=row_group_size, compression=COMPRESSION,
+                   compression_level=COMPRESSION_LEVEL, use_dictionary=_dictionary_columns(table.schema),
+                   write_statistics=True,
+                   sorting_columns=[pq.SortingColumn(table.schema.get_field_index(sort_column))])
+
+
+def write_month(table, service, year, month, root=None, by_day=False, row_group_size=ROW_GROUP_ROWS):
+    """
+    Write one month (an Arrow Table under TLC's column names) into the lake,
+    replacing whatever that month had. Returns (object_name, local_path) for
+    each file written, object_name being its path relative to the root.
+    """
+    root = lake_root(root)
+    pickup = PARTITION_KEYS[service]
+    table = compact(table, service).sort_by([(pickup, 'ascending')])
+
+    directory = month_dir(service, year, month)
+    shutil.rmtree(root / directory, ignore_errors=True)
+    if by_day:
+        days = pc.cast(table.column(pickup), pa.date32())
+        parts = [(f'{directory}/pickup_date={day}', table.filter(pc.equal(days, day)))
+                 for day in pc.unique(days).drop_null().to_pylist()]
+        if days.null_count:
+            parts.append((f'{directory}/pickup_date={NULL_PARTITION}', table.filter(pc.is_null(days))))
+    else:
+        parts = [(directory, table)]
+
+    files = []
+    for part_dir, part in parts:
+        object_name = f'{part_dir}/part-0.parquet'
+        _write(part, root / object_name, pickup, row_group_size)
+        files.append((object_name, root / object_name))
+    return files
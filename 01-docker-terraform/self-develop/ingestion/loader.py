@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Shared write path for the ingest scripts.
+
+`insert` is the original `DataFrame.to_sql` behaviour (batched INSERTs).
+`copy` streams each chunk as CSV through `COPY ... FROM STDIN`, which is
+an order of magnitude faster on taxi-sized months.
+`arrow` does the same straight from Arrow record batches: pyarrow writes the
+CSV and builds the DDL from the schema, so no pandas frame is materialised.
+`adbc` hands the batches to the ADBC Postgres driver (binary COPY) and is
+only offered when `adbc-driver-postgresql` is installed. ADBC cannot share
+psycopg2's connection, so it writes over one of its own, kept beside each
+SQLAlchemy connection and committed (or rolled back) when that connection's
+transaction is; the two commits are not atomic with each other.
+"""
+
+import io
+from contextlib import contextmanager
+
+import pyarrow as pa
+import pyarrow.csv as pv
+from sqlalchemy import event
+
+# the ingest scripts import these from here
+from schemas import normalize_column, pg_type, quote_ident
+
+try:
+    import adbc_driver_postgresql.dbapi as adbc
+except ImportError:  # optional: pip install adbc-driver-postgresql
+    adbc = None
+
+
+ARROW_METHODS = ['arrow'] + (['adbc'] if adbc else [])
+LOAD_METHODS = ['insert', 'copy'] + ARROW_METHODS
+
+
+@contextmanager
+def dbapi_cursor(con):
+    """Yield a psycopg2 cursor for an SQLAlchemy Engine or Connection.
+
+    For an Engine a fresh raw connection is checked out and committed;
+    for a Connection the caller owns the transaction.
+    """
+    if hasattr(con, 'raw_connection'):
+        raw = con.raw_connection()
+        try:
+            with raw.cursor() as cur:
+                yield cur
+            raw.commit()
+        except Exception:
+            raw.rollback()
+            raise
+        finally:
+            raw.close()
+    else:
+        with con.connection.cursor() as cur:
+            yield cur
+
+
+def copy_frame(df, con, table_name):
+    """COPY the rows of `df` into an existing table, matching columns by name."""
+    buf = io.StringIO()
+    df.to_csv(buf, header=False, index=False)
+    buf.seek(0)
+
+    columns = ', '.join(quote_ident(c) for c in df.columns)
+    statement = f'COPY {quote_ident(table_name)} ({columns}) FROM STDIN WITH (FORMAT csv)'
+    with dbapi_cursor(con) as cur:
+        cur.copy_expert(statement, buf)
+
+
+def create_table(con, table_name, schema, if_exists='append'):
+    """CREATE TABLE from an Arrow schema; `replace` drops any existing table first."""
+    columns = ', '.join(f'{quote_ident(field.name)} {pg_type(field.type)}' for field in schema)
+    with dbapi_cursor(con) as cur:
+        if if_exists == 'replace':
+            cur.execute(f'DROP TABLE IF EXISTS {quote_ident(table_name)}')
+        cur.execute(f'CREATE TABLE IF NOT EXISTS {quote_ident(table_name)} ({columns})')
+
+
+def copy_batch(batch, con, table_name):
+    """COPY an Arrow RecordBatch (or Table) into an existing table via pyarrow's CSV writer."""
+    sink = pa.BufferOutputStream()
+    pv.write_csv(batch, sink, pv.WriteOptions(include_header=False))
+
+    columns = ', '.join(quote_ident(name) for name in batch.schema.names)
+    statement = f'COPY {quote_ident(table_name)} ({columns}) FROM STDIN WITH (FORMAT csv)'
+    with dbapi_cursor(con) as cur:
+        cur.copy_expert(statement, pa.BufferReader(sink.getvalue()))
+
+
+def _adbc_commit(con):
+    if 'adbc' in con.info:
+        con.info['adbc'].commit()
+
+
+def _adbc_rollback(con):
+    if 'adbc' in con.info:
+        con.info['adbc'].rollback()
+
+
+def _adbc_reset(dbapi_connection, record, reset_state):
+    # back in the pool: whatever was never committed goes
+    if 'adbc' in record.info:
+        record.info['adbc'].rollback()
+
+
+def _adbc_close(dbapi_connection, record):
+    if 'adbc' in record.info:
+        record.info.pop('adbc').close()
+
+
+def adbc_connection(con):
+    """
+    The ADBC connection kept beside SQLAlchemy Connection `con`: opened from
+    the engine URL on first use, committed and rolled back with `con`'s
+    transactions, and closed with the pooled connection it belongs to.
+    """
+    if 'adbc' not in con.info:
+        url = con.engine.url.set(drivername='postgresql').render_as_string(hide_password=False)
+        con.info['adbc'] = adbc.connect(url)
+        if not event.contains(con.engine.pool, 'close', _adbc_close):
+            event.listen(con.engine.pool, 'reset', _adbc_reset)
+            event.listen(con.engine.pool, 'close', _adbc_close)
+    if not event.contains(con, 'commit', _adbc_commit):
+        event.listen(con, 'commit', _adbc_commit)
+        event.listen(con, 'rollback', _adbc_rollback)
+    return con.info['adbc']
+
+
+def adbc_ingest(batch, con, table_name, if_exists='append'):
+    """
+    Bulk load through the ADBC driver. For an Engine a connection is opened
+    and committed here; for a Connection the rows commit with its transaction.
+    """
+    mode = 'replace' if if_exists == 'replace' else 'create_append'
+    if hasattr(con, 'raw_connection'):
+        url = con.engine.url.set(drivername='postgresql').render_as_string(hide_password=False)
+        with adbc.connect(url) as conn:
+            with conn.cursor() as cur:
+                cur.adbc_ingest(table_name, batch, mode=mode)
+            conn.commit()
+    else:
+        with adbc_connection(con).cursor() as cur:
+            cur.adbc_ingest(table_name, batch, mode=mode)
+
+
+def write_batch(batch, con, table_name, if_exists='append', method='arrow'):
+    """Write an Arrow RecordBatch without going through pandas."""
+    if method == 'arrow':
+        create_table(con, table_name, batch.schema, if_exists=if_exists)
+        copy_batch(batch, con, table_name)
+    elif method == 'adbc' and adbc is not None:
+        adbc_ingest(batch, con, table_name, if_exists=if_exists)
+    else:
+        raise ValueError(f"Unknown arrow load method '{method}', expected one of {ARROW_METHODS}")
+
+
+def write_chunk(df, con, table_name, if_exists='append', method='insert'):
+    """Write one chunk to `table_name` using the selected load method."""
+    if method in ARROW_METHODS:
+        write_batch(pa.RecordBatch.from_pandas(df, preserve_index=False), con, table_name,
+                    if_exists=if_exists, method=method)
+    elif method == 'insert':
+        df.to_sql(name=table_name, con=con, if_exists=if_exists, index=False)
+    elif method == 'copy':
+        # let pandas own the DDL (create/replace), then bulk load the rows
+        df.head(0).to_sql(name=table_name, con=con, if_exists=if_exists, index=False)
+        copy_frame(df, con, table_name)
+    else:
+        raise ValueError(f"Unknown load method '{method}', expected one of {LOAD_METHODS}")
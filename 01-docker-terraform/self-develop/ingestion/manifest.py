@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Manifests of what has been synced, for incremental runs.
+
+Each destination keeps one entry per source file: the size, ETag and
+Last-Modified the source had when it was loaded, and the rows it held. An
+incremental run HEADs every month it covers (all at once, over the
+fetcher's pooled connections) and transfers only the ones whose entry is
+missing or no longer matches; unchanged months cost one HEAD each and
+months not yet published are skipped.
+
+PgManifest keeps the entries in a table next to the data it describes;
+JsonManifest keeps them as one JSON document wherever its load/save
+callables point (a local file, a GCS object).
+"""
+
+import asyncio
+import json
+from pathlib import Path
+
+from sqlalchemy import text
+
+from fetcher import Fetcher
+
+
+MANIFEST_TABLE = 'sync_manifest'
+
+
+def changed(entry, probe):
+    """True unless `entry` was loaded from the same version of the source that `probe` describes."""
+    if entry is None:
+        return True
+    if entry.get('etag') and probe.get('etag'):
+        return entry['etag'] != probe['etag']
+    # no ETag on one side (a plain HTTP mirror): fall back to size and date
+    return (entry.get('size'), entry.get('last_modified')) != (probe['size'], probe['last_modified'])
+
+
+def probe_all(urls, connections=8):
+    """{url: stat()} for every URL, HEADed concurrently; None for the ones not published."""
+    fetcher = Fetcher(connections=connections)
+
+    async def stat_all():
+        return await asyncio.gather(*(fetcher.stat(url) for url in urls))
+    try:
+        return dict(zip(urls, asyncio.run(stat_all())))
+    finally:
+        fetcher.close()
+
+
+def plan(manifest, sources):
+    """
+    Split (name, url) sources into (todo, unchanged, missing), probing each
+    URL. todo holds (name, url, probe) for the sources that are new or changed;
+    record a loaded one with the version its download returned, not the probe,
+    in case it was republished in between.
+    """
+    sources = list(sources)
+    probes = probe_all([url for _, url in sources])
+    todo, unchanged, missing = [], [], []
+    for name, url in sources:
+        probe = probes[url]
+        if probe is None:
+            missing.append(name)
+        elif changed(manifest.get(name), probe):
+            todo.append((name, url, probe))
+        else:
+            unchanged.append(name)
+    return todo, unchanged, missing
+
+
+class JsonManifest:
+    """Entries by source name in one JSON document; `load()` returns its text (or None), `save(text)` stores it."""
+
+    def __init__(self, load, save):
+        self._save = save
+        document = load()
+        self.entries = json.loads(document) if document else {}
+
+    @classmethod
+    def file(cls, path):
+        path = Path(path)
+        return cls(lambda: path.read_text() if path.exists() else None, path.write_text)
+
+    def get(self, name):
+        return self.entries.get(name)
+
+    def names(self):
+        return set(self.entries)
+
+    def put(self, name, probe, rows):
+        self.entries[name] = {**probe, 'rows': rows}
+        self._save(json.dumps(self.entries, indent=1, sort_keys=True))
+
+
+class PgManifest:
+    """Entries for one target table, in MANIFEST_TABLE of the same database."""
+
+    def __init__(self, engine, target_table):
+        self.engine = engine
+        self.target_table = target_table
+        with engine.begin() as conn:
+            conn.execute(text(f"""
+                CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (
+                    target_table text NOT NULL,
+                    source_file text NOT NULL,
+                    size bigint,
+                    etag text,
+                    last_modified text,
+                    rows bigint,
+                    loaded_at timestamptz NOT NULL DEFAULT now(),
+                    PRIMARY KEY (target_table, source_file)
+                )
+            """))
+
+    def get(self, name):
+        with self.engine.connect() as conn:
+            row = conn.execute(text(f'SELECT size, etag, last_modified, rows FROM {MANIFEST_TABLE} '
+                                    'WHERE target_table = :t AND source_file = :s'),
+                               {'t': self.target_table, 's': name}).mappings().first()
+        return dict(row) if row else None
+
+    def names(self):
+        """The source files recorded for this table."""
+        with self.engine.connect() as conn:
+            return set(conn.execute(text(f'SELECT source_file FROM {MANIFEST_TABLE} WHERE target_table = :t'),
+                                    {'t': self.target_table}).scalars())
+
+    def put(self, name, probe, rows):
+        with self.engine.begin() as conn:
+            conn.execute(text(f"""
+                INSERT INTO {MANIFEST_TABLE} (target_table, source_file, size, etag, last_modified, rows)
+                VALUES (:t, :s, :size, :etag, :last_modified, :rows)
+                ON CONFLICT (target_table, source_file) DO UPDATE
+                SET size = EXCLUDED.size, etag = EXCLUDED.etag, last_modified = EXCLUDED.last_modified,
+                    rows = EXCLUDED.rows, loaded_at = now()
+            """), {'t': self.target_table, 's': name, 'rows': rows, **probe})
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Footer-only parquet inspection.
+
+A parquet file ends with <footer><4-byte footer length>PAR1, and the footer
+alone holds the row count, the schema and per-row-group statistics. Everything
+here reads just that tail - from a local file, or over HTTP with a suffix
+range request - so a sanity check costs O(footer) instead of O(file).
+"""
+
+import struct
+
+import click
+import pyarrow as pa
+import pyarrow.parquet as pq
+import requests
+
+from schemas import OPTIONAL, SCHEMAS, normalize_column
+
+
+FOOTER_PROBE = 64 * 1024
+# kept while reading a full body from servers without range support
+NO_RANGE_TAIL = 1024 * 1024
+MAGIC = b'PAR1'
+
+
+def _kind(arrow_type):
+    if pa.types.is_timestamp(arrow_type):
+        return 'timestamp'
+    if pa.types.is_dictionary(arrow_type) or pa.types.is_string(arrow_type):
+        return 'string'
+    return 'number'
+
+
+# columns every month of a service must carry, by kind. TLC has widened some
+# integer columns to double over the years, so 'number' accepts either.
+EXPECTED_COLUMNS = {
+    service: {normalize_column(name): _kind(arrow_type) for name, arrow_type in SCHEMAS[service].items()
+              if normalize_column(name) not in OPTIONAL}
+    for service in ('yellow', 'green', 'fhv')
+}
+
+_KINDS = {
+    'number': lambda t: pa.types.is_integer(t) or pa.types.is_floating(t) or pa.types.is_decimal(t),
+    'timestamp': pa.types.is_timestamp,
+    'string': lambda t: (pa.types.is_string(t) or pa.types.is_large_string(t)
+                         or (pa.types.is_dictionary(t) and _KINDS['string'](t.value_type))),
+}
+
+
+def footer_from_tail(tail):
+    """Parse FileMetaData from the trailing bytes of a parquet file."""
+    if len(tail) < 8 or tail[-4:] != MAGIC:
+        raise ValueError("not a parquet file (missing PAR1 trailer)")
+    footer_len = struct.unpack('<I', tail[-8:-4])[0]
+    if footer_len + 8 > len(tail):
+        raise ValueError(f"need {footer_len + 8} trailing bytes for the footer, got {len(tail)}")
+    return pq.read_metadata(pa.BufferReader(tail[-(footer_len + 8):]))
+
+
+def _http_tail(url, nbytes, session, timeout):
+    """Last `nbytes` of a remote file; falls back to streaming the body when ranges are ignored."""
+    r = session.get(url, headers={'Range': f'bytes=-{nbytes}'}, stream=True, timeout=timeout)
+    with r:
+        r.raise_for_status()
+        if r.status_code == 206:
+            return r.content
+        tail = b''
+        for chunk in r.iter_content(chunk_size=FOOTER_PROBE):
+            tail = (tail + chunk)[-max(nbytes, NO_RANGE_TAIL):]
+        return tail
+
+
+def read_footer(source, session=None, timeout=30):
+    """
+    FileMetaData for a local path or an http(s) URL. Only the footer is read:
+    remote files cost one range request, two if the footer is bigger than
+    FOOTER_PROBE.
+    """
+    source = str(source)
+    if not source.startswith(('http://', 'https://')):
+        return pq.read_metadata(source)
+
+    session = session or requests.Session()
+    tail = _http_tail(source, FOOTER_PROBE, session, timeout)
+    if len(tail) >= 8 and tail[-4:] == MAGIC:
+        footer_len = struct.unpack('<I', tail[-8:-4])[0]
+        if footer_len + 8 > len(tail):
+            tail = _http_tail(source, footer_len + 8, session, timeout)
+    return footer_from_tail(tail)
+
+
+def row_group_stats(metadata, column):
+    """Per row group: rows, bytes and the column's min/max/null count (None when not written)."""
+    names = [normalize_column(metadata.schema.column(i).name) for i in range(metadata.num_columns)]
+    index = names.index(normalize_column(column))
+
+    stats = []
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        chunk = row_group.column(index).statistics
+        has_min_max = chunk is not None and chunk.has_min_max
+        stats.append({
+            'rows': row_group.num_rows,
+            'bytes': row_group.total_byte_size,
+            'min': chunk.min if has_min_max else None,
+            'max': chunk.max if has_min_max else None,
+            'nulls': chunk.null_count if chunk is not None and chunk.has_null_count else None,
+        })
+    return stats
+
+
+def schema_problems(metadata, service):
+    """
+    List of human-readable differences between the file and
+    EXPECTED_COLUMNS[service]; `metadata` is a parquet footer, or the Arrow
+    schema of another source (a CSV reader's).
+    """
+    schema = metadata if isinstance(metadata, pa.Schema) else metadata.schema.to_arrow_schema()
+    actual = {normalize_column(field.name): field.type for field in schema}
+
+    problems = []
+    for name, kind in EXPECTED_COLUMNS[service].items():
+        if name not in actual:
+            problems.append(f"missing column {name}")
+        elif not _KINDS[kind](actual[name]):
+            problems.append(f"{name} is {actual[name]}, expected {kind}")
+    return problems
+
+
+def validate_schema(metadata, service):
+    """Raise ValueError if the file does not look like a `service` trip file."""
+    problems = schema_problems(metadata, service)
+    if problems:
+        raise ValueError(f"unexpected {service} schema: " + '; '.join(problems))
+
+
+@click.command()
+@click.argument('source')
+@click.option('--service', default=None, type=click.Choice(sorted(EXPECTED_COLUMNS)), help='Validate against this TLC service schema')
+@click.option('--column', default=None, help='Print per-row-group statistics for this column')
+def run(source, service, column):
+    """Print row count, row groups and schema of a parquet file (path or URL) from its footer."""
+    metadata = read_footer(source)
+    print(f"{metadata.num_rows:,} rows in {metadata.num_row_groups} row group(s), "
+          f"{metadata.num_columns} columns, footer {metadata.serialized_size:,} bytes")
+    print(metadata.schema.to_arrow_schema())
+
+    if column:
+        for i, stats in enumerate(row_group_stats(metadata, column)):
+            print(f"  row group {i}: {stats['rows']:,} rows, {stats['bytes']:,} bytes, "
+                  f"min={stats['min']} max={stats['max']} nulls={stats['nulls']}")
+
+    if service:
+        problems = schema_problems(metadata, service)
+        if problems:
+            raise click.ClickException(f"unexpected {service} schema: " + '; '.join(problems))
+        print(f"Schema matches {service}")
+
+
+if __name__ == '__main__':
+    run()
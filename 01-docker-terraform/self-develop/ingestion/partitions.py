@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Month partitions and post-load indexes for the trip tables.
+
+With --partitioned the target is a parent table PARTITION BY RANGE on the
+pickup time, one partition per month. A month is loaded into a standalone
+<table>_<YYYY>_<MM>_load table with no indexes, and finish_month() then
+builds that table's indexes and, in one transaction, swaps it in as the
+month's partition: the previous partition is dropped and the table is
+ATTACHed. Date-range queries only scan the months they touch.
+
+Every TLC month carries a few trips dated outside it (years off, sometimes).
+With --partitioned those are dropped (the in_month transform), so each
+partition holds exactly the in-month trips of its own month's file and
+nothing else does. Reloading a month therefore replaces its partition and
+leaves every other month as it was: the swap is idempotent.
+
+Indexes (pickup time, PU/DO pair) are never maintained row by row during a
+load. On a flat table `after` drops them before the load and builds them at
+the end in one transaction; `concurrently` uses DROP/CREATE INDEX
+CONCURRENTLY instead, so readers and other loaders are never blocked (one
+index at a time: two concurrent builds on one table would deadlock). On a
+partitioned table the month's indexes are built side by side on its load
+table, which nobody else can see, before it is attached; the parent's
+indexes then adopt them.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import click
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from sqlalchemy import inspect, text
+
+from schemas import normalize_column, quote_ident
+
+
+PARTITION_KEYS = {
+    'yellow': 'tpep_pickup_datetime',
+    'green': 'lpep_pickup_datetime',
+    'fhv': 'pickup_datetime',
+}
+
+# what downstream queries filter and join on
+INDEXED = {
+    'yellow': [('tpep_pickup_datetime',), ('pulocationid', 'dolocationid')],
+    'green': [('lpep_pickup_datetime',), ('pulocationid', 'dolocationid')],
+    'fhv': [('pickup_datetime',), ('pulocationid', 'dolocationid')],
+}
+
+INDEX_MODES = ['none', 'after', 'concurrently']
+
+
+def month_bounds(year, month):
+    """[start, end) of a month as datetimes."""
+    start = datetime(year, month, 1)
+    return start, datetime(year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(table, year, month):
+    return f'{table}_{year}_{month:02d}'
+
+
+def month_table(table, year, month):
+    """Standalone table a month is loaded into before it becomes a partition."""
+    return partition_name(table, year, month) + '_load'
+
+
+def split_month(data, key, year, month):
+    """(rows with `key` inside the month, the rest) of an Arrow batch or a DataFrame; null keys are the rest."""
+    start, end = month_bounds(year, month)
+    if isinstance(data, pd.DataFrame):
+        inside = (data[key] >= start) & (data[key] < end)
+        return data[inside], data[~inside]
+    column = data.column(key)
+    inside = pc.and_(pc.greater_equal(column, pa.scalar(start, column.type)),
+                     pc.less(column, pa.scalar(end, column.type)))
+    inside = pc.fill_null(inside, False)
+    return data.filter(inside), data.filter(pc.invert(inside))
+
+
+def _columns(conn, table):
+    """Column names of `table` by lowercase name (the pipeline keeps TLC's mixed case)."""
+    return {normalize_column(column['name']): column['name'] for column in inspect(conn).get_columns(table)}
+
+
+def _lock(conn, table):
+    # months load in parallel (backfill); serialise DDL on the parent between them
+    conn.execute(text('SELECT pg_advisory_xact_lock(hashtext(:t))'), {'t': table})
+
+
+def is_partitioned(conn, table):
+    return conn.execute(text('SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:t))'),
+                        {'t': quote_ident(table)}).scalar()
+
+
+def require_partitioned(conn, table):
+    """Raise a ClickException if `table` exists and is not partitioned; returns whether it exists."""
+    if not inspect(conn).has_table(table):
+        return False
+    if not is_partitioned(conn, table):
+        raise click.ClickException(f"'{table}' exists and is not partitioned; drop it or load without --partitioned")
+    return True
+
+
+def ensure_parent(conn, table, template, service):
+    """
+    Create `table` partitioned by pickup month, with the columns of
+    `template` (the first month's load table, so each load method keeps its
+    own DDL). Raises require_partitioned()'s error if `table` exists unpartitioned.
+    """
+    _lock(conn, table)
+    if require_partitioned(conn, table):
+        return
+    key = _columns(conn, template)[PARTITION_KEYS[service]]
+    conn.execute(text(f'CREATE TABLE {quote_ident(table)} (LIKE {quote_ident(template)}) '
+                      f'PARTITION BY RANGE ({quote_ident(key)})'))
+
+
+def _index_statements(conn, table, service, name_prefix, concurrently=False):
+    """CREATE INDEX for each index of `service` on `table`, named <name_prefix>_<columns>_idx."""
+    columns = _columns(conn, table)
+    statements = []
+    for indexed in INDEXED[service]:
+        name = f'{name_prefix}_{"_".join(indexed)}_idx'
+        statements.append(f'CREATE INDEX {"CONCURRENTLY " if concurrently else ""}IF NOT EXISTS {quote_ident(name)} '
+                          f'ON {quote_ident(table)} ({", ".join(quote_ident(columns[c]) for c in indexed)})')
+    return statements
+
+
+def _execute(engine, statements, how='transaction'):
+    """Run DDL statements in one transaction, one by one in autocommit (CONCURRENTLY), or side by side."""
+    if how == 'transaction':
+        with engine.begin() as conn:
+            for statement in statements:
+                conn.execute(text(statement))
+        return
+
+    def run(statement):
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.execute(text(statement))
+    if how == 'autocommit':
+        for statement in statements:
+            run(statement)
+    else:
+        # one connection per statement; plain CREATE INDEX builds share the table's lock
+        with ThreadPoolExecutor(max_workers=len(statements)) as pool:
+            list(pool.map(run, statements))
+
+
+def drop_indexes(engine, table, service, indexes):
+    """Drop the indexes build_indexes() makes on a flat `table`, ahead of a load."""
+    if indexes == 'none' or not inspect(engine).has_table(table):
+        return
+    names = [f'{table}_{"_".join(indexed)}_idx' for indexed in INDEXED[service]]
+    concurrently = 'CONCURRENTLY ' if indexes == 'concurrently' else ''
+    _execute(engine, [f'DROP INDEX {concurrently}IF EXISTS {quote_ident(name)}' for name in names],
+             'autocommit' if concurrently else 'transaction')
+
+
+def build_indexes(engine, table, service, indexes):
+    """Build the indexes of `service` on a flat `table`: in one transaction, or concurrently."""
+    if indexes == 'none':
+        return
+    concurrently = indexes == 'concurrently'
+    with engine.connect() as conn:
+        statements = _index_statements(conn, table, service, table, concurrently)
+    _execute(engine, statements, 'autocommit' if concurrently else 'transaction')
+
+
+def finish_month(engine, table, service, year, month, indexes='none'):
+    """
+    Index the month's load table and swap it in as the partition of `table`
+    for that month. Does nothing if there is no load table (already attached).
+    """
+    staging, partition = month_table(table, year, month), partition_name(table, year, month)
+    if not inspect(engine).has_table(staging):
+        return
+    if indexes != 'none':
+        with engine.connect() as conn:
+            statements = _index_statements(conn, staging, service, staging)
+        _execute(engine, statements, 'parallel')
+
+    start, end = month_bounds(year, month)
+    with engine.begin() as conn:
+        _lock(conn, table)
+        # only the previous load of this month is in there: dropping it loses nothing else
+        conn.execute(text(f'DROP TABLE IF EXISTS {quote_ident(partition)}'))
+        # indexes keep their names through a table rename; ours and pandas' ix_<table>_index carry the table's
+        for (name,) in conn.execute(text('SELECT indexname FROM pg_indexes WHERE tablename = :t'), {'t': staging}):
+            if staging in name:
+                conn.execute(text(f'ALTER INDEX {quote_ident(name)} '
+                                  f'RENAME TO {quote_ident(name.replace(staging, partition))}'))
+        conn.execute(text(f'ALTER TABLE {quote_ident(staging)} RENAME TO {quote_ident(partition)}'))
+        conn.execute(text(f"ALTER TABLE {quote_ident(table)} ATTACH PARTITION {quote_ident(partition)} "
+                          f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"))
+        if indexes != 'none':
+            # adopts the partitions' matching indexes; only ones still lacking them are built
+            for statement in _index_statements(conn, table, service, table):
+                conn.execute(text(statement))
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Trips pre-aggregated by pickup date x pickup zone x dropoff zone, kept up
+to date by the loaders (--rollup).
+
+While a file loads, every batch leaving the transform chain is reduced with
+Arrow's group_by to one row per (pickup_date, pulocationid, dolocationid):
+the trip count and the sums of fare, tip, total and distance. The partial
+aggregates are folded together whenever they pile up, and once the file is
+loaded they replace that file's rows of <table>_rollup in one transaction,
+so reloading a month never counts it twice. Rows are kept per source_file;
+a dashboard sums over it and reads thousands of rows, not the trip table:
+
+    SELECT pickup_date, pulocationid, sum(trips) AS trips, sum(fare_amount) AS fares
+    FROM yellow_taxi_data_rollup
+    WHERE pickup_date >= '2024-01-01'
+    GROUP BY 1, 2;
+"""
+
+import pyarrow as pa
+import pyarrow.compute as pc
+from sqlalchemy import text
+
+from loader import copy_batch, create_table, quote_ident
+from partitions import PARTITION_KEYS
+
+
+KEYS = ['pickup_date', 'pulocationid', 'dolocationid']
+# summed when the service has them (fhv has none: trips only)
+MEASURES = ['fare_amount', 'tip_amount', 'total_amount', 'trip_distance']
+# fold the partial aggregates into one once those added since the last fold hold
+# this many rows, or as many as the folded one if it's bigger
+FOLD_ROWS = 1_000_000
+
+_SUM = pc.ScalarAggregateOptions(min_count=0)
+
+
+def rollup_table(target_table):
+    return f'{target_table}_rollup'
+
+
+def _sum(table, counts):
+    """Group `table` by KEYS; `counts` is the column to sum into trips, or None to count rows."""
+    measures = [name for name in MEASURES if name in table.schema.names]
+    aggregations = [(counts, 'sum', _SUM) if counts else ([], 'count_all')]
+    aggregations += [(name, 'sum', _SUM) for name in measures]
+    grouped = table.group_by(KEYS).aggregate(aggregations)
+    # pick by name: the order group_by puts keys and aggregates in varies across pyarrow versions
+    return pa.table([grouped[name] for name in KEYS]
+                    + [grouped[f'{counts}_sum' if counts else 'count_all']]
+                    + [grouped[f'{name}_sum'] for name in measures],
+                    names=KEYS + ['trips'] + measures)
+
+
+def aggregate(batch, service):
+    """Rollup rows of one Arrow batch or Table with normalized names (the output of the transform chain)."""
+    columns = {
+        'pickup_date': pc.cast(batch.column(PARTITION_KEYS[service]), pa.date32()),
+        'pulocationid': batch.column('pulocationid'),
+        'dolocationid': batch.column('dolocationid'),
+    }
+    columns.update((name, batch.column(name)) for name in MEASURES if name in batch.schema.names)
+    return _sum(pa.table(columns), None)
+
+
+class Rollup:
+    """The rollup rows of one source file, built a batch at a time and written by write()."""
+
+    def __init__(self, service, source_file):
+        self.service = service
+        self.source_file = source_file
+        self.parts = []
+        # rows of the folded aggregate (parts[0]) and of the parts added after it
+        self.folded = 0
+        self.pending = 0
+
+    def add(self, batch):
+        part = aggregate(batch, self.service)
+        self.parts.append(part)
+        self.pending += part.num_rows
+        # a fold rereads the folded rows too: waiting until the new parts match them
+        # keeps the total work linear in the rows added, however big the file's rollup is
+        if self.pending >= max(FOLD_ROWS, self.folded):
+            self._fold()
+
+    def _fold(self):
+        if len(self.parts) > 1:
+            self.parts = [_sum(pa.concat_tables(self.parts), 'trips')]
+        self.folded = self.parts[0].num_rows if self.parts else 0
+        self.pending = 0
+
+    def result(self):
+        """The file's rollup rows, with source_file as the first column."""
+        self._fold()
+        if not self.parts:
+            return None
+        table = self.parts[0]
+        return table.add_column(0, 'source_file', pa.array([self.source_file] * table.num_rows, pa.string()))
+
+    def write(self, engine, table_name):
+        """Replace the file's rows in `table_name`; returns how many were written."""
+        table = self.result()
+        if table is None:
+            return 0
+        with engine.begin() as conn:
+            # months load in parallel (backfill); serialise creating the table between them
+            conn.execute(text('SELECT pg_advisory_xact_lock(hashtext(:t))'), {'t': table_name})
+            create_table(conn, table_name, table.schema)
+            for columns in (['source_file'], ['pickup_date', 'pulocationid']):
+                name = quote_ident(f'{table_name}_{"_".join(columns)}_idx')
+                conn.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON {quote_ident(table_name)} ({", ".join(columns)})'))
+            conn.execute(text(f'DELETE FROM {quote_ident(table_name)} WHERE source_file = :s'),
+                         {'s': self.source_file})
+            copy_batch(table, conn, table_name)
+        return table.num_rows
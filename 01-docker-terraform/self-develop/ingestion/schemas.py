@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+One schema per TLC feed, shared by every loader.
+
+SCHEMAS gives the compact Arrow type of each column a service can carry,
+keyed by the name TLC publishes it under. Everything else is derived from
+it: pandas read_csv dtypes, pyarrow CSV column types, the downcast applied
+to parquet batches, nullable pandas frames and the matching Postgres DDL.
+
+Compact means:
+  * location, vendor, rate code, payment and trip type codes, passenger
+    counts and SR flags are int16 (smallint) instead of int64/bigint
+  * Y/N flags, boroughs and base numbers are dictionary-encoded (category
+    in pandas, text in Postgres)
+  * fixed-rate surcharges are float32 (real); they never need more than the
+    six significant digits float32 holds exactly, and compact() refuses a
+    batch where that isn't so. Fares, tips, totals and trip_distance stay
+    float64: they are open-ended, and fare_amount/trip_distance feed the
+    unique_row_id md5. Postgres sums a real column in real, so cast to
+    double precision when totalling surcharges over many rows.
+
+This module has no local imports: pipeline/Dockerfile copies it (with
+batching, partitions and telemetry) into the pipeline image on its own.
+"""
+
+import click
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
+CODE = pa.int16()
+FLAG = pa.dictionary(pa.int8(), pa.string())
+LABEL = pa.dictionary(pa.int16(), pa.string())
+SURCHARGE = pa.float32()
+AMOUNT = pa.float64()
+TIMESTAMP = pa.timestamp('us')
+
+SCHEMAS = {
+    'yellow': {
+        'VendorID': CODE,
+        'tpep_pickup_datetime': TIMESTAMP,
+        'tpep_dropoff_datetime': TIMESTAMP,
+        'passenger_count': CODE,
+        'trip_distance': AMOUNT,
+        'RatecodeID': CODE,
+        'store_and_fwd_flag': FLAG,
+        'PULocationID': CODE,
+        'DOLocationID': CODE,
+        'payment_type': CODE,
+        'fare_amount': AMOUNT,
+        'extra': SURCHARGE,
+        'mta_tax': SURCHARGE,
+        'tip_amount': AMOUNT,
+        'tolls_amount': AMOUNT,
+        'improvement_surcharge': SURCHARGE,
+        'total_amount': AMOUNT,
+        'congestion_surcharge': SURCHARGE,
+        'Airport_fee': SURCHARGE,
+        'cbd_congestion_fee': SURCHARGE,
+    },
+    'green': {
+        'VendorID': CODE,
+        'lpep_pickup_datetime': TIMESTAMP,
+        'lpep_dropoff_datetime': TIMESTAMP,
+        'store_and_fwd_flag': FLAG,
+        'RatecodeID': CODE,
+        'PULocationID': CODE,
+        'DOLocationID': CODE,
+        'passenger_count': CODE,
+        'trip_distance': AMOUNT,
+        'fare_amount': AMOUNT,
+        'extra': SURCHARGE,
+        'mta_tax': SURCHARGE,
+        'tip_amount': AMOUNT,
+        'tolls_amount': AMOUNT,
+        'ehail_fee': SURCHARGE,
+        'improvement_surcharge': SURCHARGE,
+        'total_amount': AMOUNT,
+        'payment_type': CODE,
+        'trip_type': CODE,
+        'congestion_surcharge': SURCHARGE,
+        'cbd_congestion_fee': SURCHARGE,
+    },
+    'fhv': {
+        'dispatching_base_num': LABEL,
+        'pickup_datetime': TIMESTAMP,
+        'dropOff_datetime': TIMESTAMP,
+        'PUlocationID': CODE,
+        'DOlocationID': CODE,
+        'SR_Flag': CODE,
+        'Affiliated_base_number': LABEL,
+    },
+    'zones': {
+        'LocationID': CODE,
+        'Borough': FLAG,
+        'Zone': pa.string(),
+        'service_zone': FLAG,
+    },
+}
+
+# columns only some months carry (added or dropped by TLC over the years)
+OPTIONAL = {'congestion_surcharge', 'airport_fee', 'cbd_congestion_fee', 'ehail_fee',
+            'sr_flag', 'affiliated_base_number'}
+
+# nullable pandas dtypes, so an int column with nulls doesn't turn into float64
+_NULLABLE_INTS = {
+    pa.int8(): pd.Int8Dtype(),
+    pa.int16(): pd.Int16Dtype(),
+    pa.int32(): pd.Int32Dtype(),
+    pa.int64(): pd.Int64Dtype(),
+}
+
+
+def quote_ident(name):
+    """Double-quote a Postgres identifier so mixed-case taxi columns survive."""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def normalize_column(name):
+    """Remove quotes and convert to lowercase, as the ingesters do for every feed."""
+    return name.replace('"', '').lower()
+
+
+def pg_type(arrow_type):
+    """Postgres column type for an Arrow type, matching what to_sql would pick."""
+    if pa.types.is_dictionary(arrow_type):
+        return pg_type(arrow_type.value_type)
+    if pa.types.is_boolean(arrow_type):
+        return 'boolean'
+    if pa.types.is_integer(arrow_type):
+        if arrow_type.bit_width <= 16 and pa.types.is_signed_integer(arrow_type):
+            return 'smallint'
+        if arrow_type.bit_width <= 32 and pa.types.is_signed_integer(arrow_type):
+            return 'integer'
+        return 'numeric' if arrow_type == pa.uint64() else 'bigint'
+    if pa.types.is_float32(arrow_type):
+        return 'real'
+    if pa.types.is_floating(arrow_type):
+        return 'double precision'
+    if pa.types.is_decimal(arrow_type):
+        return 'numeric'
+    if pa.types.is_timestamp(arrow_type):
+        return 'timestamp with time zone' if arrow_type.tz else 'timestamp without time zone'
+    if pa.types.is_date(arrow_type):
+        return 'date'
+    return 'text'
+
+
+def column_type(service, name):
+    """Registry type of `name` (any spelling) in `service`, or None if the registry doesn't know it."""
+    name = normalize_column(name)
+    for published, arrow_type in SCHEMAS[service].items():
+        if normalize_column(published) == name:
+            return arrow_type
+    return None
+
+
+def arrow_schema(service, normalized=True):
+    """The full compact schema of `service`, with lowercase or published column names."""
+    return pa.schema([(normalize_column(name) if normalized else name, arrow_type)
+                      for name, arrow_type in SCHEMAS[service].items()])
+
+
+def csv_dtypes(service):
+    """
+    (dtype, parse_dates) for pandas.read_csv of a TLC CSV; columns a month
+    lacks are ignored. Floats are read as float64: read_csv would round
+    surcharges into float32 unchecked, so compact_frame() narrows them.
+    """
+    dtype, parse_dates = {}, []
+    for name, arrow_type in SCHEMAS[service].items():
+        if pa.types.is_timestamp(arrow_type):
+            parse_dates.append(name)
+        elif pa.types.is_dictionary(arrow_type):
+            dtype[name] = 'category'
+        elif pa.types.is_integer(arrow_type):
+            dtype[name] = _NULLABLE_INTS[arrow_type].name
+        elif pa.types.is_floating(arrow_type):
+            dtype[name] = 'float64'
+        else:
+            dtype[name] = 'string'
+    return dtype, parse_dates
+
+
+def csv_column_types(service):
+    """
+    column_types for pyarrow's CSV reader. Floats are read wide and flags as
+    plain strings (the reader only dictionary-encodes with int32 indices);
+    compact() narrows both afterwards.
+    """
+    types = {}
+    for name, arrow_type in SCHEMAS[service].items():
+        if pa.types.is_dictionary(arrow_type):
+            arrow_type = arrow_type.value_type
+        elif pa.types.is_floating(arrow_type):
+            arrow_type = pa.float64()
+        types[name] = arrow_type
+    return types
+
+
+def _compact_type(service, field):
+    arrow_type = column_type(service, field.name)
+    if arrow_type is None or (pa.types.is_timestamp(arrow_type) and pa.types.is_timestamp(field.type)):
+        # timestamps keep their unit: it costs no space and TLC has shipped both us and ns
+        return field.type
+    return arrow_type
+
+
+def compact_schema(schema, service):
+    """`schema` with every column the registry knows switched to its compact type."""
+    return pa.schema([field.with_type(_compact_type(service, field)) for field in schema])
+
+
+def _narrow(column, arrow_type):
+    if pa.types.is_float32(arrow_type) and pa.types.is_floating(column.type) and column.type != arrow_type:
+        narrowed = pc.cast(column, arrow_type)
+        # lossless when the float32 prints exactly like the float64 it came from
+        same = pc.equal(pc.cast(narrowed, pa.string()), pc.cast(column, pa.string()))
+        # min_count=0: an all-null column (green ehail_fee) has nothing to lose
+        if not pc.all(same, min_count=0).as_py():
+            worst = pc.max(pc.abs(column)).as_py()
+            raise ValueError(f"values up to {worst} do not fit float32 exactly")
+        return narrowed
+    if pa.types.is_dictionary(column.type) and column.type != arrow_type:
+        # re-key dictionaries (e.g. int32 indices from the CSV reader) via their values
+        column = column.dictionary_decode()
+    return pc.cast(column, arrow_type)
+
+
+def compact(batch, service):
+    """
+    Downcast an Arrow RecordBatch or Table to the registry's types. Columns
+    the registry doesn't know pass through. Raises ValueError if a value
+    doesn't fit (an int16 overflow, a surcharge float32 can't hold).
+    """
+    columns = []
+    for field, column in zip(batch.schema, batch.columns):
+        arrow_type = _compact_type(service, field)
+        if column.type != arrow_type:
+            try:
+                column = _narrow(column, arrow_type)
+            except (pa.ArrowInvalid, ValueError) as e:
+                raise ValueError(f"{service} column '{field.name}': {e}") from e
+        columns.append(column)
+    return type(batch).from_arrays(columns, names=batch.schema.names)
+
+
+def compact_frame(df, service):
+    """
+    The DataFrame counterpart of compact() for chunks read with csv_dtypes():
+    float64 surcharges become float32, with the same check that no value
+    changes. Raises ValueError where one would.
+    """
+    for name in df.columns:
+        arrow_type = column_type(service, name)
+        if arrow_type is not None and pa.types.is_float32(arrow_type) and df[name].dtype == 'float64':
+            try:
+                narrowed = _narrow(pa.array(df[name], from_pandas=True), arrow_type)
+            except ValueError as e:
+                raise ValueError(f"{service} column '{name}': {e}") from e
+            df[name] = narrowed.to_numpy(zero_copy_only=False)
+    return df
+
+
+def to_pandas(batch):
+    """DataFrame of an Arrow batch that keeps small nullable ints (Int16, not float64) and categories."""
+    return batch.to_pandas(types_mapper=_NULLABLE_INTS.get)
+
+
+def create_table_sql(service, table_name, normalized=True):
+    """CREATE TABLE for the full registry schema of `service`."""
+    columns = ',\n'.join(f'    {quote_ident(field.name)} {pg_type(field.type)}'
+                         for field in arrow_schema(service, normalized=normalized))
+    return f'CREATE TABLE IF NOT EXISTS {quote_ident(table_name)} (\n{columns}\n);'
+
+
+@click.command()
+@click.argument('service', type=click.Choice(list(SCHEMAS)))
+@click.option('--table', default=None, help='Table name (default: <service>_taxi_data, or zones)')
+@click.option('--published_names', is_flag=True, help='Keep TLC column spelling (as the pipeline and zone loaders do)')
+def run(service, table, published_names):
+    """Print the Postgres DDL for a service's registry schema."""
+    if table is None:
+        table = 'zones' if service == 'zones' else f'{service}_taxi_data'
+    print(create_table_sql(service, table, normalized=not published_names))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Source readers for the ingest CLI: where a service's month is published in
+a given format, and how to read it back as Arrow RecordBatches.
+
+Every reader hands out batches under the names TLC publishes, cut to the
+batcher's size, and leaves renaming and narrowing to the transform chain
+(transforms.py). A new format is a class with url(), open() and batches()
+added to SOURCES.
+"""
+
+import os
+
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+
+from batching import parquet_batches, regroup
+from parquet_footer import EXPECTED_COLUMNS, validate_schema
+from schemas import csv_column_types
+
+
+PARQUET_URL = 'https://d37ci6vzurychx.cloudfront.net/trip-data/'
+CSV_URL = 'https://github.com/DataTalksClub/nyc-tlc-data/releases/download/'
+GZIP_MAGIC = b'\x1f\x8b'
+# CSV blocks are parsed this big, then regrouped to the batcher's size
+CSV_BLOCK = 16 * 1024 * 1024
+
+
+class ParquetSource:
+    """TLC's own parquet months (TLC_BASE_URL swaps in a mirror with the same file names)."""
+
+    def url(self, service, year, month):
+        prefix = os.environ.get('TLC_BASE_URL', PARQUET_URL)
+        return f'{prefix}{service}_tripdata_{year}-{month:02d}.parquet'
+
+    def open(self, local_file, service):
+        """Check the footer against the service's schema; returns the row count."""
+        metadata = pq.read_metadata(local_file)
+        if service in EXPECTED_COLUMNS:
+            validate_schema(metadata, service)
+        return metadata.num_rows
+
+    def batches(self, local_file, service, batcher):
+        return parquet_batches(pq.ParquetFile(local_file), batcher)
+
+
+class CsvSource:
+    """
+    The CSV copies of the DataTalksClub mirror (TLC_CSV_BASE_URL swaps in
+    another): gzipped per month, and the zone lookup as a plain CSV.
+    """
+
+    def url(self, service, year, month):
+        prefix = os.environ.get('TLC_CSV_BASE_URL', CSV_URL)
+        if service == 'zones':
+            return f'{prefix}misc/taxi_zone_lookup.csv'
+        return f'{prefix}{service}/{service}_tripdata_{year}-{month:02d}.csv.gz'
+
+    def _reader(self, local_file, service):
+        # cached files are named by digest, so look at the bytes instead of the extension
+        with open(local_file, 'rb') as f:
+            compression = 'gzip' if f.read(2) == GZIP_MAGIC else None
+        stream = pa.input_stream(local_file, compression=compression)
+        # the registry's types up front, so no month is inferred differently
+        return pv.open_csv(stream, read_options=pv.ReadOptions(block_size=CSV_BLOCK),
+                           convert_options=pv.ConvertOptions(column_types=csv_column_types(service)))
+
+    def open(self, local_file, service):
+        """Check the header against the service's schema; the row count isn't known up front (None)."""
+        if service in EXPECTED_COLUMNS:
+            reader = self._reader(local_file, service)
+            try:
+                validate_schema(reader.schema, service)
+            finally:
+                reader.close()
+        return None
+
+    def batches(self, local_file, service, batcher):
+        reader = self._reader(local_file, service)
+        try:
+            # blocks hold whatever fit in CSV_BLOCK bytes; regroup cuts exactly the rows asked for
+            yield from regroup(reader, batcher)
+        finally:
+            reader.close()
+
+
+SOURCES = {
+    'parquet': ParquetSource(),
+    'csv': CsvSource(),
+}
+
+# where each service is read from unless --source says otherwise
+DEFAULT_SOURCES = {'yellow': 'parquet', 'green': 'parquet', 'fhv': 'parquet', 'zones': 'csv'}
@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Overlapped fetch -> decode -> write pipeline for the parquet ingesters.
+
+The fetch stage reads the parquet footer with a range request, then pulls
+one row group at a time into a pre-sized local file. The decode stage turns
+each row group into batches as soon as its bytes are on disk, and
+N writer threads (one connection each) load the batches. Stages talk through
+bounded queues, so a month takes roughly as long as its slowest stage.
+
+WriterPool is the write stage on its own, for loaders that decode in their
+main loop: batches go round-robin to the writers, optionally into UNLOGGED
+staging tables moved into the target at the end.
+
+Servers without range support fall back to a full download inside the fetch
+stage; decode and write still overlap with each other.
+"""
+
+import os
+import queue
+import struct
+import threading
+import time
+
+import pyarrow.parquet as pq
+import requests
+from sqlalchemy import text
+
+from loader import ARROW_METHODS, create_table, normalize_column, quote_ident, write_batch, write_chunk
+from schemas import compact, to_pandas
+
+
+FOOTER_PROBE = 64 * 1024
+DOWNLOAD_CHUNK = 1024 * 1024
+
+_DONE = object()
+
+
+class Aborted(Exception):
+    """Raised inside a stage when another stage has failed."""
+
+
+class StageStats:
+    """
+    Counters for one stage; `busy` is time spent working, not waiting on
+    queues. Each item is also recorded to `telemetry`, whose summary reports it.
+    """
+
+    def __init__(self, name, telemetry=None):
+        self.name = name
+        self.items = 0
+        self.rows = 0
+        self.bytes = 0
+        self.busy = 0.0
+        self.telemetry = telemetry
+        self._lock = threading.Lock()
+
+    def add(self, busy, rows=0, nbytes=0):
+        with self._lock:
+            chunk = self.items
+            self.items += 1
+            self.rows += rows
+            self.bytes += nbytes
+            self.busy += busy
+        if self.telemetry is not None:
+            self.telemetry.record(self.name, busy, chunk=chunk, rows=rows, nbytes=nbytes)
+
+
+def _put(q, item, abort):
+    while not abort.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return
+        except queue.Full:
+            continue
+    raise Aborted()
+
+
+def _get(q, abort):
+    while not abort.is_set():
+        try:
+            return q.get(timeout=0.5)
+        except queue.Empty:
+            continue
+    raise Aborted()
+
+
+def row_group_span(row_group):
+    """Byte range [start, end) covering every column chunk of a row group."""
+    start, end = None, 0
+    for j in range(row_group.num_columns):
+        column = row_group.column(j)
+        offset = column.data_page_offset
+        if column.has_dictionary_page and column.dictionary_page_offset:
+            offset = min(offset, column.dictionary_page_offset)
+        start = offset if start is None else min(start, offset)
+        end = max(end, offset + column.total_compressed_size)
+    return start, end
+
+
+def _fetch_range(session, url, f, start, end, timeout):
+    """Write bytes [start, end] (inclusive) of `url` to the same offset in `f`."""
+    response = session.get(url, headers={'Range': f'bytes={start}-{end}'}, stream=True, timeout=timeout)
+    response.raise_for_status()
+    if response.status_code != 206:
+        raise requests.exceptions.RequestException(f"Server ignored range request for {url}")
+    f.seek(start)
+    nbytes = 0
+    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK):
+        f.write(chunk)
+        nbytes += len(chunk)
+    return nbytes
+
+
+def fetch_stage(url, local_file, out_q, stats, abort, timeout=30):
+    """Download `url` into `local_file`, announcing each row group once its bytes are on disk."""
+    with requests.Session() as session:
+        head = session.head(url, allow_redirects=True, timeout=timeout)
+        head.raise_for_status()
+        size = int(head.headers.get('Content-Length', 0))
+
+        if head.headers.get('Accept-Ranges') != 'bytes' or size == 0:
+            start = time.perf_counter()
+            nbytes = 0
+            response = session.get(url, stream=True, timeout=timeout)
+            response.raise_for_status()
+            with open(local_file, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK):
+                    f.write(chunk)
+                    nbytes += len(chunk)
+            stats.add(time.perf_counter() - start, nbytes=nbytes)
+            for i in range(pq.read_metadata(local_file).num_row_groups):
+                _put(out_q, i, abort)
+            return
+
+        with open(local_file, 'w+b') as f:
+            f.truncate(size)
+
+            # footer first: the last 8 bytes are <footer length><PAR1>
+            start = time.perf_counter()
+            probe = min(size, FOOTER_PROBE)
+            nbytes = _fetch_range(session, url, f, size - probe, size - 1, timeout)
+            f.seek(size - 8)
+            footer_len = struct.unpack('<I', f.read(4))[0]
+            if footer_len + 8 > probe:
+                nbytes += _fetch_range(session, url, f, size - footer_len - 8, size - probe - 1, timeout)
+            f.flush()
+            stats.add(time.perf_counter() - start, nbytes=nbytes)
+
+            metadata = pq.read_metadata(local_file)
+            for i in range(metadata.num_row_groups):
+                start = time.perf_counter()
+                rg_start, rg_end = row_group_span(metadata.row_group(i))
+                nbytes = _fetch_range(session, url, f, rg_start, rg_end - 1, timeout)
+                f.flush()
+                stats.add(time.perf_counter() - start, nbytes=nbytes)
+                _put(out_q, i, abort)
+
+
+def decode_stage(local_file, engine, target_table, in_q, out_q, batch_size, load_method, stats, abort,
+                 service=None, transform=None):
+    """
+    Decode announced row groups into normalised batches (DataFrames, or Arrow
+    for arrow methods), narrowed to the registry types of `service` if given.
+    A `transform` (see transforms.chain) replaces both steps.
+    """
+    parquet_file = None
+    created = False
+    while True:
+        item = _get(in_q, abort)
+        if item is _DONE:
+            return
+
+        if parquet_file is None:
+            parquet_file = pq.ParquetFile(local_file)
+        start = time.perf_counter()
+        table = parquet_file.read_row_group(item)
+        if transform is not None:
+            table = transform(table)
+        else:
+            table = table.rename_columns([normalize_column(name) for name in table.schema.names])
+            if service is not None:
+                table = compact(table, service)
+        if load_method in ARROW_METHODS:
+            batches = table.to_batches(max_chunksize=batch_size)
+        else:
+            batches = [to_pandas(batch) for batch in table.to_batches(max_chunksize=batch_size)]
+        stats.add(time.perf_counter() - start, rows=table.num_rows, nbytes=table.nbytes)
+
+        if not created and batches:
+            # writers only ever append, so the table must exist before the first batch
+            if load_method in ARROW_METHODS:
+                create_table(engine, target_table, table.schema)
+            else:
+                batches[0].head(0).to_sql(name=target_table, con=engine, if_exists='append', index=False)
+            created = True
+        for df_chunk in batches:
+            _put(out_q, df_chunk, abort)
+
+
+def write_stage(engine, target_table, in_q, load_method, stats, abort):
+    """Load batches over a dedicated connection, one transaction per batch."""
+    with engine.connect() as conn:
+        while True:
+            df_chunk = _get(in_q, abort)
+            if df_chunk is _DONE:
+                return
+            start = time.perf_counter()
+            with conn.begin():
+                if load_method in ARROW_METHODS:
+                    write_batch(df_chunk, conn, target_table, if_exists='append', method=load_method)
+                else:
+                    write_chunk(df_chunk, conn, target_table, if_exists='append', method=load_method)
+            stats.add(time.perf_counter() - start, rows=len(df_chunk))
+
+
+class WriterPool:
+    """
+    `writers` threads with a pooled connection each, fed batches round-robin
+    by submit(); every batch is its own transaction. With `staging` each
+    writer appends to an UNLOGGED table of its own (no WAL, no index, no
+    contention with the others) and close() moves them all into the target
+    in one transaction, so a load that fails leaves the target untouched.
+    Leaving the `with` block without close() stops the writers and drops
+    whatever was staged.
+    """
+
+    def __init__(self, engine, target_table, writers, load_method, staging=False, telemetry=None, queue_size=2):
+        self.engine = engine
+        self.target_table = target_table
+        self.load_method = load_method
+        self.staging = staging
+        self.tables = [f'{target_table}_stage_{os.getpid()}_{i}' if staging else target_table
+                       for i in range(writers)]
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(writers)]
+        self.stats = StageStats('write', telemetry)
+        self.abort = threading.Event()
+        self.errors = []
+        self.threads = []
+        self.submitted = 0
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if not self.closed:
+            self.abort.set()
+            self._join()
+            self._drop_staging()
+
+    def _run(self, i):
+        try:
+            write_stage(self.engine, self.tables[i], self.queues[i], self.load_method, self.stats, self.abort)
+        except Aborted:
+            pass
+        except Exception as e:
+            self.errors.append(e)
+            self.abort.set()
+
+    def _start(self, batch, if_exists):
+        # writers only ever append, so the tables must exist before the first batch
+        with self.engine.begin() as conn:
+            if self.load_method in ARROW_METHODS:
+                create_table(conn, self.target_table, batch.schema, if_exists=if_exists)
+            else:
+                batch.head(0).to_sql(name=self.target_table, con=conn, if_exists=if_exists, index=False)
+            if self.staging:
+                for table in self.tables:
+                    conn.execute(text(f'DROP TABLE IF EXISTS {quote_ident(table)}'))
+                    conn.execute(text(f'CREATE UNLOGGED TABLE {quote_ident(table)} '
+                                      f'(LIKE {quote_ident(self.target_table)})'))
+        self.threads = [threading.Thread(target=self._run, args=(i,), daemon=True) for i in range(len(self.queues))]
+        for t in self.threads:
+            t.start()
+
+    def _join(self):
+        for t in self.threads:
+            t.join()
+
+    def _drop_staging(self):
+        if self.staging and self.threads:
+            with self.engine.begin() as conn:
+                for table in self.tables:
+                    conn.execute(text(f'DROP TABLE IF EXISTS {quote_ident(table)}'))
+
+    def submit(self, batch, if_exists='append'):
+        """
+        Queue a batch (Arrow for arrow methods, else a DataFrame) for the next
+        writer in turn, blocking while that writer is behind. The first batch
+        creates the target first (`if_exists`). Raises a writer's error.
+        """
+        if not self.threads:
+            self._start(batch, if_exists)
+        try:
+            _put(self.queues[self.submitted % len(self.queues)], batch, self.abort)
+        except Aborted:
+            raise self.errors[0]
+        self.submitted += 1
+
+    def close(self):
+        """Wait for the writers to finish, then move any staged rows into the target."""
+        try:
+            for q in self.queues[:len(self.threads)]:
+                _put(q, _DONE, self.abort)
+        except Aborted:
+            pass
+        self._join()
+        if self.errors:
+            # leaving the with block drops the staging tables
+            raise self.errors[0]
+        if self.staging and self.threads:
+            with self.engine.begin() as conn:
+                for table in self.tables:
+                    conn.execute(text(f'INSERT INTO {quote_ident(self.target_table)} '
+                                      f'SELECT * FROM {quote_ident(table)}'))
+                    conn.execute(text(f'DROP TABLE {quote_ident(table)}'))
+        self.closed = True
+
+
+def load_overlapped(url, local_file, engine, target_table, writers=4, load_method='insert',
+                    batch_size=100000, queue_size=4, telemetry=None, service=None, transform=None):
+    """Run the three stages concurrently; each stage's items go to `telemetry`."""
+    abort = threading.Event()
+    errors = []
+    fetched = queue.Queue(maxsize=queue_size)
+    decoded = queue.Queue(maxsize=queue_size * writers)
+    stats = {name: StageStats(name, telemetry) for name in ('fetch', 'decode', 'write')}
+
+    def guarded(target, *args, done=None, copies=1):
+        def runner():
+            try:
+                target(*args)
+                if done is not None:
+                    for _ in range(copies):
+                        _put(done, _DONE, abort)
+            except Aborted:
+                pass
+            except Exception as e:
+                errors.append(e)
+                abort.set()
+        return threading.Thread(target=runner, daemon=True)
+
+    threads = [
+        guarded(fetch_stage, url, local_file, fetched, stats['fetch'], abort, done=fetched),
+        guarded(decode_stage, local_file, engine, target_table, fetched, decoded, batch_size,
+                load_method, stats['decode'], abort, service, transform, done=decoded, copies=writers),
+    ]
+    threads += [
+        guarded(write_stage, engine, target_table, decoded, load_method, stats['write'], abort)
+        for _ in range(writers)
+    ]
+
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    if errors:
+        raise errors[0]
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Run telemetry for the ingest and upload scripts.
+
+Every timed step (download, decode, transform, write, upload, ...) becomes
+one JSON line with its stage, chunk, seconds, rows, bytes and the process'
+peak RSS so far. `close()` adds a per-stage summary line, prints the same
+summary for humans and, if asked, writes a Prometheus textfile for
+node_exporter's textfile collector.
+
+Where the output goes is set by environment, so scripts need no extra flags:
+  INGEST_TELEMETRY   path to append JSON lines to ('-' for stderr)
+  INGEST_PROM_FILE   path of the .prom file to (re)write at the end
+"""
+
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+def peak_rss_mb():
+    """Peak RSS of this process or any finished child (process pools), in MB."""
+    # ru_maxrss is reported in KB on Linux
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+
+
+def _rows(item):
+    if hasattr(item, 'num_rows'):
+        return item.num_rows
+    try:
+        return len(item)
+    except TypeError:
+        return 0
+
+
+def _prom_labels(labels):
+    return '{' + ','.join(f'{k}="{v}"' for k, v in sorted(labels.items())) + '}'
+
+
+class Telemetry:
+    """Per-stage counters for one run of `job`; safe to share between threads."""
+
+    def __init__(self, job, jsonl=None, prom_file=None, **labels):
+        self.job = job
+        self.labels = labels
+        self.jsonl = jsonl if jsonl is not None else os.environ.get('INGEST_TELEMETRY')
+        self.prom_file = prom_file if prom_file is not None else os.environ.get('INGEST_PROM_FILE')
+        self.stages = {}
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def _emit(self, event):
+        if not self.jsonl:
+            return
+        line = json.dumps({'ts': round(time.time(), 3), 'job': self.job, **self.labels, **event}, default=str)
+        if self.jsonl == '-':
+            print(line, file=sys.stderr)
+        else:
+            with open(self.jsonl, 'a') as f:
+                f.write(line + '\n')
+
+    def record(self, stage, seconds, chunk=None, rows=0, nbytes=0):
+        """Add one timed step of `stage`."""
+        with self._lock:
+            totals = self.stages.setdefault(stage, {'count': 0, 'seconds': 0.0, 'rows': 0, 'bytes': 0})
+            totals['count'] += 1
+            totals['seconds'] += seconds
+            totals['rows'] += rows
+            totals['bytes'] += nbytes
+            self._emit({'event': 'stage', 'stage': stage, 'chunk': chunk, 'seconds': round(seconds, 6),
+                        'rows': rows, 'bytes': nbytes, 'peak_rss_mb': round(peak_rss_mb(), 1)})
+
+    @contextmanager
+    def stage(self, stage, chunk=None, rows=0, nbytes=0):
+        """
+        Time a block as one step of `stage`. Rows/bytes known only at the end
+        can be set on the yielded dict:
+
+            with telemetry.stage('write', chunk=i) as step:
+                step['rows'] = write(df)
+        """
+        step = {'rows': rows, 'bytes': nbytes}
+        start = time.perf_counter()
+        yield step
+        # only reached when the block succeeded; failed steps are not counted
+        self.record(stage, time.perf_counter() - start, chunk=chunk, rows=step['rows'], nbytes=step['bytes'])
+
+    def iterate(self, stage, iterable):
+        """Yield from `iterable`, timing each next() as one step of `stage` (decode loops)."""
+        iterator = iter(iterable)
+        chunk = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.record(stage, time.perf_counter() - start, chunk=chunk, rows=_rows(item))
+            yield item
+            chunk += 1
+
+    def summary(self):
+        lines = []
+        for stage, t in self.stages.items():
+            line = f"{stage:>9}: {t['count']:>4} steps, {t['seconds']:7.2f}s"
+            if t['rows']:
+                line += f", {t['rows']:,} rows ({t['rows'] / max(t['seconds'], 1e-9):,.0f} rows/s)"
+            if t['bytes']:
+                mb = t['bytes'] / 1024 / 1024
+                line += f", {mb:,.1f} MB ({mb / max(t['seconds'], 1e-9):,.1f} MB/s)"
+            lines.append(line)
+        lines.append(f"     wall: {time.perf_counter() - self.started:.2f}s, peak RSS {peak_rss_mb():,.0f} MB")
+        return '\n'.join(lines)
+
+    def write_prom(self, path):
+        """Write the totals as a Prometheus textfile; renamed into place so scrapes never see half a file."""
+        base = {'job': self.job, **self.labels}
+        metrics = [
+            ('ingest_stage_seconds_total', 'counter', 'Seconds spent in each stage', 'seconds'),
+            ('ingest_stage_rows_total', 'counter', 'Rows handled by each stage', 'rows'),
+            ('ingest_stage_bytes_total', 'counter', 'Bytes handled by each stage', 'bytes'),
+            ('ingest_stage_steps_total', 'counter', 'Chunks or files handled by each stage', 'count'),
+        ]
+        lines = []
+        for name, kind, help_text, key in metrics:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            lines += [f'{name}{_prom_labels({**base, "stage": stage})} {t[key]}' for stage, t in self.stages.items()]
+        lines += ['# HELP ingest_peak_rss_bytes Peak resident set size of the run',
+                  '# TYPE ingest_peak_rss_bytes gauge',
+                  f'ingest_peak_rss_bytes{_prom_labels(base)} {int(peak_rss_mb() * 1024 * 1024)}',
+                  '# HELP ingest_wall_seconds Wall-clock duration of the run',
+                  '# TYPE ingest_wall_seconds gauge',
+                  f'ingest_wall_seconds{_prom_labels(base)} {time.perf_counter() - self.started:.3f}',
+                  '# HELP ingest_last_run_timestamp_seconds When the run finished',
+                  '# TYPE ingest_last_run_timestamp_seconds gauge',
+                  f'ingest_last_run_timestamp_seconds{_prom_labels(base)} {time.time():.0f}']
+
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp, path)
+
+    def close(self):
+        """Emit the summary event, write the textfile if configured and print the summary."""
+        self._emit({'event': 'summary', 'wall_seconds': round(time.perf_counter() - self.started, 3),
+                    'peak_rss_mb': round(peak_rss_mb(), 1), 'stages': self.stages})
+        if self.prom_file:
+            self.write_prom(self.prom_file)
+        print(self.summary())
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+The transform chain every batch goes through between the reader and the
+writer.
+
+A transform is fn(batch, feed) -> batch: it takes an Arrow RecordBatch (or
+Table) as read, and the Feed being loaded, and returns a new one built with
+pyarrow.compute, a column at a time, never a row at a time. The chain
+starts with the service's defaults (lowercase names, then the registry's
+compact types), so the optional ones can rely on lowercase names and
+registry types. --transform adds them by name from TRANSFORMS, or as
+`module:function` for one defined elsewhere.
+"""
+
+import importlib
+from collections import namedtuple
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from partitions import PARTITION_KEYS, split_month
+from schemas import compact, normalize_column
+from zones import load_dimension
+
+
+Feed = namedtuple('Feed', ['service', 'year', 'month'])
+
+# pickup and dropoff columns after normalize
+TRIP_TIMES = {
+    'yellow': ('tpep_pickup_datetime', 'tpep_dropoff_datetime'),
+    'green': ('lpep_pickup_datetime', 'lpep_dropoff_datetime'),
+    'fhv': ('pickup_datetime', 'dropoff_datetime'),
+}
+
+
+def normalize(batch, feed):
+    """Lowercase, unquoted column names, as every trip table has."""
+    return batch.rename_columns([normalize_column(name) for name in batch.schema.names])
+
+
+def compact_types(batch, feed):
+    """The registry's compact types (int16 IDs, float32 surcharges, ...); see schemas.py."""
+    return compact(batch, feed.service)
+
+
+def trip_seconds(batch, feed):
+    """Derived: trip duration in whole seconds (int32), null where either time is."""
+    pickup, dropoff = (batch.column(name) for name in TRIP_TIMES[feed.service])
+    seconds = pc.divide(pc.cast(pc.subtract(dropoff, pickup), pa.int64()),
+                        {'s': 1, 'ms': 1000, 'us': 10 ** 6, 'ns': 10 ** 9}[pickup.type.unit])
+    return batch.append_column('trip_seconds', pc.cast(seconds, pa.int32()))
+
+
+def drop_invalid(batch, feed):
+    """Filter: drop trips that end before they start or have a negative distance or fare."""
+    pickup, dropoff = (batch.column(name) for name in TRIP_TIMES[feed.service])
+    keep = pc.greater_equal(dropoff, pickup)
+    for name in ('trip_distance', 'fare_amount'):
+        if name in batch.schema.names:
+            keep = pc.and_(keep, pc.greater_equal(batch.column(name), 0))
+    # a null time or amount says nothing against the trip
+    return batch.filter(pc.fill_null(keep, True))
+
+
+def in_month(batch, feed):
+    """Filter: drop trips picked up outside the month being loaded (TLC files carry a few)."""
+    return split_month(batch, PARTITION_KEYS[feed.service], feed.year, feed.month)[0]
+
+
+def zone_names(batch, feed):
+    """Derived: pickup/dropoff borough and zone (pu_borough, pu_zone, do_borough, do_zone) from the zone lookup."""
+    # the lookup is read once per process and indexed by LocationID; see zones.py
+    return load_dimension(revalidate=False).enrich(batch)
+
+
+TRANSFORMS = {
+    'normalize': normalize,
+    'compact': compact_types,
+    'trip_seconds': trip_seconds,
+    'drop_invalid': drop_invalid,
+    'in_month': in_month,
+    'zone_names': zone_names,
+}
+
+# zones keeps TLC's column spelling ("LocationID"), as the zone loader always has
+DEFAULTS = {
+    'yellow': ['normalize', 'compact'],
+    'green': ['normalize', 'compact'],
+    'fhv': ['normalize', 'compact'],
+    'zones': ['compact'],
+}
+
+
+def resolve(name):
+    """A transform by TRANSFORMS name or `module:function`; raises ValueError for neither."""
+    if name in TRANSFORMS:
+        return TRANSFORMS[name]
+    module, _, function = name.partition(':')
+    if not function:
+        raise ValueError(f"unknown transform '{name}' (one of {', '.join(TRANSFORMS)}, or module:function)")
+    return getattr(importlib.import_module(module), function)
+
+
+def chain(feed, extra=()):
+    """fn(batch) -> batch running the service's defaults, then `extra` (names), in order."""
+    hooks = [resolve(name) for name in DEFAULTS[feed.service] + list(extra)]
+
+    def run(batch):
+        for hook in hooks:
+            batch = hook(batch, feed)
+        return batch
+    return run
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Idempotent loads: the Python counterpart of the Kestra 04_postgres_taxi flow.
+
+The flow COPYs a month into a staging table, runs an md5 UPDATE over every
+staged row to fill `unique_row_id`, then MERGEs into the target. Here the
+md5 input is built while the batch is still in Arrow (one vectorized join
+of the key columns), the rows are COPYed once into a temporary staging
+table (never WAL-logged, and private to the writer's session so parallel
+writers don't share it), and the MERGE hashes them with Postgres' md5() on
+the way into the target, probing a unique index on `unique_row_id`. Reruns
+add nothing.
+
+The md5 input matches the flow's COALESCE(CAST(col AS text), '') chain, so
+rows loaded by either path dedup against each other.
+
+The staging table is TEMPORARY on purpose, not the UNLOGGED table the
+upsert was first specified with. Both skip the WAL, but an UNLOGGED table
+is shared by every session: concurrent writers (backfill's months) would
+need a name each, and a crashed writer would leave its table behind. A
+temporary table is per-session, reused batch after batch (ON COMMIT DELETE
+ROWS), and dropped with the connection.
+"""
+
+import click
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from loader import copy_batch, create_table, dbapi_cursor, quote_ident
+
+
+# the columns the Kestra flow hashes into unique_row_id, in the same order
+KEY_COLUMNS = {
+    'yellow': ['vendorid', 'tpep_pickup_datetime', 'tpep_dropoff_datetime',
+               'pulocationid', 'dolocationid', 'fare_amount', 'trip_distance'],
+    'green': ['vendorid', 'lpep_pickup_datetime', 'lpep_dropoff_datetime',
+              'pulocationid', 'dolocationid', 'fare_amount', 'trip_distance'],
+    'fhv': ['dispatching_base_num', 'pickup_datetime', 'dropoff_datetime',
+            'pulocationid', 'dolocationid'],
+}
+
+
+def as_pg_text(column):
+    """Render a column the way Postgres casts it to text, with nulls as ''."""
+    if pa.types.is_timestamp(column.type):
+        # second resolution prints as 'YYYY-MM-DD HH:MM:SS' like Postgres; TLC has no fractions
+        text = pc.cast(pc.cast(column, pa.timestamp('s'), safe=False), pa.string())
+    else:
+        # both sides print floats in shortest round-trip form ('7', '7.5')
+        text = pc.cast(column, pa.string())
+    return pc.fill_null(text, '')
+
+
+def row_keys(batch, key_columns):
+    """The flow's md5 input, one per row: the key columns as Postgres prints them, concatenated."""
+    return pc.binary_join_element_wise(*[as_pg_text(batch.column(name)) for name in key_columns], '')
+
+
+def with_row_keys(batch, key_columns, filename):
+    """
+    Prepend unique_row_id and filename columns to a (normalized) batch, as
+    staged for upsert_batch: unique_row_id holds the row key, which the
+    MERGE hashes. Of any rows that share a key the first is kept: a month
+    can repeat a trip, and the unique index would reject the second copy.
+    """
+    keys = row_keys(batch, key_columns)
+    first = (pa.table({'unique_row_id': keys, 'row': pa.array(range(len(keys)), pa.int64())})
+             .group_by('unique_row_id', use_threads=False).aggregate([('row', 'min')]))
+    if first.num_rows < batch.num_rows:
+        rows = first['row_min'].combine_chunks()
+        rows = rows.take(pc.sort_indices(rows))
+        batch, keys = batch.take(rows), keys.take(rows)
+
+    filenames = pa.repeat(pa.scalar(filename, pa.string()), batch.num_rows)
+    return pa.RecordBatch.from_arrays([keys, filenames] + batch.columns,
+                                      names=['unique_row_id', 'filename'] + batch.schema.names)
+
+
+def staging_table(table_name):
+    return f'{table_name}_staging'
+
+
+def prepare_upsert(con, table_name, schema):
+    """Create the target (if missing) with unique_row_id/filename and the unique index MERGE probes."""
+    schema = pa.schema([('unique_row_id', pa.string()), ('filename', pa.string())] + list(schema))
+    create_table(con, table_name, schema)
+    with dbapi_cursor(con) as cur:
+        cur.execute('SELECT column_name FROM information_schema.columns '
+                    'WHERE table_schema = current_schema() AND table_name = %s', (table_name,))
+        missing = {'unique_row_id', 'filename'} - {name for name, in cur.fetchall()}
+        if missing:
+            raise click.ClickException(f"'{table_name}' was loaded without --upsert (it has no "
+                                       f"{' or '.join(sorted(missing))}); drop it or load without --upsert")
+        cur.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS {quote_ident(table_name + "_unique_row_id_idx")} '
+                    f'ON {quote_ident(table_name)} (unique_row_id)')
+
+
+def upsert_batch(batch, engine, table_name, key_columns, filename):
+    """
+    Add the rows of `batch` that `table_name` doesn't have yet, in one
+    transaction. Returns the number of rows inserted.
+    """
+    batch = with_row_keys(batch, key_columns, filename)
+    staging = quote_ident(staging_table(table_name))
+    columns = ', '.join(quote_ident(name) for name in batch.schema.names)
+    values = ', '.join('md5(S.unique_row_id)' if name == 'unique_row_id' else 'S.' + quote_ident(name)
+                       for name in batch.schema.names)
+
+    with engine.begin() as conn:
+        with dbapi_cursor(conn) as cur:
+            cur.execute(f'CREATE TEMPORARY TABLE IF NOT EXISTS {staging} '
+                        f'(LIKE {quote_ident(table_name)}) ON COMMIT DELETE ROWS')
+        copy_batch(batch, conn, staging_table(table_name))
+        with dbapi_cursor(conn) as cur:
+            # a batch is tiny next to the target: probe the unique index per row
+            # rather than let the planner hash-join a full scan of the table
+            cur.execute('SET LOCAL enable_hashjoin = off')
+            cur.execute('SET LOCAL enable_mergejoin = off')
+            cur.execute(f'MERGE INTO {quote_ident(table_name)} AS T USING {staging} AS S '
+                        f'ON T.unique_row_id = md5(S.unique_row_id) '
+                        f'WHEN NOT MATCHED THEN INSERT ({columns}) VALUES ({values})')
+            return cur.rowcount
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+The taxi zone lookup as an in-memory dimension, and its version in Postgres.
+
+ZoneDimension holds the lookup as small arrays indexed by LocationID: for
+each attribute, the dictionary code of every zone's value. Enriching a trip
+batch is then one array index per column (codes[pulocationid]), giving
+dictionary columns (pu_borough, pu_zone, do_borough, do_zone) that write as
+text, so queries no longer need to join trips to zones. load_dimension()
+reads the lookup once per process and rereads it only when its checksum
+changes.
+
+The zone loader records the checksum it loaded as the table's comment and
+skips the reload while the source still has the same one.
+"""
+
+import hashlib
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pv
+from sqlalchemy import text
+
+from download_cache import shared_cache
+from schemas import FLAG, LABEL, compact, csv_column_types, quote_ident
+from sources import SOURCES
+
+
+# lookup column -> (trip column suffix, Arrow type of the enriched column)
+ATTRIBUTES = {'Borough': ('borough', FLAG), 'Zone': ('zone', LABEL)}
+LOCATIONS = {'pu': 'pulocationid', 'do': 'dolocationid'}
+
+_loaded = {}
+
+
+def checksum(path):
+    """'sha256:<hex>' of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return f'sha256:{digest.hexdigest()}'
+
+
+class ZoneDimension:
+    """The zone lookup as code arrays indexed by LocationID."""
+
+    def __init__(self, table, version=None):
+        self.version = version
+        ids = np.asarray(table['LocationID'])
+        self.columns = {}
+        for name, (suffix, arrow_type) in ATTRIBUTES.items():
+            encoded = table[name].combine_chunks().cast(pa.string()).dictionary_encode()
+            indices = encoded.indices.to_numpy(zero_copy_only=False)
+            # one slot past the highest ID stays -1: unknown IDs are sent there
+            codes = np.full(ids.max() + 2, -1, dtype=arrow_type.index_type.to_pandas_dtype())
+            codes[ids] = np.where(encoded.indices.is_valid().to_numpy(zero_copy_only=False), indices, -1)
+            self.columns[name] = (suffix, arrow_type, codes, encoded.dictionary)
+
+    @classmethod
+    def read(cls, path, version=None):
+        table = pv.read_csv(path, convert_options=pv.ConvertOptions(column_types=csv_column_types('zones')))
+        return cls(compact(table, 'zones'), version)
+
+    def lookup(self, location_ids, name):
+        """The `name` attribute (Borough, Zone) of each LocationID, as a dictionary array; null where unknown."""
+        _, arrow_type, codes, dictionary = self.columns[name]
+        ids = np.asarray(location_ids.fill_null(-1)).astype(np.int64)
+        ids[(ids < 0) | (ids >= len(codes))] = len(codes) - 1
+        indices = codes[ids]
+        return pa.DictionaryArray.from_arrays(pa.array(indices, arrow_type.index_type, mask=indices < 0), dictionary)
+
+    def enrich(self, batch):
+        """`batch` with pu_/do_ borough and zone columns appended."""
+        for prefix, location in LOCATIONS.items():
+            location_ids = batch.column(location)
+            for name, (suffix, _, _, _) in self.columns.items():
+                batch = batch.append_column(f'{prefix}_{suffix}', self.lookup(location_ids, name))
+        return batch
+
+
+def load_dimension(url=None, revalidate=True):
+    """
+    The zone dimension for `url` (default: the CSV mirror's lookup), read once
+    per process. Each call revalidates the cached download and rereads it if
+    the checksum changed; `revalidate=False` reuses whatever is in memory.
+    """
+    url = url or SOURCES['csv'].url('zones', None, None)
+    dimension = _loaded.get(url)
+    if dimension is not None and not revalidate:
+        return dimension
+    local_file = shared_cache().fetch(url, revalidate=revalidate)
+    version = checksum(local_file)
+    if dimension is None or dimension.version != version:
+        dimension = _loaded[url] = ZoneDimension.read(local_file, version)
+    return dimension
+
+
+def table_version(conn, table_name):
+    """The version recorded on `table_name` by mark_version(), or None."""
+    return conn.execute(text("SELECT obj_description(to_regclass(:t), 'pg_class')"),
+                        {'t': quote_ident(table_name)}).scalar()
+
+
+def mark_version(conn, table_name, version):
+    conn.execute(text(f'COMMENT ON TABLE {quote_ident(table_name)} IS {_literal(version)}'))
+
+
+def _literal(value):
+    # COMMENT takes a literal, not a bind parameter
+    return "'" + value.replace("'", "''") + "'"
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import functools
+import os
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+
+
+@pytest.fixture
+def pg_engine():
+    """An engine on TEST_DATABASE_URL (e.g. the docker-compose Postgres); skips the test without one."""
+    url = os.environ.get('TEST_DATABASE_URL')
+    if not url:
+        pytest.skip('TEST_DATABASE_URL is not set')
+    engine = create_engine(url)
+    try:
+        engine.connect().close()
+    except OperationalError as e:
+        pytest.skip(f'no Postgres at TEST_DATABASE_URL: {e}')
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def http_server():
+    """
+    start(handler, **kwargs) serves `handler` (kwargs go to its constructor,
+    e.g. directory=) on a free local port, without request logs, and returns
+    its base URL; every server started is shut down after the test.
+    """
+    servers = []
+
+    def start(handler, **kwargs):
+        quiet = type(handler.__name__, (handler,), {'log_message': lambda self, *args: None})
+        server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(quiet, **kwargs) if kwargs else quiet)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f'http://127.0.0.1:{server.server_address[1]}'
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+from http.server import SimpleHTTPRequestHandler
+
+import pytest
+import click
+from click.testing import CliRunner
+from sqlalchemy import inspect, text
+import backfill
+import download_cache
+from bench_loader import synthetic_trips
+from manifest import MANIFEST_TABLE, PgManifest
+
+
+def test_month_range_crosses_year_boundary():
+    months = list(backfill.month_range((2019, 11), (2020, 2)))
+    assert months == [(2019, 11), (2019, 12), (2020, 1), (2020, 2)]
+
+
+@pytest.mark.parametrize('value', ['2019', '2019-13', 'jan-2019'])
+def test_parse_month_rejects_bad_values(value):
+    with pytest.raises(click.BadParameter):
+        backfill.parse_month(None, None, value)
+
+
+def test_upsert_refuses_a_load_method(monkeypatch):
+    monkeypatch.setattr(backfill, 'create_engine', lambda url: pytest.fail('connected'))
+
+    result = CliRunner().invoke(backfill.run, ['--from', '2021-01', '--to', '2021-02', '--upsert',
+                                               '--load_method', 'arrow'])
+
+    assert result.exit_code == 2
+    assert '--upsert cannot be combined with --load_method' in result.output
+
+
+@pytest.fixture
+def tlc_mirror(tmp_path, monkeypatch, http_server):
+    """Synthetic yellow months on a local HTTP mirror (sizes and Last-Modified, no ETags), with a fresh cache."""
+    site = tmp_path / 'site'
+    site.mkdir()
+    monkeypatch.setattr(backfill, 'prefix', http_server(SimpleHTTPRequestHandler, directory=str(site)) + '/')
+    monkeypatch.setenv('TLC_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setattr(download_cache, '_shared', None)
+
+    def publish(month, rows, mtime=None):
+        path = site / f'yellow_tripdata_2021-{month:02d}.parquet'
+        synthetic_trips(rows, seed=month, month=f'2021-{month:02d}').to_parquet(path, index=False)
+        if mtime:
+            os.utime(path, (mtime, mtime))
+        return path
+    return publish
+
+
+@pytest.fixture
+def backfill_table(pg_engine):
+    """A table name for one test, dropped (with its manifest entries) afterwards, and the CLI's connection options."""
+    table = f'test_backfill_{os.getpid()}'
+    url = pg_engine.url
+    options = ['--pg_user', url.username, '--pg_pass', url.password or '', '--pg_host', url.host or '',
+               '--pg_port', str(url.port or 5432), '--pg_db', url.database, '--target_table', table, '--workers', '1']
+    yield table, options
+    with pg_engine.begin() as conn:
+        conn.execute(text(f'DROP TABLE IF EXISTS {table}'))
+        if inspect(conn).has_table(MANIFEST_TABLE):
+            conn.execute(text(f'DELETE FROM {MANIFEST_TABLE} WHERE target_table = :t'), {'t': table})
+
+
+def count(pg_engine, table):
+    with pg_engine.connect() as conn:
+        return conn.execute(text(f'SELECT count(*) FROM {table}')).scalar()
+
+
+def test_incremental_refuses_a_table_loaded_without_it(pg_engine, tlc_mirror, backfill_table):
+    table, options = backfill_table
+    tlc_mirror(1, 200)
+    runner = CliRunner()
+    assert runner.invoke(backfill.run, [*options, '--from', '2021-01', '--to', '2021-01']).exit_code == 0
+
+    result = runner.invoke(backfill.run, [*options, '--from', '2021-01', '--to', '2021-02', '--incremental'])
+
+    assert result.exit_code == 1
+    assert f"'{table}' already holds rows loaded without --incremental" in result.output
+    assert count(pg_engine, table) == 200
+
+
+def test_incremental_records_the_version_it_loaded(pg_engine, tlc_mirror, backfill_table, monkeypatch):
+    table, options = backfill_table
+    tlc_mirror(1, 200, mtime=1.6e9)
+    probed, republished = backfill.plan, []
+
+    def plan_then_republish(manifest, sources):
+        # TLC republishes the month between the HEAD and the download
+        todo = probed(manifest, sources)
+        republished.append(tlc_mirror(1, 250, mtime=1.7e9))
+        return todo
+    monkeypatch.setattr(backfill, 'plan', plan_then_republish)
+    runner = CliRunner()
+    args = [*options, '--from', '2021-01', '--to', '2021-01', '--incremental']
+
+    assert runner.invoke(backfill.run, args).exit_code == 0
+    monkeypatch.setattr(backfill, 'plan', probed)
+    result = runner.invoke(backfill.run, args)
+
+    # the manifest holds the republished version that was loaded, so nothing is appended twice
+    assert result.exit_code == 0, result.output
+    assert '0 new or changed, 1 unchanged' in result.output
+    assert count(pg_engine, table) == 250
+    entry = PgManifest(pg_engine, table).get('yellow_tripdata_2021-01.parquet')
+    assert (entry['size'], entry['rows']) == (os.path.getsize(republished[0]), 250)
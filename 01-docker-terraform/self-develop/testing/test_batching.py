@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import io
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from batching import STEP, AdaptiveBatcher, csv_chunks, parquet_batches
+
+
+MB = 1024 * 1024
+
+
+class TestAdaptiveBatcher:
+    """Tests for batching.py"""
+
+    def test_without_budget_size_is_fixed(self):
+        batcher = AdaptiveBatcher(rows=100000)
+        batcher.observe(100000, 50 * MB, 0.1)
+
+        assert batcher.rows == 100000
+
+    def test_grows_while_throughput_holds_then_settles(self):
+        batcher = AdaptiveBatcher(1024 * MB, probe_rows=10000)
+        for rows, seconds in [(10000, 0.1), (20000, 0.19), (40000, 0.5)]:
+            assert batcher.rows == rows
+            batcher.observe(rows, rows * 100, seconds)
+
+        # 40k rows ran at 80k rows/s, well under the 105k of 20k rows
+        assert batcher.settled and batcher.rows == 20000
+
+    def test_capped_by_memory_budget(self):
+        batcher = AdaptiveBatcher(30 * MB, probe_rows=10000)
+        batcher.observe(10000, 10000 * 1000, 0.01)
+
+        assert batcher.rows == 30 * MB // (3 * 1000)
+
+    def test_capped_by_commit_latency(self):
+        batcher = AdaptiveBatcher(1024 * MB, probe_rows=10000, max_commit_seconds=1.0)
+        batcher.observe(10000, 10000 * 10, 2.0)
+
+        assert batcher.rows == 5000
+
+    def test_parquet_batches_follow_the_batcher(self, tmp_path):
+        path = tmp_path / 'trips.parquet'
+        pq.write_table(pa.table({'x': range(5 * STEP)}), path, row_group_size=STEP)
+        batcher = AdaptiveBatcher(1024 * MB, probe_rows=STEP // 2)
+
+        sizes = []
+        for batch in parquet_batches(pq.ParquetFile(path), batcher):
+            sizes.append(batch.num_rows)
+            batcher.rows = STEP + 100
+
+        assert sizes == [STEP // 2, STEP + 100, STEP + 100, STEP + 100, STEP + 100, 5 * STEP - STEP // 2 - 4 * (STEP + 100)]
+
+    def test_csv_chunks_replay_committed_sizes(self):
+        reader = pd.read_csv(io.StringIO('x\n' + '\n'.join(map(str, range(10)))), iterator=True, chunksize=4)
+
+        chunks = list(csv_chunks(reader, AdaptiveBatcher(rows=4), sizes={0: 3, 1: 1}))
+
+        assert [len(c) for c in chunks] == [3, 1, 4, 2]
+        assert chunks[2]['x'].tolist() == [4, 5, 6, 7]
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+import requests
+import bench_ingest
+from bench_loader import synthetic_trips
+from parquet_footer import schema_problems
+
+
+@pytest.fixture
+def served(tmp_path):
+    (tmp_path / 'trips.bin').write_bytes(bytes(range(100)))
+    server = bench_ingest.serve(str(tmp_path))
+    yield f'http://127.0.0.1:{server.server_address[1]}/trips.bin'
+    server.shutdown()
+
+
+class TestBenchIngest:
+    """Tests for bench_ingest.py"""
+
+    @pytest.mark.parametrize('header, status, body', [
+        (None, 200, bytes(range(100))),
+        ('bytes=10-19', 206, bytes(range(10, 20))),
+        ('bytes=90-', 206, bytes(range(90, 100))),
+        ('bytes=-8', 206, bytes(range(92, 100))),
+    ])
+    def test_server_answers_ranges(self, served, header, status, body):
+        response = requests.get(served, headers={'Range': header} if header else {})
+
+        assert response.status_code == status
+        assert response.content == body
+        assert response.headers['Accept-Ranges'] == 'bytes'
+
+    @pytest.mark.parametrize('service', ['yellow', 'green'])
+    def test_synthetic_trips_look_like_tlc_files(self, service, tmp_path):
+        df = synthetic_trips(1000, service=service, month='2021-02')
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp_path / 'trips.parquet')
+
+        assert schema_problems(pq.read_metadata(tmp_path / 'trips.parquet'), service) == []
+        pickup = df[f"{'tpep' if service == 'yellow' else 'lpep'}_pickup_datetime"]
+        assert pickup.dt.month.eq(2).all()
+        assert 0 < df['passenger_count'].isna().mean() < 0.1
+
+    def test_compare_flags_slower_and_bigger_variants(self):
+        baseline = {'a': {'rows': 10, 'rows_per_sec': 100.0, 'peak_rss_mb': 100.0},
+                    'b': {'rows': 10, 'rows_per_sec': 100.0, 'peak_rss_mb': 100.0},
+                    'c': {'rows': 99, 'rows_per_sec': 900.0, 'peak_rss_mb': 100.0}}
+        results = {'a': {'rows': 10, 'rows_per_sec': 90.0, 'peak_rss_mb': 130.0},
+                   'b': {'rows': 10, 'rows_per_sec': 80.0, 'peak_rss_mb': 100.0},
+                   'c': {'rows': 10, 'rows_per_sec': 100.0, 'peak_rss_mb': 100.0}}
+
+        regressions = bench_ingest.compare(results, baseline, tolerance=0.15)
+
+        assert regressions == ['a: peak RSS 130 MB, was 100', 'b: 80 rows/sec, was 100']
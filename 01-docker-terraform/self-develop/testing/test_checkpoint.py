@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import sys
+from http.server import SimpleHTTPRequestHandler
+
+import pandas as pd
+import pytest
+from click.testing import CliRunner
+from sqlalchemy import create_engine, text
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'pipeline'))
+import checkpoint
+import ingest_data
+import parallel_csv
+from bench_loader import synthetic_trips
+from checkpoint import LEDGER_TABLE, chunk_checksum, completed_chunks, forget_table, record_chunk
+from parallel_csv import line_ranges
+
+
+def sqlite_ledger(engine):
+    """ensure_ledger() for SQLite (no timestamptz or now())."""
+    with engine.begin() as conn:
+        conn.execute(text(f'CREATE TABLE IF NOT EXISTS {LEDGER_TABLE} (source_file text NOT NULL, '
+                          'target_table text NOT NULL, chunk_index integer NOT NULL, rows bigint NOT NULL, '
+                          'checksum text NOT NULL, loaded_at timestamp DEFAULT CURRENT_TIMESTAMP, '
+                          'PRIMARY KEY (source_file, target_table, chunk_index))'))
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """ingest_data.py (and its range workers) writing to a SQLite file instead of Postgres."""
+    url = f'sqlite:///{tmp_path / "taxi.db"}'
+    engine = create_engine(url)
+    monkeypatch.setattr(ingest_data, 'create_engine', lambda db_url: engine)
+    # workers are forked, so they see this too
+    monkeypatch.setattr(parallel_csv, 'create_engine', lambda db_url: create_engine(url))
+    monkeypatch.setattr(ingest_data, 'ensure_ledger', sqlite_ledger)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def month(tmp_path, monkeypatch, http_server):
+    """January 2021 as a 250-row csv.gz, served locally through TLC_BASE_URL."""
+    site = tmp_path / 'site'
+    site.mkdir()
+    synthetic_trips(250, month='2021-01').to_csv(site / 'yellow_tripdata_2021-01.csv.gz', index=False)
+    monkeypatch.setenv('TLC_BASE_URL', http_server(SimpleHTTPRequestHandler, directory=str(site)) + '/')
+    monkeypatch.chdir(tmp_path)
+    return site / 'yellow_tripdata_2021-01.csv.gz'
+
+
+def fail_on(monkeypatch, module, name, index):
+    """Make `module.name` (a ledger write) raise for chunk/range `index`, as if the run died there."""
+    original = getattr(module, name)
+
+    def write(conn, source_file, target_table, chunk_index, *args):
+        if chunk_index == index:
+            raise RuntimeError(f'killed at {chunk_index}')
+        return original(conn, source_file, target_table, chunk_index, *args)
+    monkeypatch.setattr(module, name, write)
+    return original
+
+
+def loaded(engine, table='yellow_taxi_data'):
+    with engine.connect() as conn:
+        return pd.read_sql(f'SELECT "index" FROM {table} ORDER BY "index"', conn)['index'].tolist()
+
+
+def ledger(engine):
+    with engine.connect() as conn:
+        return conn.execute(text(f'SELECT chunk_index, rows FROM {LEDGER_TABLE} ORDER BY chunk_index')).all()
+
+
+class TestCheckpoint:
+    """Tests for checkpoint.py"""
+
+    def test_ledger_round_trip(self, tmp_path):
+        engine = create_engine(f'sqlite:///{tmp_path / "ledger.db"}')
+        sqlite_ledger(engine)
+        df = pd.DataFrame({'a': [1, 2, 3]})
+        with engine.begin() as conn:
+            record_chunk(conn, 'm01.csv', 'trips', 0, df)
+            record_chunk(conn, 'm02.csv', 'trips', 0, df.head(2))
+
+        assert completed_chunks(engine, 'm01.csv', 'trips') == {0: (3, chunk_checksum(df))}
+        with engine.begin() as conn:
+            forget_table(conn, 'trips', 'm01.csv')
+        assert completed_chunks(engine, 'm01.csv', 'trips') == {}
+        assert completed_chunks(engine, 'm02.csv', 'trips') == {0: (2, chunk_checksum(df.head(2)))}
+        with engine.begin() as conn:
+            forget_table(conn, 'trips')
+        assert completed_chunks(engine, 'm02.csv', 'trips') == {}
+
+    def test_checksum_ignores_the_index(self):
+        df = pd.DataFrame({'a': [1, 2, 3]})
+
+        assert chunk_checksum(df) == chunk_checksum(df.set_axis([10, 11, 12]))
+        assert chunk_checksum(df) != chunk_checksum(df.assign(a=[1, 2, 4]))
+
+
+class TestResume:
+    """An interrupted ingest_data.py run, resumed from the ledger"""
+
+    def test_serial_resume_skips_committed_chunks(self, db, month, monkeypatch):
+        args = ['--year', '2021', '--month', '1', '--chunksize', '100']
+        fail_on(monkeypatch, ingest_data, 'record_chunk', 1)
+        assert CliRunner().invoke(ingest_data.run, args).exit_code == 1
+        # chunk 1 was rolled back with its ledger row
+        assert loaded(db) == list(range(100))
+
+        monkeypatch.setattr(ingest_data, 'record_chunk', record_chunk)
+        written = []
+        to_sql = pd.DataFrame.to_sql
+        monkeypatch.setattr(pd.DataFrame, 'to_sql',
+                            lambda df, *args, **kwargs: written.append(len(df)) or to_sql(df, *args, **kwargs))
+        result = CliRunner().invoke(ingest_data.run, args)
+
+        assert result.exit_code == 0, result.output
+        assert "Resuming: 1 chunk(s) already in 'yellow_taxi_data'" in result.output
+        assert written == [100, 50]
+        assert loaded(db) == list(range(250))
+        assert ledger(db) == [(0, 100), (1, 100), (2, 50)]
+
+    def test_serial_resume_refuses_a_changed_chunk(self, db, month, monkeypatch):
+        args = ['--year', '2021', '--month', '1', '--chunksize', '100']
+        fail_on(monkeypatch, ingest_data, 'record_chunk', 1)
+        CliRunner().invoke(ingest_data.run, args)
+        monkeypatch.setattr(ingest_data, 'record_chunk', record_chunk)
+        synthetic_trips(250, seed=7, month='2021-01').to_csv(month, index=False)
+
+        result = CliRunner().invoke(ingest_data.run, args)
+
+        assert result.exit_code == 1
+        assert 'Chunk 0 of' in result.output and 'differs from the ledger' in result.output
+        assert loaded(db) == list(range(100))
+
+    def test_no_resume_starts_over(self, db, month):
+        args = ['--year', '2021', '--month', '1', '--chunksize', '100']
+        CliRunner().invoke(ingest_data.run, args)
+
+        result = CliRunner().invoke(ingest_data.run, [*args, '--no-resume'])
+
+        assert result.exit_code == 0, result.output
+        assert loaded(db) == list(range(250))
+        assert ledger(db) == [(0, 100), (1, 100), (2, 50)]
+
+    def test_ranges_resume_skips_committed_ranges(self, db, month, monkeypatch):
+        args = ['--year', '2021', '--month', '1', '--workers', '2', '--chunksize', '10']
+        # a few ranges of a small file, rather than one of --range_mb
+        monkeypatch.setattr(ingest_data, 'line_ranges', lambda csv_file, range_bytes: line_ranges(csv_file, 8000))
+        fail_on(monkeypatch, parallel_csv, 'record_rows', 1)
+        assert CliRunner().invoke(ingest_data.run, args).exit_code == 1
+        first = ledger(db)
+        assert 1 not in [index for index, _ in first] and len(first) >= 2
+
+        monkeypatch.setattr(parallel_csv, 'record_rows', checkpoint.record_rows)
+        result = CliRunner().invoke(ingest_data.run, args)
+
+        assert result.exit_code == 0, result.output
+        assert f"Resuming: {len(first)} of {len(first) + 1} range(s)" in result.output
+        assert loaded(db) == list(range(250))
+        assert sum(rows for _, rows in ledger(db)) == 250
+        # loaded: the decompressed CSV is gone
+        assert not os.path.exists('yellow_tripdata_2021-01.csv')
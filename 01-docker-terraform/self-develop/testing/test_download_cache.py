@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+import requests
+import download_cache
+from download_cache import DownloadCache, shared_cache
+
+
+class FakeTLCHandler(BaseHTTPRequestHandler):
+    """Serves `files` with an ETag and answers If-None-Match with 304; `statuses` forces an error."""
+    files = {}
+    statuses = {}
+    requests_seen = []
+
+    def do_GET(self):
+        self.requests_seen.append((self.path, self.headers.get('If-None-Match')))
+        if self.path in self.statuses:
+            self.send_error(self.statuses[self.path])
+            return
+        body = self.files.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def tlc_server(http_server):
+    FakeTLCHandler.files = {}
+    FakeTLCHandler.statuses = {}
+    FakeTLCHandler.requests_seen = []
+    return http_server(FakeTLCHandler), FakeTLCHandler
+
+
+class TestDownloadCache:
+    """Tests for download_cache.py"""
+
+    def test_second_fetch_revalidates_instead_of_downloading(self, tlc_server, tmp_path):
+        base, handler = tlc_server
+        handler.files['/green_tripdata_2025-11.parquet'] = b'x' * 1000
+        cache = DownloadCache(root=tmp_path)
+
+        first = cache.fetch(base + '/green_tripdata_2025-11.parquet')
+        second = cache.fetch(base + '/green_tripdata_2025-11.parquet')
+
+        assert first == second
+        assert first.read_bytes() == b'x' * 1000
+        assert (cache.misses, cache.hits) == (1, 1)
+        assert handler.requests_seen[1][1] is not None  # conditional GET
+
+    def test_changed_source_is_downloaded_again(self, tlc_server, tmp_path):
+        base, handler = tlc_server
+        handler.files['/zones.csv'] = b'old'
+        cache = DownloadCache(root=tmp_path)
+        cache.fetch(base + '/zones.csv')
+
+        handler.files['/zones.csv'] = b'new'
+        assert cache.fetch(base + '/zones.csv').read_bytes() == b'new'
+        assert cache.misses == 2
+
+    def test_version_is_what_the_download_returned(self, tlc_server, tmp_path):
+        base, handler = tlc_server
+        cache = DownloadCache(root=tmp_path)
+        assert cache.version(base + '/zones.csv') is None
+
+        handler.files['/zones.csv'] = b'old'
+        cache.fetch(base + '/zones.csv')
+        handler.files['/zones.csv'] = b'newer'
+        cache.fetch(base + '/zones.csv')
+
+        assert cache.version(base + '/zones.csv') == {'size': 5, 'etag': '"' + hashlib.md5(b'newer').hexdigest() + '"',
+                                                      'last_modified': None}
+
+    def test_least_recently_used_entry_is_evicted(self, tlc_server, tmp_path):
+        base, handler = tlc_server
+        for name in ('a', 'b', 'c'):
+            handler.files[f'/{name}'] = name.encode() * 400
+        cache = DownloadCache(root=tmp_path, max_bytes=1000)
+
+        path_a = cache.fetch(base + '/a')
+        cache.fetch(base + '/b')
+        cache.fetch(base + '/c')
+
+        assert not path_a.exists()
+        assert cache.fetch(base + '/c', revalidate=False).exists()
+        assert len(list((tmp_path / 'blobs').iterdir())) == 2
+
+    def test_stale_copy_is_served_only_while_the_source_is_down(self, tlc_server, tmp_path):
+        base, handler = tlc_server
+        handler.files['/yellow_tripdata_2019-02.parquet'] = b'trips'
+        cache = DownloadCache(root=tmp_path)
+        cache.fetcher.retries = 0
+        cache.fetch(base + '/yellow_tripdata_2019-02.parquet')
+
+        handler.statuses['/yellow_tripdata_2019-02.parquet'] = 503
+        assert cache.fetch(base + '/yellow_tripdata_2019-02.parquet').read_bytes() == b'trips'
+
+        # a removed month is an answer, not an outage
+        handler.statuses['/yellow_tripdata_2019-02.parquet'] = 404
+        with pytest.raises(requests.exceptions.HTTPError):
+            cache.fetch(base + '/yellow_tripdata_2019-02.parquet')
+
+    def test_shared_cache_is_one_per_process(self, tmp_path, monkeypatch):
+        monkeypatch.setenv('TLC_CACHE_DIR', str(tmp_path))
+        monkeypatch.setattr(download_cache, '_shared', None)
+
+        cache = shared_cache()
+
+        assert shared_cache() is cache and cache.root == tmp_path
+        # a forked worker starts without the parent's cache (and its fetcher threads)
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('fork')) as pool:
+            assert pool.submit(_has_shared_cache).result() is False
+        assert download_cache._shared is cache
+
+
+def _has_shared_cache():
+    return download_cache._shared is not None
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import asyncio
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+import requests
+from fetcher import Fetcher, download
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves `body` with an ETag and byte ranges; the first `failures` GETs get a 503."""
+    protocol_version = 'HTTP/1.1'
+    body = b''
+    etag = '"v1"'
+    failures = 0
+    gets = []
+
+    def _headers(self, status, length):
+        self.send_response(status)
+        self.send_header('ETag', self.etag)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(length))
+        self.end_headers()
+
+    def do_HEAD(self):
+        self._headers(200, len(self.body))
+
+    def do_GET(self):
+        self.gets.append(self.headers.get('Range'))
+        if RangeHandler.failures:
+            RangeHandler.failures -= 1
+            self._headers(503, 0)
+            return
+        spec = self.headers.get('Range')
+        if spec and self.headers.get('If-Range', self.etag) == self.etag:
+            start, end = (int(x) for x in spec.removeprefix('bytes=').split('-'))
+            self._headers(206, end - start + 1)
+            self.wfile.write(self.body[start:end + 1])
+            return
+        self._headers(200, len(self.body))
+        self.wfile.write(self.body)
+
+
+@pytest.fixture
+def range_server(http_server):
+    RangeHandler.body = bytes(range(256)) * 400
+    RangeHandler.etag = '"v1"'
+    RangeHandler.failures = 0
+    RangeHandler.gets = []
+    return http_server(RangeHandler) + '/trips.parquet', RangeHandler
+
+
+class TestFetcher:
+    """Tests for fetcher.py"""
+
+    def test_big_file_is_fetched_in_ranges(self, range_server, tmp_path):
+        url, handler = range_server
+
+        result = download(url, tmp_path / 'trips.parquet', part_size=10000)
+
+        assert (tmp_path / 'trips.parquet').read_bytes() == handler.body
+        assert result == {'size': 102400, 'etag': '"v1"', 'last_modified': None}
+        assert sorted(handler.gets) == sorted(f'bytes={s}-{min(s + 10000, 102400) - 1}' for s in range(0, 102400, 10000))
+
+    def test_small_file_is_one_get(self, range_server, tmp_path):
+        url, handler = range_server
+
+        download(url, tmp_path / 'trips.parquet', part_size=1024 * 1024)
+
+        assert handler.gets == [None]
+        assert (tmp_path / 'trips.parquet').read_bytes() == handler.body
+
+    def test_transient_errors_are_retried(self, range_server, tmp_path):
+        url, handler = range_server
+        handler.failures = 3
+
+        download(url, tmp_path / 'trips.parquet', part_size=40000, backoff=0.01)
+
+        assert (tmp_path / 'trips.parquet').read_bytes() == handler.body
+        assert len(handler.gets) == 3 + 3
+
+    def test_gives_up_after_retries(self, range_server, tmp_path):
+        url, handler = range_server
+        handler.failures = 100
+
+        with pytest.raises(requests.exceptions.HTTPError):
+            download(url, tmp_path / 'trips.parquet', retries=2, backoff=0.01)
+        assert len(handler.gets) == 3
+
+    def test_changed_file_is_refetched_whole(self, range_server, tmp_path, monkeypatch):
+        url, handler = range_server
+        # the probe sees v1, every range request finds v2
+        monkeypatch.setattr(handler, 'do_HEAD',
+                            lambda self: (self._headers(200, len(self.body)), setattr(handler, 'etag', '"v2"')))
+
+        result = download(url, tmp_path / 'trips.parquet', part_size=10000)
+
+        assert result['etag'] == '"v2"'
+        assert handler.gets[-1] is None
+        assert (tmp_path / 'trips.parquet').read_bytes() == handler.body
+
+    def test_download_many_shares_the_pool(self, range_server, tmp_path):
+        url, handler = range_server
+        fetcher = Fetcher(connections=2, part_size=30000)
+        try:
+            results = asyncio.run(fetcher.download_many([(url, tmp_path / 'a'), (url, tmp_path / 'b')]))
+        finally:
+            fetcher.close()
+
+        assert [r['size'] for r in results] == [102400, 102400]
+        assert (tmp_path / 'a').read_bytes() == (tmp_path / 'b').read_bytes() == handler.body
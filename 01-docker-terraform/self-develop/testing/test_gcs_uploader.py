@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import base64
+import io
+import os
+import sys
+from http.server import BaseHTTPRequestHandler
+
+import google_crc32c
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', '..', '..', '03-data-warehouse', 'upload_file_to_gcs'))
+import gcs_uploader
+import parquet_nyc_to_gcs
+from bench_loader import synthetic_trips
+from download_cache import DownloadCache
+from gcs_uploader import GCSUploader, TailReader
+
+
+def crc32c(data):
+    return base64.b64encode(google_crc32c.Checksum(data).digest()).decode()
+
+
+class FakeBlob:
+    """The slice of google.cloud.storage.Blob the uploader uses, stored in a FakeBucket."""
+
+    def __init__(self, bucket, name, chunk_size=None):
+        self.bucket = bucket
+        self.name = name
+        self.chunk_size = chunk_size
+
+    @property
+    def crc32c(self):
+        return crc32c(self.bucket.objects[self.name])
+
+    def upload_from_filename(self, filename, checksum=None):
+        with open(filename, 'rb') as f:
+            self.upload_from_file(f, checksum=checksum)
+
+    def upload_from_file(self, f, size=None, checksum=None):
+        if self.name in self.bucket.fail:
+            raise ConnectionError(f'{self.name}: upload interrupted')
+        if not self.chunk_size:
+            self.bucket.objects[self.name] = f.read() if size is None else f.read(size)
+            return
+        # resumable: a chunk the server lost is resent from where the server says it stopped
+        data = b''
+        while size is None or len(data) < size:
+            start = f.tell()
+            chunk = f.read(self.chunk_size if size is None else min(self.chunk_size, size - len(data)))
+            if start > 0 and self.bucket.lost.get(self.name):
+                self.bucket.lost[self.name] -= 1
+                f.seek(len(data))
+                continue
+            data += chunk
+            if len(chunk) < self.chunk_size:
+                break
+        self.bucket.objects[self.name] = data
+
+    def compose(self, sources):
+        if 'compose' in self.bucket.fail:
+            raise ConnectionError(f'{self.name}: compose failed')
+        self.bucket.objects[self.name] = b''.join(self.bucket.objects[source.name] for source in sources)
+
+    def delete(self):
+        del self.bucket.objects[self.name]
+
+
+class FakeBucket:
+    """
+    Objects in a dict; names in `fail` (or 'compose') raise instead of being
+    written, and `lost[name]` chunks of a resumable upload are dropped once each.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.fail = set()
+        self.lost = {}
+
+    def blob(self, name, chunk_size=None):
+        return FakeBlob(self, name, chunk_size)
+
+    def get_blob(self, name):
+        return FakeBlob(self, name) if name in self.objects else None
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    fake = FakeBucket()
+
+    class Client:
+        def __init__(self, project=None):
+            pass
+
+        def bucket(self, name):
+            return fake
+
+    monkeypatch.setattr(gcs_uploader.storage, 'Client', Client)
+    monkeypatch.setattr(gcs_uploader, '_uploaders', {})
+    # small enough that a 100-byte file is composed from 4 parts
+    monkeypatch.setattr(gcs_uploader, 'CHUNK_SIZE', 8)
+    monkeypatch.setattr(gcs_uploader, 'COMPOSITE_PART_SIZE', 32)
+    return fake
+
+
+@pytest.fixture
+def month(tmp_path):
+    path = tmp_path / 'yellow_tripdata_2024-01.parquet'
+    path.write_bytes(bytes(range(100)))
+    return path
+
+
+class MonthHandler(BaseHTTPRequestHandler):
+    """Serves `bodies` to successive GETs (the last one from then on), without byte ranges."""
+    bodies = []
+
+    def do_GET(self):
+        body = self.bodies.pop(0) if len(self.bodies) > 1 else self.bodies[0]
+        self.send_response(200)
+        self.send_header('ETag', '"' + str(len(body)) + '"')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def month_bytes(rows):
+    buffer = io.BytesIO()
+    synthetic_trips(rows, month='2024-01').to_parquet(buffer, index=False)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def tlc_site(bucket, http_server, tmp_path, monkeypatch):
+    """parquet_nyc_to_gcs pointed at a local TLC site (MonthHandler) and the fake bucket."""
+    monkeypatch.setattr(parquet_nyc_to_gcs, 'init_url', http_server(MonthHandler) + '/')
+    cache = DownloadCache(root=tmp_path)
+    monkeypatch.setattr(parquet_nyc_to_gcs, 'shared_cache', lambda: cache)
+    yield MonthHandler
+    cache.fetcher.close()
+
+
+class TestTailReader:
+    """Tests for TailReader"""
+
+    def test_seeks_back_within_the_window_only(self):
+        reader = TailReader(io.BytesIO(bytes(range(100))), keep=30)
+
+        assert reader.read(50) == bytes(range(50))
+        assert reader.seek(30) == 30
+        assert reader.read(40) == bytes(range(30, 70))
+        assert reader.tail == bytes(range(40, 70))
+        with pytest.raises(io.UnsupportedOperation):
+            reader.seek(39)
+        reader.seek(-5, io.SEEK_CUR)
+        assert reader.read() == bytes(range(65, 100))
+        assert reader.tell() == 100
+
+
+class TestGCSUploader:
+    """Tests for gcs_uploader.py"""
+
+    def test_identical_object_is_skipped(self, bucket, month):
+        uploader = GCSUploader('tlc', composite=False)
+
+        assert uploader.upload('yellow/2024-01.parquet', month) == 'uploaded'
+        assert uploader.upload('yellow/2024-01.parquet', month) == 'skipped'
+
+        month.write_bytes(b'republished')
+        assert uploader.upload('yellow/2024-01.parquet', month) == 'uploaded'
+        assert bucket.objects['yellow/2024-01.parquet'] == b'republished'
+
+    def test_big_file_is_composed_from_parts(self, bucket, month):
+        uploader = GCSUploader('tlc', composite_threshold=50)
+
+        assert uploader.upload('yellow/2024-01.parquet', month) == 'uploaded'
+
+        # the parts are gone once composed, and the object's crc32c matches the file
+        assert list(bucket.objects) == ['yellow/2024-01.parquet']
+        assert bucket.objects['yellow/2024-01.parquet'] == month.read_bytes()
+        assert uploader.upload('yellow/2024-01.parquet', month) == 'skipped'
+
+    @pytest.mark.parametrize('failing', ['yellow/2024-01.parquet.part-02', 'compose'])
+    def test_failed_composite_upload_leaves_no_parts(self, bucket, month, failing):
+        bucket.fail.add(failing)
+        uploader = GCSUploader('tlc', composite_threshold=50)
+
+        with pytest.raises(ConnectionError):
+            uploader.upload('yellow/2024-01.parquet', month)
+
+        assert bucket.objects == {}
+
+
+class TestStreamMonth:
+    """Tests for parquet_nyc_to_gcs.stream_month against the fake bucket"""
+
+    def test_month_is_streamed_whole(self, tlc_site, bucket):
+        tlc_site.bodies = [month_bytes(500)]
+
+        object_name, rows, version = parquet_nyc_to_gcs.stream_month(2024, 'yellow', 1)
+
+        assert (object_name, rows) == ('yellow/yellow_tripdata_2024-01.parquet', 500)
+        assert bucket.objects[object_name] == tlc_site.bodies[0]
+        assert version['size'] == len(tlc_site.bodies[0]) and version['etag'] == f'"{version["size"]}"'
+
+    def test_lost_chunks_are_resent_from_the_stream(self, tlc_site, bucket):
+        tlc_site.bodies = [month_bytes(500)]
+        bucket.lost['yellow/yellow_tripdata_2024-01.parquet'] = 3
+
+        parquet_nyc_to_gcs.stream_month(2024, 'yellow', 1)
+
+        assert bucket.lost['yellow/yellow_tripdata_2024-01.parquet'] == 0
+        assert bucket.objects['yellow/yellow_tripdata_2024-01.parquet'] == tlc_site.bodies[0]
+
+    def test_footer_mismatch_leaves_no_object(self, tlc_site, bucket):
+        # republished between the footer probe and the stream
+        tlc_site.bodies = [month_bytes(500), month_bytes(520)]
+
+        with pytest.raises(ValueError, match='uploaded 520 rows, footer said 500'):
+            parquet_nyc_to_gcs.stream_month(2024, 'yellow', 1)
+
+        assert bucket.objects == {}
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+from datetime import date, datetime, timedelta
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pytest
+from lake import partitioning, write_month
+
+
+@pytest.fixture
+def month():
+    """A green month as TLC publishes it, in shuffled pickup order, with a stray from the month before."""
+    n = 300
+    pickups = [datetime(2024, 1, 1) + timedelta(minutes=(i * 7919) % (n * 60)) for i in range(n)]
+    pickups[5] = datetime(2023, 12, 31, 23, 50)
+    return pa.table({
+        'VendorID': pa.array([i % 2 + 1 for i in range(n)], pa.int64()),
+        'lpep_pickup_datetime': pa.array(pickups, pa.timestamp('us')),
+        'lpep_dropoff_datetime': pa.array([p + timedelta(minutes=9) for p in pickups], pa.timestamp('us')),
+        'PULocationID': pa.array([i % 30 + 1 for i in range(n)], pa.int64()),
+        'fare_amount': pa.array([float(i % 40) for i in range(n)], pa.float64()),
+    })
+
+
+class TestLake:
+    """Tests for lake.py"""
+
+    def test_month_is_sorted_zstd_and_cut_into_row_groups(self, month, tmp_path):
+        files = write_month(month, 'green', 2024, 1, root=tmp_path, row_group_size=100)
+
+        assert [name for name, _ in files] == ['service=green/year=2024/month=1/part-0.parquet']
+        parquet_file = pq.ParquetFile(files[0][1])
+        metadata = parquet_file.metadata
+        assert metadata.num_rows == month.num_rows and metadata.num_row_groups == 3
+        assert metadata.row_group(0).sorting_columns[0].column_index == 1
+        pickup = metadata.row_group(0).column(1)
+        assert pickup.compression == 'ZSTD' and not pickup.has_dictionary_page
+        # low-cardinality columns are dictionary-encoded, times are not
+        assert metadata.row_group(0).column(3).has_dictionary_page
+        # sorted, so consecutive row groups cover disjoint pickup windows
+        assert pickup.statistics.max <= metadata.row_group(1).column(1).statistics.min
+
+        table = parquet_file.read()
+        assert table.column('lpep_pickup_datetime').to_pylist() == sorted(month['lpep_pickup_datetime'].to_pylist())
+        # the registry's compact types
+        assert table.schema.field('PULocationID').type == pa.int16()
+
+    def test_by_day_partitions_prune_on_pickup_date(self, month, tmp_path):
+        files = write_month(month, 'green', 2024, 1, root=tmp_path, by_day=True)
+
+        # the stray keeps its own day under the source month
+        assert 'service=green/year=2024/month=1/pickup_date=2023-12-31/part-0.parquet' in [name for name, _ in files]
+        dataset = ds.dataset(tmp_path, partitioning=partitioning(by_day=True))
+        day = ds.field('pickup_date') == date(2024, 1, 2)
+
+        assert len(list(dataset.get_fragments(filter=day))) == 1
+        expected = sum(p.date() == date(2024, 1, 2) for p in month['lpep_pickup_datetime'].to_pylist())
+        assert dataset.to_table(filter=day).num_rows == expected
+        assert dataset.count_rows(filter=(ds.field('year') == 2024) & (ds.field('month') == 1)) == month.num_rows
+
+    def test_rewriting_a_month_replaces_it(self, month, tmp_path):
+        write_month(month, 'green', 2024, 1, root=tmp_path, by_day=True)
+        write_month(month.slice(0, 10), 'green', 2024, 1, root=tmp_path)
+        write_month(month, 'green', 2024, 2, root=tmp_path)
+
+        dataset = ds.dataset(tmp_path, partitioning=partitioning())
+
+        assert dataset.count_rows(filter=ds.field('month') == 1) == 10
+        assert dataset.count_rows() == 10 + month.num_rows
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import pytest
+import pandas as pd
+import pyarrow as pa
+from unittest.mock import MagicMock, patch
+import loader
+
+
+@pytest.fixture
+def sample_dataframe():
+    """Create a small chunk with mixed-case columns and missing values."""
+    return pd.DataFrame({
+        'VendorID': pd.array([1, None], dtype='Int64'),
+        'PULocationID': [132, 236],
+        'fare_amount': [10.5, 7.0],
+    })
+
+
+@pytest.fixture
+def mock_engine():
+    """Create a mock engine whose raw connection hands out a mock cursor."""
+    engine = MagicMock()
+    cursor = engine.raw_connection.return_value.cursor.return_value.__enter__.return_value
+    return engine, cursor
+
+
+class TestLoader:
+    """Tests for loader.py"""
+
+    def test_copy_frame_streams_csv(self, sample_dataframe, mock_engine):
+        """COPY statement quotes identifiers and the payload is headerless CSV with empty NULLs."""
+        engine, cursor = mock_engine
+
+        loader.copy_frame(sample_dataframe, engine, 'yellow_taxi_data')
+
+        statement, buf = cursor.copy_expert.call_args[0]
+        assert statement == ('COPY "yellow_taxi_data" ("VendorID", "PULocationID", "fare_amount") '
+                             'FROM STDIN WITH (FORMAT csv)')
+        assert buf.getvalue() == '1,132,10.5\n,236,7.0\n'
+        engine.raw_connection.return_value.commit.assert_called_once()
+
+    def test_write_chunk_copy_creates_table_with_to_sql(self, sample_dataframe, mock_engine):
+        """copy mode lets to_sql create the (empty) table and COPYs the rows."""
+        engine, cursor = mock_engine
+
+        with patch.object(pd.DataFrame, 'to_sql') as mock_to_sql:
+            loader.write_chunk(sample_dataframe, engine, 'zones', if_exists='replace', method='copy')
+
+        mock_to_sql.assert_called_once_with(name='zones', con=engine, if_exists='replace', index=False)
+        cursor.copy_expert.assert_called_once()
+
+    def test_write_chunk_rejects_unknown_method(self, sample_dataframe, mock_engine):
+        engine, _ = mock_engine
+        with pytest.raises(ValueError):
+            loader.write_chunk(sample_dataframe, engine, 'zones', method='bulk')
+
+    def test_copy_batch_streams_arrow_csv(self, mock_engine):
+        """Arrow batches are COPYed as headerless CSV written by pyarrow, nulls left empty."""
+        engine, cursor = mock_engine
+        batch = pa.RecordBatch.from_pydict({'pulocationid': [132, None], 'store_and_fwd_flag': ['N', 'Y']})
+
+        loader.copy_batch(batch, engine, 'green_taxi_data')
+
+        statement, buf = cursor.copy_expert.call_args[0]
+        assert statement == ('COPY "green_taxi_data" ("pulocationid", "store_and_fwd_flag") '
+                             'FROM STDIN WITH (FORMAT csv)')
+        assert buf.read().decode() == '132,"N"\n,"Y"\n'
+
+    def test_create_table_maps_arrow_types(self, mock_engine):
+        engine, cursor = mock_engine
+        schema = pa.schema([('pulocationid', pa.int16()), ('fare_amount', pa.float64()),
+                            ('lpep_pickup_datetime', pa.timestamp('us')), ('store_and_fwd_flag', pa.string())])
+
+        loader.create_table(engine, 'green_taxi_data', schema, if_exists='replace')
+
+        drop, create = [c[0][0] for c in cursor.execute.call_args_list]
+        assert drop == 'DROP TABLE IF EXISTS "green_taxi_data"'
+        assert create == ('CREATE TABLE IF NOT EXISTS "green_taxi_data" ("pulocationid" smallint, '
+                          '"fare_amount" double precision, "lpep_pickup_datetime" timestamp without time zone, '
+                          '"store_and_fwd_flag" text)')
+
+
+@pytest.mark.skipif(loader.adbc is None, reason='adbc-driver-postgresql is not installed')
+class TestAdbc:
+    """adbc writes on a Connection commit and roll back with its transaction (needs TEST_DATABASE_URL)"""
+
+    @pytest.fixture
+    def trips(self, pg_engine):
+        with pg_engine.begin() as conn:
+            conn.exec_driver_sql('DROP TABLE IF EXISTS adbc_trips')
+            conn.exec_driver_sql('CREATE TABLE adbc_trips (pulocationid bigint)')
+        yield pg_engine
+        with pg_engine.begin() as conn:
+            conn.exec_driver_sql('DROP TABLE IF EXISTS adbc_trips')
+
+    def count(self, engine):
+        with engine.connect() as conn:
+            return conn.exec_driver_sql('SELECT count(*) FROM adbc_trips').scalar()
+
+    def test_rows_follow_the_transaction(self, trips):
+        batch = pa.RecordBatch.from_pydict({'pulocationid': [132, 236, 7]})
+
+        with trips.connect() as conn:
+            with conn.begin():
+                loader.write_batch(batch, conn, 'adbc_trips', method='adbc')
+                # not committed yet
+                assert self.count(trips) == 0
+            assert self.count(trips) == 3
+
+            with pytest.raises(RuntimeError), conn.begin():
+                loader.write_batch(batch, conn, 'adbc_trips', method='adbc')
+                raise RuntimeError('writer failed')
+            assert self.count(trips) == 3
+
+            # one ADBC connection for every batch of this writer
+            adbc_conn = conn.info['adbc']
+            with conn.begin():
+                loader.write_batch(batch, conn, 'adbc_trips', method='adbc')
+            assert conn.info['adbc'] is adbc_conn
+        assert self.count(trips) == 6
+
+    def test_closed_with_the_pool(self, trips):
+        with trips.connect() as conn:
+            with conn.begin():
+                loader.write_batch(pa.RecordBatch.from_pydict({'pulocationid': [1]}), conn, 'adbc_trips',
+                                   method='adbc')
+            info, adbc_conn = conn.info, conn.info['adbc']
+
+        trips.dispose()
+
+        assert 'adbc' not in info
+        with pytest.raises(loader.adbc.ProgrammingError):
+            adbc_conn.cursor()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+from http.server import SimpleHTTPRequestHandler
+
+import pytest
+from manifest import JsonManifest, changed, plan
+
+
+@pytest.fixture
+def mirror(tmp_path, http_server):
+    """A plain HTTP mirror of tmp_path/site: sizes and Last-Modified, no ETags."""
+    site = tmp_path / 'site'
+    site.mkdir()
+    return http_server(SimpleHTTPRequestHandler, directory=str(site)) + '/', site
+
+
+class TestManifest:
+    """Tests for manifest.py"""
+
+    def test_changed_prefers_etags(self):
+        entry = {'size': 10, 'etag': '"a"', 'last_modified': 'Mon'}
+
+        assert changed(None, {'size': 10, 'etag': '"a"', 'last_modified': 'Mon'})
+        assert not changed(entry, {'size': 10, 'etag': '"a"', 'last_modified': 'Tue'})
+        assert changed(entry, {'size': 10, 'etag': '"b"', 'last_modified': 'Mon'})
+        assert changed(entry, {'size': 11, 'etag': None, 'last_modified': 'Mon'})
+        assert not changed(entry, {'size': 10, 'etag': None, 'last_modified': 'Mon'})
+
+    def test_plan_skips_unchanged_and_unpublished_months(self, mirror, tmp_path):
+        base, site = mirror
+        for name in ('m01', 'm02'):
+            (site / name).write_bytes(b'x' * 100)
+        manifest = JsonManifest.file(tmp_path / 'manifest.json')
+        sources = [(name, base + name) for name in ('m01', 'm02', 'm03')]
+
+        todo, unchanged, missing = plan(manifest, sources)
+        assert [name for name, _, _ in todo] == ['m01', 'm02'] and missing == ['m03']
+        for name, _, probe in todo:
+            manifest.put(name, probe, rows=100)
+
+        # republished with new content (and a later date)
+        (site / 'm02').write_bytes(b'y' * 120)
+        os.utime(site / 'm02', (2e9, 2e9))
+        todo, unchanged, missing = plan(JsonManifest.file(tmp_path / 'manifest.json'), sources)
+
+        assert [name for name, _, _ in todo] == ['m02'] and unchanged == ['m01']
+        assert todo[0][2]['size'] == 120
+
+    def test_json_manifest_round_trip(self, tmp_path):
+        manifest = JsonManifest.file(tmp_path / 'manifest.json')
+        manifest.put('yellow_tripdata_2024-01.parquet', {'size': 5, 'etag': '"e"', 'last_modified': None}, rows=3)
+
+        reopened = JsonManifest.file(tmp_path / 'manifest.json')
+
+        assert reopened.get('yellow_tripdata_2024-01.parquet') == {'size': 5, 'etag': '"e"', 'last_modified': None,
+                                                                   'rows': 3}
+        assert reopened.get('yellow_tripdata_2024-02.parquet') is None
+        assert reopened.names() == {'yellow_tripdata_2024-01.parquet'}
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import gzip
+import io
+import os
+import sys
+from http.server import BaseHTTPRequestHandler
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, text
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'pipeline'))
+from bench_loader import synthetic_trips
+from checkpoint import LEDGER_TABLE
+from parallel_csv import decompress, discard, line_ranges, load_range, range_checksum
+from partitions import month_table
+from schemas import csv_dtypes
+
+
+@pytest.fixture
+def trips_csv(tmp_path):
+    """A yellow CSV of January 2021 whose first rows were picked up in December and February."""
+    df = synthetic_trips(40, month='2021-01')
+    df.loc[:1, 'tpep_pickup_datetime'] = pd.to_datetime(['2020-12-31 23:50', '2021-02-01 00:05'])
+    path = tmp_path / 'yellow_tripdata_2021-01.csv'
+    df.to_csv(path, index=False)
+    return path
+
+
+class GzipHandler(BaseHTTPRequestHandler):
+    """Serves `body` gzipped, with `etag` (none if None) on HEAD and GET; counts the GETs."""
+    body = b''
+    etag = None
+    gets = 0
+
+    def _headers(self):
+        self.send_response(200)
+        if self.etag:
+            self.send_header('ETag', self.etag)
+        self.end_headers()
+
+    def do_HEAD(self):
+        self._headers()
+
+    def do_GET(self):
+        GzipHandler.gets += 1
+        self._headers()
+        self.wfile.write(gzip.compress(self.body))
+
+
+@pytest.fixture
+def gz_server(http_server):
+    GzipHandler.body = b'a,b\n1,2\n'
+    GzipHandler.etag = '"v1"'
+    GzipHandler.gets = 0
+    return http_server(GzipHandler) + '/yellow_tripdata_2021-01.csv.gz', GzipHandler
+
+
+def sqlite_url(tmp_path):
+    """A database load_range can write to, with the ledger table checkpoint.py would create."""
+    url = f'sqlite:///{tmp_path / "ranges.db"}'
+    engine = create_engine(url)
+    with engine.begin() as conn:
+        conn.execute(text(f'CREATE TABLE {LEDGER_TABLE} (source_file text, target_table text, chunk_index integer, '
+                          'rows bigint, checksum text, loaded_at timestamp DEFAULT CURRENT_TIMESTAMP)'))
+    engine.dispose()
+    return url
+
+
+class TestLineRanges:
+    """Tests for parallel_csv.line_ranges"""
+
+    @pytest.mark.parametrize('trailing_newline', [True, False])
+    def test_every_range_size_cuts_whole_lines(self, tmp_path, trailing_newline):
+        lines = [b'id,name\n'] + [b'%d,%s\n' % (i, b'x' * (i % 7)) for i in range(30)]
+        if not trailing_newline:
+            lines[-1] = lines[-1].rstrip(b'\n')
+        path = tmp_path / 'lines.csv'
+        path.write_bytes(b''.join(lines))
+        body = b''.join(lines[1:])
+
+        # every size, so some ranges end exactly on a '\n' and some in the middle of a line
+        for range_bytes in range(1, len(body) + 2):
+            header, ranges = line_ranges(path, range_bytes)
+
+            assert header == lines[0]
+            assert b''.join(body[start - len(header):end - len(header)] for start, end, _ in ranges) == body
+            assert all(start == previous_end for (start, _, _), (_, previous_end, _) in zip(ranges[1:], ranges))
+            for start, end, first_row in ranges:
+                data = body[start - len(header):end - len(header)]
+                assert data.endswith(b'\n') or end == len(header) + len(body)
+                # the range's first line is line first_row of the body
+                assert data.split(b'\n')[0] == lines[1 + first_row].rstrip(b'\n')
+
+    def test_first_rows_match_a_serial_read(self, trips_csv):
+        dtype, parse_dates = csv_dtypes('yellow')
+        serial = pd.read_csv(trips_csv, dtype=dtype, parse_dates=parse_dates)
+
+        header, ranges = line_ranges(trips_csv, 500)
+
+        assert len(ranges) > 3
+        with open(trips_csv, 'rb') as f:
+            for start, end, first_row in ranges:
+                f.seek(start)
+                part = pd.read_csv(io.BytesIO(header + f.read(end - start)), dtype=dtype, parse_dates=parse_dates)
+                expected = serial.iloc[first_row:first_row + len(part)].reset_index(drop=True)
+                pd.testing.assert_frame_equal(part, expected)
+
+    def test_empty_body(self, tmp_path):
+        path = tmp_path / 'header_only.csv'
+        path.write_bytes(b'id,name\n')
+
+        assert line_ranges(path, 10) == (b'id,name\n', [])
+
+
+class TestDecompress:
+    """Tests for parallel_csv.decompress and discard"""
+
+    def test_same_version_reuses_the_csv(self, gz_server, tmp_path):
+        url, handler = gz_server
+        csv_file = str(tmp_path / 'yellow_tripdata_2021-01.csv')
+
+        decompress(url, csv_file)
+        decompress(url, csv_file)
+
+        assert handler.gets == 1
+        assert open(csv_file, 'rb').read() == b'a,b\n1,2\n'
+        assert open(csv_file + '.source').read() == '"v1"'
+
+    def test_new_version_is_downloaded_again(self, gz_server, tmp_path):
+        url, handler = gz_server
+        csv_file = str(tmp_path / 'yellow_tripdata_2021-01.csv')
+        decompress(url, csv_file)
+
+        handler.body, handler.etag = b'a,b\n3,4\n', '"v2"'
+        decompress(url, csv_file)
+
+        assert handler.gets == 2
+        assert open(csv_file, 'rb').read() == b'a,b\n3,4\n'
+        assert open(csv_file + '.source').read() == '"v2"'
+
+    def test_unversioned_source_is_never_reused(self, gz_server, tmp_path):
+        url, handler = gz_server
+        handler.etag = None
+        csv_file = str(tmp_path / 'yellow_tripdata_2021-01.csv')
+
+        decompress(url, csv_file)
+        decompress(url, csv_file)
+
+        assert handler.gets == 2
+        assert not os.path.exists(csv_file + '.source')
+
+    def test_discard_removes_the_csv_and_its_stamp(self, gz_server, tmp_path):
+        url, _ = gz_server
+        csv_file = str(tmp_path / 'yellow_tripdata_2021-01.csv')
+        decompress(url, csv_file)
+
+        discard(csv_file)
+        discard(csv_file)
+
+        assert not os.path.exists(csv_file) and not os.path.exists(csv_file + '.source')
+
+
+class TestLoadRange:
+    """Tests for parallel_csv.load_range, against SQLite"""
+
+    def test_ranges_load_like_a_serial_read(self, trips_csv, tmp_path):
+        dtype, parse_dates = csv_dtypes('yellow')
+        db_url = sqlite_url(tmp_path)
+        header, ranges = line_ranges(trips_csv, 700)
+
+        total = 0
+        with open(trips_csv, 'rb') as f:
+            for i, (start, end, first_row) in enumerate(ranges):
+                rows, _, _ = load_range(db_url, str(trips_csv), header, i, start, end, first_row, 'source.csv',
+                                        'trips', 7, dtype, parse_dates, None)
+                f.seek(start)
+                assert rows == f.read(end - start).count(b'\n')
+                total += rows
+
+        engine = create_engine(db_url)
+        with engine.connect() as conn:
+            loaded = pd.read_sql('SELECT * FROM trips ORDER BY "index"', conn)
+            ledger = conn.execute(text(f'SELECT chunk_index, rows, checksum FROM {LEDGER_TABLE} '
+                                       'ORDER BY chunk_index')).all()
+        engine.dispose()
+        # one index column numbered as the serial reader would, and the header's columns after it
+        assert total == 40
+        assert loaded['index'].tolist() == list(range(40))
+        assert list(loaded.columns[1:]) == header.decode().strip().split(',')
+        with open(trips_csv, 'rb') as f:
+            expected = []
+            for i, (start, end, _) in enumerate(ranges):
+                f.seek(start)
+                data = f.read(end - start)
+                expected.append((i, data.count(b'\n'), range_checksum(data)))
+        assert ledger == expected
+
+    def test_month_drops_other_months_pickups(self, trips_csv, tmp_path):
+        dtype, parse_dates = csv_dtypes('yellow')
+        db_url = sqlite_url(tmp_path)
+        header, ranges = line_ranges(trips_csv, 10 ** 6)
+        start, end, first_row = ranges[0]
+
+        rows, _, _ = load_range(db_url, str(trips_csv), header, 0, start, end, first_row, 'source.csv',
+                                'trips', 100, dtype, parse_dates, None, month=(2021, 1))
+
+        engine = create_engine(db_url)
+        with engine.connect() as conn:
+            loaded = pd.read_sql(f'SELECT "index" FROM {month_table("trips", 2021, 1)}', conn)
+            recorded = conn.execute(text(f'SELECT rows FROM {LEDGER_TABLE}')).scalar()
+        engine.dispose()
+        # the ledger counts the whole range; the month's table holds only January's pickups
+        assert rows == recorded == 40
+        assert loaded['index'].tolist() == list(range(2, 40))
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+from http.server import BaseHTTPRequestHandler
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+import parquet_footer
+import schemas
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves `body` and answers suffix ranges (bytes=-N) unless `ranges` is off."""
+    body = b''
+    ranges = True
+    ranges_seen = []
+
+    def do_GET(self):
+        rng = self.headers.get('Range')
+        self.ranges_seen.append(rng)
+        if rng and self.ranges:
+            data = self.body[-int(rng.split('-')[1]):]
+            self.send_response(206)
+        else:
+            data = self.body
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def parquet_server(http_server):
+    RangeHandler.ranges = True
+    RangeHandler.ranges_seen = []
+    return http_server(RangeHandler) + '/fhv.parquet', RangeHandler
+
+
+@pytest.fixture
+def fhv_file(tmp_path):
+    """A two-row-group fhv-shaped parquet file."""
+    table = pa.table({
+        'dispatching_base_num': ['B00001', 'B00002', 'B00003'],
+        'pickup_datetime': pa.array([0, 1, 2], pa.timestamp('us')),
+        'dropOff_datetime': pa.array([5, 6, 7], pa.timestamp('us')),
+        'PUlocationID': pa.array([10.0, None, 265.0]),
+        'DOlocationID': pa.array([1, 2, 3], pa.int64()),
+    })
+    path = tmp_path / 'fhv.parquet'
+    pq.write_table(table, path, row_group_size=2)
+    return path
+
+
+class TestParquetFooter:
+    """Tests for parquet_footer.py"""
+
+    def test_footer_parsed_from_tail_only(self, fhv_file):
+        data = fhv_file.read_bytes()
+        footer_len = int.from_bytes(data[-8:-4], 'little')
+
+        metadata = parquet_footer.footer_from_tail(data[-(footer_len + 8):])
+
+        assert (metadata.num_rows, metadata.num_row_groups) == (3, 2)
+        with pytest.raises(ValueError):
+            parquet_footer.footer_from_tail(data[-footer_len:])
+
+    def test_remote_footer_uses_one_suffix_range(self, parquet_server, fhv_file):
+        url, handler = parquet_server
+        handler.body = fhv_file.read_bytes()
+
+        metadata = parquet_footer.read_footer(url)
+
+        assert metadata.num_rows == 3
+        assert handler.ranges_seen == [f'bytes=-{parquet_footer.FOOTER_PROBE}']
+
+    def test_remote_footer_without_range_support(self, parquet_server, fhv_file):
+        url, handler = parquet_server
+        handler.body = fhv_file.read_bytes()
+        handler.ranges = False
+
+        assert parquet_footer.read_footer(url).num_rows == 3
+
+    def test_row_group_stats(self, fhv_file):
+        stats = parquet_footer.row_group_stats(parquet_footer.read_footer(fhv_file), 'pulocationid')
+
+        assert [(s['rows'], s['min'], s['max'], s['nulls']) for s in stats] == [(2, 10.0, 10.0, 1), (1, 265.0, 265.0, 0)]
+
+    def test_validate_schema(self, fhv_file):
+        metadata = parquet_footer.read_footer(fhv_file)
+
+        parquet_footer.validate_schema(metadata, 'fhv')
+        with pytest.raises(ValueError, match='missing column lpep_pickup_datetime'):
+            parquet_footer.validate_schema(metadata, 'green')
+
+    def test_validate_schema_accepts_compacted_files(self, tmp_path):
+        """Files written with the registry types (int16 IDs, dictionary base numbers) still validate."""
+        table = schemas.compact(pa.table({
+            'dispatching_base_num': ['B00001'],
+            'pickup_datetime': pa.array([0], pa.timestamp('us')),
+            'dropOff_datetime': pa.array([5], pa.timestamp('us')),
+            'PUlocationID': [10],
+            'DOlocationID': [1],
+        }), 'fhv')
+        path = tmp_path / 'fhv.parquet'
+        pq.write_table(table, path)
+
+        parquet_footer.validate_schema(parquet_footer.read_footer(path), 'fhv')
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+from datetime import datetime
+
+import pandas as pd
+import pyarrow as pa
+import click
+import pytest
+from sqlalchemy import text
+import backfill
+from bench_loader import synthetic_trips
+from partitions import month_bounds, month_table, partition_name, require_partitioned, split_month
+
+
+@pytest.fixture
+def tlc_months(tmp_path, monkeypatch):
+    """Two synthetic yellow months whose files carry trips of each other's month (and of December 2020)."""
+    files = {}
+    for month, strays in ((1, ['2021-02-01 00:10', '2021-02-03 08:00', '2020-12-31 23:55']),
+                          (2, ['2021-01-31 23:50'])):
+        df = synthetic_trips(300, seed=month, month=f'2021-{month:02d}')
+        df.loc[:len(strays) - 1, 'tpep_pickup_datetime'] = pd.to_datetime(strays)
+        df.loc[:len(strays) - 1, 'tpep_dropoff_datetime'] = pd.to_datetime(strays) + pd.Timedelta(minutes=10)
+        name = f'yellow_tripdata_2021-{month:02d}.parquet'
+        df.to_parquet(tmp_path / name, index=False)
+        files[backfill.prefix + name] = tmp_path / name
+
+    class Cache:
+        def fetch(self, url):
+            return files[url]
+
+        def version(self, url):
+            return {'size': files[url].stat().st_size, 'etag': None, 'last_modified': None}
+    monkeypatch.setattr(backfill, 'shared_cache', Cache)
+    return files
+
+
+class TestPartitions:
+    """Tests for partitions.py"""
+
+    def test_month_bounds_roll_over_the_year(self):
+        assert month_bounds(2021, 12) == (datetime(2021, 12, 1), datetime(2022, 1, 1))
+        assert month_bounds(2021, 2) == (datetime(2021, 2, 1), datetime(2021, 3, 1))
+
+    def test_names(self):
+        assert partition_name('yellow_taxi_data', 2021, 3) == 'yellow_taxi_data_2021_03'
+        assert month_table('yellow_taxi_data', 2021, 3) == 'yellow_taxi_data_2021_03_load'
+
+    def test_split_month_arrow_sends_nulls_and_other_months_out(self):
+        pickups = [datetime(2021, 1, 1), datetime(2021, 1, 31, 23, 59), datetime(2021, 2, 1),
+                   datetime(2009, 1, 1), None]
+        batch = pa.RecordBatch.from_pydict({'tpep_pickup_datetime': pa.array(pickups, pa.timestamp('us')),
+                                            'x': range(5)})
+
+        inside, strays = split_month(batch, 'tpep_pickup_datetime', 2021, 1)
+
+        assert inside.column(1).to_pylist() == [0, 1]
+        assert strays.column(1).to_pylist() == [2, 3, 4]
+
+    def test_split_month_dataframe(self):
+        df = pd.DataFrame({'lpep_pickup_datetime': pd.to_datetime(['2021-01-15', '2020-12-31', None]),
+                           'x': range(3)})
+
+        inside, strays = split_month(df, 'lpep_pickup_datetime', 2021, 1)
+
+        assert inside['x'].tolist() == [0]
+        assert strays['x'].tolist() == [1, 2]
+
+    @pytest.mark.parametrize('load_method', ['copy', 'arrow'])
+    def test_reloading_a_month_replaces_its_partition_only(self, pg_engine, tlc_months, load_method):
+        table = f'test_partitioned_{os.getpid()}'
+        db_url = pg_engine.url.render_as_string(hide_password=False)
+
+        def counts():
+            with pg_engine.connect() as conn:
+                return {name: conn.execute(text(f'SELECT count(*) FROM {name}')).scalar()
+                        for name in (table, partition_name(table, 2021, 1), partition_name(table, 2021, 2))}
+
+        try:
+            for month in (1, 2):
+                backfill.load_month('yellow', 2021, month, db_url, table, load_method, partitioned=True)
+            # each partition holds its own file's trips of its month; the strays are dropped
+            loaded = counts()
+            assert loaded == {table: 297 + 299, partition_name(table, 2021, 1): 297,
+                              partition_name(table, 2021, 2): 299}
+
+            result = backfill.load_month('yellow', 2021, 1, db_url, table, load_method, partitioned=True)
+
+            assert result['rows'] == 297
+            assert counts() == loaded
+        finally:
+            with pg_engine.begin() as conn:
+                conn.execute(text(f'DROP TABLE IF EXISTS {table}, {month_table(table, 2021, 1)}, '
+                                  f'{month_table(table, 2021, 2)} CASCADE'))
+
+    def test_require_partitioned(self, pg_engine):
+        flat, parent = f'test_flat_{os.getpid()}', f'test_parent_{os.getpid()}'
+        try:
+            with pg_engine.begin() as conn:
+                conn.execute(text(f'CREATE TABLE {flat} (pickup timestamp)'))
+                conn.execute(text(f'CREATE TABLE {parent} (pickup timestamp) PARTITION BY RANGE (pickup)'))
+
+            with pg_engine.connect() as conn:
+                assert require_partitioned(conn, f'test_missing_{os.getpid()}') is False
+                assert require_partitioned(conn, parent) is True
+                with pytest.raises(click.ClickException, match=f"'{flat}' exists and is not partitioned"):
+                    require_partitioned(conn, flat)
+        finally:
+            with pg_engine.begin() as conn:
+                conn.execute(text(f'DROP TABLE IF EXISTS {flat}, {parent}'))
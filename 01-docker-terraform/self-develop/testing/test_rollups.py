@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+import rollups
+from rollups import Rollup, _sum, aggregate, rollup_table
+
+
+@pytest.fixture
+def trips():
+    """Normalised yellow rows: three days, a handful of zone pairs, some null fares."""
+    n = 500
+    start = datetime(2024, 1, 1)
+    return pa.table({
+        'tpep_pickup_datetime': pa.array([start + timedelta(minutes=13 * i) for i in range(n)], pa.timestamp('us')),
+        'pulocationid': pa.array([i % 4 + 1 for i in range(n)], pa.int32()),
+        'dolocationid': pa.array([i % 3 + 10 for i in range(n)], pa.int32()),
+        'fare_amount': pa.array([None if i % 50 == 0 else float(i % 17) for i in range(n)], pa.float64()),
+        'tip_amount': pa.array([float(i % 5) for i in range(n)], pa.float64()),
+        'total_amount': pa.array([float(i % 23) for i in range(n)], pa.float64()),
+        'trip_distance': pa.array([i / 10 for i in range(n)], pa.float64()),
+    })
+
+
+def expected(table):
+    df = table.to_pandas()
+    df['pickup_date'] = df['tpep_pickup_datetime'].dt.date
+    return (df.groupby(['pickup_date', 'pulocationid', 'dolocationid'])
+            .agg(trips=('pulocationid', 'size'), fare_amount=('fare_amount', 'sum'), tip_amount=('tip_amount', 'sum'))
+            .sort_index())
+
+
+def as_frame(table):
+    return (table.to_pandas().set_index(['pickup_date', 'pulocationid', 'dolocationid'])
+            [['trips', 'fare_amount', 'tip_amount']].sort_index())
+
+
+class TestRollups:
+    """Tests for rollups.py"""
+
+    def test_aggregate_matches_a_pandas_groupby(self, trips):
+        result = aggregate(trips, 'yellow')
+
+        assert result.schema.names == ['pickup_date', 'pulocationid', 'dolocationid', 'trips',
+                                       'fare_amount', 'tip_amount', 'total_amount', 'trip_distance']
+        assert result.schema.field('pickup_date').type == pa.date32()
+        pd.testing.assert_frame_equal(as_frame(result), expected(trips), check_dtype=False)
+
+    def test_batches_fold_into_the_same_rollup(self, trips, monkeypatch):
+        # fold after every few batches, so partial aggregates are summed into each other
+        monkeypatch.setattr(rollups, 'FOLD_ROWS', 50)
+        rollup = Rollup('yellow', 'yellow_tripdata_2024-01.parquet')
+        for batch in trips.to_batches(max_chunksize=60):
+            rollup.add(batch)
+
+        result = rollup.result()
+
+        assert result.schema.names[0] == 'source_file'
+        assert set(result['source_file'].to_pylist()) == {'yellow_tripdata_2024-01.parquet'}
+        assert sum(result['trips'].to_pylist()) == trips.num_rows
+        pd.testing.assert_frame_equal(as_frame(result), expected(trips), check_dtype=False)
+
+    def test_folding_rereads_each_row_a_bounded_number_of_times(self, monkeypatch):
+        # every trip its own zone pair, so the folded aggregate grows with every batch
+        n = 2000
+        distinct = pa.table({
+            'tpep_pickup_datetime': pa.array([datetime(2024, 1, 1)] * n, pa.timestamp('us')),
+            'pulocationid': pa.array(range(n), pa.int32()),
+            'dolocationid': pa.array([1] * n, pa.int32()),
+            'fare_amount': pa.array([1.0] * n, pa.float64()),
+        })
+        folded = []
+        monkeypatch.setattr(rollups, 'FOLD_ROWS', 10)
+        monkeypatch.setattr(rollups, '_sum', lambda table, counts: folded.append(table.num_rows) or _sum(table, counts))
+        rollup = Rollup('yellow', 'yellow_tripdata_2024-01.parquet')
+        for batch in distinct.to_batches(max_chunksize=10):
+            rollup.add(batch)
+
+        result = rollup.result()
+
+        assert result.num_rows == n and sum(result['trips'].to_pylist()) == n
+        # folding all of it after every batch would reread ~n^2/20 = 200,000 rows
+        assert sum(folded) - n < 4 * n
+
+    def test_fhv_counts_trips_only(self):
+        fhv = pa.table({
+            'pickup_datetime': pa.array([datetime(2024, 1, 1, 8), datetime(2024, 1, 1, 9), datetime(2024, 1, 2, 8)]),
+            'pulocationid': pa.array([1, 1, 1], pa.int32()),
+            'dolocationid': pa.array([2, 2, 2], pa.int32()),
+        })
+
+        result = aggregate(fhv, 'fhv')
+
+        assert result.schema.names == ['pickup_date', 'pulocationid', 'dolocationid', 'trips']
+        assert sorted(result['trips'].to_pylist()) == [1, 2]
+
+    def test_empty_rollup(self):
+        rollup = Rollup('green', 'green_tripdata_2024-01.parquet')
+
+        assert rollup.result() is None
+        assert rollup.write(None, rollup_table('green_taxi_data')) == 0
+        assert rollup_table('green_taxi_data') == 'green_taxi_data_rollup'
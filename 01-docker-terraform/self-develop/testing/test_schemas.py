@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import io
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+import schemas
+
+
+class TestSchemas:
+    """Tests for schemas.py"""
+
+    def test_compact_narrows_known_columns_only(self):
+        batch = pa.RecordBatch.from_pydict({
+            'pulocationid': [132.0, None],
+            'store_and_fwd_flag': ['N', None],
+            'extra': [0.5, 2.75],
+            'fare_amount': [7.5, 10.0],
+            'tpep_pickup_datetime': pa.array([0, 1], pa.timestamp('ns')),
+            'not_in_registry': [1, 2],
+        })
+
+        compacted = schemas.compact(batch, 'yellow')
+
+        assert compacted.schema.types == [pa.int16(), schemas.FLAG, pa.float32(), pa.float64(),
+                                          pa.timestamp('ns'), pa.int64()]
+        assert compacted.column(0).to_pylist() == [132, None]
+        assert compacted.column(2).to_pylist() == [0.5, 2.75]
+        assert compacted.schema == schemas.compact_schema(batch.schema, 'yellow')
+
+    @pytest.mark.parametrize('column, values', [
+        ('PULocationID', [1.5]),
+        ('PULocationID', [70000]),
+        ('extra', [1234567.89]),
+    ])
+    def test_compact_refuses_lossy_values(self, column, values):
+        with pytest.raises(ValueError, match=column):
+            schemas.compact(pa.RecordBatch.from_pydict({column: values}), 'yellow')
+
+    def test_compact_accepts_all_null_surcharges(self):
+        batch = pa.RecordBatch.from_pydict({'ehail_fee': pa.array([None, None], pa.float64())})
+
+        compacted = schemas.compact(batch, 'green')
+
+        assert compacted.column(0).type == pa.float32()
+        assert compacted.column(0).null_count == 2
+
+    def test_csv_dtypes_read_a_tlc_csv(self):
+        dtype, parse_dates = schemas.csv_dtypes('yellow')
+        csv = io.StringIO('VendorID,tpep_pickup_datetime,tpep_dropoff_datetime,PULocationID,store_and_fwd_flag,extra\n'
+                          '1,2021-01-01 00:30:10,2021-01-01 00:36:12,132,N,0.5\n'
+                          ',2021-01-01 00:31:00,2021-01-01 00:40:00,,,\n')
+
+        # the registry also lists columns this month lacks; read_csv ignores those
+        df = pd.read_csv(csv, dtype=dtype, parse_dates=parse_dates)
+
+        assert str(df['VendorID'].dtype) == 'Int16'
+        assert str(df['PULocationID'].dtype) == 'Int16'
+        assert str(df['store_and_fwd_flag'].dtype) == 'category'
+        assert df['VendorID'].isna().tolist() == [False, True]
+        # surcharges are read wide and narrowed with compact()'s check
+        assert str(df['extra'].dtype) == 'float64'
+        df = schemas.compact_frame(df, 'yellow')
+        assert str(df['extra'].dtype) == 'float32'
+        assert df['extra'].isna().tolist() == [False, True]
+
+    def test_compact_frame_rejects_surcharges_float32_would_round(self):
+        df = pd.DataFrame({'congestion_surcharge': [2.5, 123456.789]})
+
+        with pytest.raises(ValueError, match="'congestion_surcharge'"):
+            schemas.compact_frame(df, 'yellow')
+
+    def test_ddl_matches_compact_types(self):
+        ddl = schemas.create_table_sql('yellow', 'yellow_taxi_data')
+
+        assert '"pulocationid" smallint' in ddl
+        assert '"store_and_fwd_flag" text' in ddl
+        assert '"extra" real' in ddl
+        assert '"fare_amount" double precision' in ddl
+        assert '"PULocationID" smallint' in schemas.create_table_sql('yellow', 'y', normalized=False)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import gzip
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from batching import AdaptiveBatcher
+from sources import SOURCES
+
+
+HEADER = 'VendorID,tpep_pickup_datetime,tpep_dropoff_datetime,passenger_count,trip_distance,RatecodeID,' \
+         'store_and_fwd_flag,PULocationID,DOLocationID,payment_type,fare_amount,extra,mta_tax,tip_amount,' \
+         'tolls_amount,improvement_surcharge,total_amount\n'
+ROW = '1,2021-01-01 00:30:10,2021-01-01 00:36:12,1,2.1,1,N,142,43,2,8.0,3.0,0.5,0.0,0.0,0.3,11.8\n'
+
+
+class TestSources:
+    """Tests for sources.py"""
+
+    def test_urls(self, monkeypatch):
+        monkeypatch.setenv('TLC_BASE_URL', 'http://mirror/')
+        monkeypatch.delenv('TLC_CSV_BASE_URL', raising=False)
+
+        assert SOURCES['parquet'].url('green', 2021, 3) == 'http://mirror/green_tripdata_2021-03.parquet'
+        assert SOURCES['csv'].url('yellow', 2021, 3).endswith('/download/yellow/yellow_tripdata_2021-03.csv.gz')
+        assert SOURCES['csv'].url('zones', 2021, 3).endswith('/download/misc/taxi_zone_lookup.csv')
+
+    def test_gzipped_csv_without_extension_is_read_in_batcher_sized_batches(self, tmp_path):
+        # the download cache names blobs by digest
+        path = tmp_path / '3f2a9c'
+        path.write_bytes(gzip.compress((HEADER + ROW * 25).encode()))
+        source = SOURCES['csv']
+
+        assert source.open(path, 'yellow') is None
+        batches = list(source.batches(path, 'yellow', AdaptiveBatcher(rows=10)))
+
+        assert [b.num_rows for b in batches] == [10, 10, 5]
+        assert batches[0].schema.field('PULocationID').type == pa.int16()
+        assert batches[0].schema.field('tpep_pickup_datetime').type == pa.timestamp('us')
+
+    def test_csv_missing_columns_are_refused(self, tmp_path):
+        path = tmp_path / 'trips.csv'
+        path.write_text('VendorID,tpep_pickup_datetime\n1,2021-01-01 00:30:10\n')
+
+        with pytest.raises(ValueError, match='missing column'):
+            SOURCES['csv'].open(path, 'yellow')
+
+    def test_parquet_returns_row_count_and_skips_validation_for_zones(self, tmp_path):
+        path = tmp_path / 'zones.parquet'
+        pq.write_table(pa.table({'LocationID': [1, 2]}), path)
+
+        assert SOURCES['parquet'].open(path, 'zones') == 2
+        with pytest.raises(ValueError):
+            SOURCES['parquet'].open(path, 'yellow')
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+import stages
+
+
+def test_row_group_span_covers_column_chunks(tmp_path):
+    """Only the bytes inside each row group's span are needed to read that row group."""
+    df = pd.DataFrame({'PULocationID': range(1000), 'store_and_fwd_flag': ['N'] * 1000})
+    path = tmp_path / 'trips.parquet'
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), path, row_group_size=250)
+
+    data = path.read_bytes()
+    metadata = pq.read_metadata(path)
+    footer_start = len(data) - 8 - int.from_bytes(data[-8:-4], 'little')
+
+    for i in range(metadata.num_row_groups):
+        start, end = stages.row_group_span(metadata.row_group(i))
+        # zero out everything except the footer and this row group
+        sparse = bytearray(len(data))
+        sparse[:4] = data[:4]
+        sparse[start:end] = data[start:end]
+        sparse[footer_start:] = data[footer_start:]
+        sparse_path = tmp_path / f'sparse_{i}.parquet'
+        sparse_path.write_bytes(bytes(sparse))
+
+        table = pq.ParquetFile(sparse_path).read_row_group(i)
+        assert table.column('PULocationID').to_pylist() == list(range(i * 250, (i + 1) * 250))
+
+
+class FakeConnection:
+    """Engine and connection at once: records SQL, every transaction a no-op."""
+
+    def __init__(self, log):
+        self.log = log
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def connect(self):
+        return self
+
+    def begin(self):
+        return self
+
+    def execute(self, statement, *args):
+        self.log.append(str(statement))
+
+
+def test_writer_pool_round_robin_into_staging(monkeypatch):
+    """Batches go to the writers in turn, each into its own staging table, merged into the target on close."""
+    written = []
+    monkeypatch.setattr(stages, 'create_table', lambda conn, table, schema, if_exists: written.append((table, if_exists)))
+    monkeypatch.setattr(stages, 'write_batch',
+                        lambda batch, conn, table, if_exists, method: written.append((table, batch.num_rows)))
+    log = []
+    engine = FakeConnection(log)
+    batches = [pa.record_batch({'x': list(range(n))}) for n in range(1, 7)]
+
+    with stages.WriterPool(engine, 'trips', 3, 'arrow', staging=True) as pool:
+        for batch in batches:
+            pool.submit(batch, if_exists='replace')
+        pool.close()
+
+    staged = pool.tables
+    assert written[0] == ('trips', 'replace')
+    assert sorted(written[1:], key=lambda w: w[1]) == [(staged[i % 3], i + 1) for i in range(6)]
+    assert [s for s in log if s.startswith('CREATE UNLOGGED')] == [f'CREATE UNLOGGED TABLE "{t}" (LIKE "trips")'
+                                                                  for t in staged]
+    assert [s for s in log if s.startswith('INSERT')] == [f'INSERT INTO "trips" SELECT * FROM "{t}"' for t in staged]
+    assert pool.stats.rows == 21
+
+
+def test_writer_pool_failure_leaves_target_untouched(monkeypatch):
+    """A writer error surfaces in the caller and the staged rows are dropped, never merged."""
+    def write_batch(batch, conn, table, if_exists, method):
+        if batch.num_rows == 2:
+            raise RuntimeError('connection lost')
+    monkeypatch.setattr(stages, 'create_table', lambda *args, **kwargs: None)
+    monkeypatch.setattr(stages, 'write_batch', write_batch)
+    log = []
+
+    with pytest.raises(RuntimeError, match='connection lost'):
+        with stages.WriterPool(FakeConnection(log), 'trips', 2, 'arrow', staging=True) as pool:
+            for n in range(1, 5):
+                pool.submit(pa.record_batch({'x': list(range(n))}))
+            pool.close()
+
+    assert not [s for s in log if s.startswith('INSERT')]
+    assert [s for s in log if s.startswith('DROP')][-2:] == [f'DROP TABLE IF EXISTS "{t}"' for t in pool.tables]
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import json
+
+import pytest
+from telemetry import Telemetry
+
+
+class TestTelemetry:
+    """Tests for telemetry.py"""
+
+    def test_stages_go_to_jsonl_and_prom_file(self, tmp_path):
+        jsonl, prom = tmp_path / 'run.jsonl', tmp_path / 'run.prom'
+        telemetry = Telemetry('ingest_test', jsonl=str(jsonl), prom_file=str(prom), month='2021-01')
+
+        for batch in telemetry.iterate('decode', [[1, 2, 3], [4, 5]]):
+            with telemetry.stage('write', rows=len(batch)) as step:
+                step['bytes'] = 10
+        telemetry.close()
+
+        events = [json.loads(line) for line in jsonl.read_text().splitlines()]
+        assert [e['stage'] for e in events[:-1]] == ['decode', 'write', 'decode', 'write']
+        assert events[0]['month'] == '2021-01' and events[0]['rows'] == 3
+        assert events[-1]['event'] == 'summary'
+        assert events[-1]['stages']['write'] == {'count': 2, 'seconds': pytest.approx(0, abs=1), 'rows': 5, 'bytes': 20}
+
+        text = prom.read_text()
+        assert 'ingest_stage_rows_total{job="ingest_test",month="2021-01",stage="decode"} 5' in text
+        assert 'ingest_stage_bytes_total{job="ingest_test",month="2021-01",stage="write"} 20' in text
+
+    def test_failed_step_is_not_recorded(self):
+        telemetry = Telemetry('ingest_test', jsonl='', prom_file='')
+
+        with pytest.raises(RuntimeError):
+            with telemetry.stage('write', rows=100):
+                raise RuntimeError('connection lost')
+
+        assert telemetry.stages == {}
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+from datetime import datetime
+
+import pyarrow as pa
+import pytest
+from transforms import Feed, chain, drop_invalid, in_month, resolve, trip_seconds
+
+
+FEED = Feed('yellow', 2021, 1)
+
+
+def trips(pickups, dropoffs, **columns):
+    return pa.RecordBatch.from_pydict({
+        'tpep_pickup_datetime': pa.array(pickups, pa.timestamp('us')),
+        'tpep_dropoff_datetime': pa.array(dropoffs, pa.timestamp('us')),
+        **columns,
+    })
+
+
+class TestTransforms:
+    """Tests for transforms.py"""
+
+    def test_default_chain_normalizes_and_compacts(self):
+        batch = pa.RecordBatch.from_pydict({'PULocationID': [132.0], 'extra': [0.5]})
+
+        out = chain(FEED)(batch)
+
+        assert out.schema.names == ['pulocationid', 'extra']
+        assert out.schema.types == [pa.int16(), pa.float32()]
+
+    def test_zones_keep_published_names(self):
+        batch = pa.RecordBatch.from_pydict({'LocationID': [1], 'Borough': ['EWR']})
+
+        out = chain(Feed('zones', 2021, 1))(batch)
+
+        assert out.schema.names == ['LocationID', 'Borough']
+        assert out.column(0).type == pa.int16()
+
+    def test_trip_seconds(self):
+        batch = trips([datetime(2021, 1, 1, 0, 0), None], [datetime(2021, 1, 1, 0, 10, 30), datetime(2021, 1, 1)])
+
+        assert trip_seconds(batch, FEED).column('trip_seconds').to_pylist() == [630, None]
+
+    def test_drop_invalid_keeps_unknowns(self):
+        t0, t1 = datetime(2021, 1, 1, 0, 0), datetime(2021, 1, 1, 0, 5)
+        batch = trips([t0, t1, t0, t0], [t1, t0, t1, None],
+                      trip_distance=[1.0, 1.0, -0.5, 1.0], fare_amount=[5.0, 5.0, 5.0, None])
+
+        assert drop_invalid(batch, FEED).num_rows == 2
+
+    def test_in_month(self):
+        batch = trips([datetime(2021, 1, 5), datetime(2009, 1, 1)], [datetime(2021, 1, 5), datetime(2009, 1, 1)])
+
+        assert in_month(batch, FEED).num_rows == 1
+
+    def test_extra_transforms_run_after_the_defaults(self):
+        batch = pa.RecordBatch.from_pydict({
+            'TPEP_PICKUP_DATETIME': pa.array([datetime(2021, 1, 1)], pa.timestamp('us')),
+            'tpep_dropoff_datetime': pa.array([datetime(2021, 1, 1, 0, 1)], pa.timestamp('us')),
+        })
+
+        out = chain(FEED, ['trip_seconds', 'transforms:in_month'])(batch)
+
+        assert out.column('trip_seconds').to_pylist() == [60]
+
+    def test_unknown_transform(self):
+        with pytest.raises(ValueError, match='unknown transform'):
+            resolve('nope')
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+from contextlib import contextmanager
+from unittest.mock import MagicMock
+
+import click
+import pyarrow as pa
+import pytest
+import upsert
+
+
+def yellow_batch():
+    return pa.RecordBatch.from_pydict({
+        'vendorid': [1, None, 1],
+        'tpep_pickup_datetime': pa.array([1546303600_000000, 0, 1546303600_000000], pa.timestamp('us')),
+        'tpep_dropoff_datetime': pa.array([1546304200_000000, 0, 1546304200_000000], pa.timestamp('us')),
+        'pulocationid': [132, 1, 132],
+        'dolocationid': [1, 2, 1],
+        'fare_amount': [7.0, 7.5, 7.0],
+        'trip_distance': [1.2, None, 1.2],
+        'tip_amount': [0.0, 1.0, 2.0],
+    })
+
+
+class TestUpsert:
+    """Tests for upsert.py"""
+
+    def test_row_keys_are_the_kestra_md5_input(self):
+        """Same string as COALESCE(CAST(col AS text), '') || ... in 04_postgres_taxi, which the MERGE md5()s."""
+        keys = upsert.row_keys(yellow_batch(), upsert.KEY_COLUMNS['yellow']).to_pylist()
+
+        assert keys[0] == '12019-01-01 00:46:402019-01-01 00:56:40132171.2'
+        assert keys[1] == '1970-01-01 00:00:001970-01-01 00:00:00127.5'
+
+    def test_repeated_trip_is_kept_once(self):
+        batch = upsert.with_row_keys(yellow_batch(), upsert.KEY_COLUMNS['yellow'], 'yellow_tripdata_2019-01.parquet')
+
+        assert batch.schema.names[:2] == ['unique_row_id', 'filename']
+        assert batch.num_rows == 2
+        assert batch.column('tip_amount').to_pylist() == [0.0, 1.0]
+        assert set(batch.column('filename').to_pylist()) == {'yellow_tripdata_2019-01.parquet'}
+
+    @pytest.mark.parametrize('columns, error', [
+        (['unique_row_id', 'filename', 'vendorid'], None),
+        (['vendorid', 'fare_amount'], 'has no filename or unique_row_id'),
+    ])
+    def test_prepare_upsert_needs_the_upsert_columns(self, monkeypatch, columns, error):
+        """A table loaded earlier without --upsert can't take the unique index."""
+        cursor = MagicMock()
+        cursor.fetchall.return_value = [(name,) for name in columns]
+        monkeypatch.setattr(upsert, 'create_table', MagicMock())
+        monkeypatch.setattr(upsert, 'dbapi_cursor', contextmanager(lambda con: (yield cursor)))
+
+        if error:
+            with pytest.raises(click.ClickException, match=error):
+                upsert.prepare_upsert(None, 'yellow_taxi_data', yellow_batch().schema)
+            assert 'CREATE UNIQUE INDEX' not in str(cursor.execute.call_args_list)
+        else:
+            upsert.prepare_upsert(None, 'yellow_taxi_data', yellow_batch().schema)
+            assert 'CREATE UNIQUE INDEX' in cursor.execute.call_args.args[0]
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import pyarrow as pa
+import pytest
+import zones
+from transforms import Feed, chain
+from zones import ZoneDimension, checksum
+
+
+LOOKUP = '''"LocationID","Borough","Zone","service_zone"
+1,"EWR","Newark Airport","EWR"
+2,"Queens","Jamaica Bay","Boro Zone"
+132,"Queens","JFK Airport","Airports"
+264,"Unknown",,"N/A"
+'''
+
+
+@pytest.fixture
+def lookup(tmp_path):
+    path = tmp_path / 'taxi_zone_lookup.csv'
+    path.write_text(LOOKUP)
+    return path
+
+
+class TestZones:
+    """Tests for zones.py"""
+
+    def test_enrich_indexes_the_lookup_by_location_id(self, lookup):
+        dimension = ZoneDimension.read(lookup)
+        batch = pa.record_batch({
+            'pulocationid': pa.array([132, 1, None, 999, 264], pa.int16()),
+            'dolocationid': pa.array([2, 2, 132, 0, 1], pa.int16()),
+        })
+
+        enriched = dimension.enrich(batch)
+
+        assert enriched.schema.names[2:] == ['pu_borough', 'pu_zone', 'do_borough', 'do_zone']
+        assert enriched.schema.field('pu_borough').type == pa.dictionary(pa.int8(), pa.string())
+        assert enriched.column('pu_borough').to_pylist() == ['Queens', 'EWR', None, None, 'Unknown']
+        # unknown IDs (999, 0) and null IDs come out null; 264's empty name stays '' as in the zones table
+        assert enriched.column('pu_zone').to_pylist() == ['JFK Airport', 'Newark Airport', None, None, '']
+        assert enriched.column('do_zone').to_pylist() == ['Jamaica Bay', 'Jamaica Bay', 'JFK Airport', None,
+                                                          'Newark Airport']
+
+    def test_zone_names_transform(self, lookup, monkeypatch):
+        monkeypatch.setattr(zones, '_loaded', {})
+        monkeypatch.setattr(zones, 'shared_cache', lambda: pytest.fail('lookup already in memory'))
+        zones._loaded[zones.SOURCES['csv'].url('zones', None, None)] = ZoneDimension.read(lookup, checksum(lookup))
+        batch = pa.table({
+            'tpep_pickup_datetime': pa.array([0], pa.timestamp('us')),
+            'PULocationID': pa.array([1], pa.int64()),
+            'DOLocationID': pa.array([132], pa.int64()),
+        })
+
+        enriched = chain(Feed('yellow', 2024, 1), ['zone_names'])(batch)
+
+        assert enriched.column('pu_borough').to_pylist() == ['EWR']
+        assert enriched.column('do_zone').to_pylist() == ['JFK Airport']
+
+    def test_load_dimension_rereads_only_a_changed_lookup(self, lookup, monkeypatch):
+        class Cache:
+            def fetch(self, url, revalidate=True):
+                return lookup
+        monkeypatch.setattr(zones, '_loaded', {})
+        monkeypatch.setattr(zones, 'shared_cache', Cache)
+
+        first = zones.load_dimension('http://mirror/taxi_zone_lookup.csv')
+        assert zones.load_dimension('http://mirror/taxi_zone_lookup.csv') is first
+        assert first.version == checksum(lookup)
+
+        lookup.write_text(LOOKUP.replace('Jamaica Bay', 'Broad Channel'))
+        second = zones.load_dimension('http://mirror/taxi_zone_lookup.csv')
+
+        assert second is not first and second.version != first.version
+        assert zones.load_dimension('http://mirror/taxi_zone_lookup.csv', revalidate=False) is second
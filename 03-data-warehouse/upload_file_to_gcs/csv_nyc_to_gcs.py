@@ -1,8 +1,21 @@
+import gzip
 import io
 import os
+import sys
+import time
 import requests
 import pandas as pd
-from google.cloud import storage
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+
+# the TLC download cache is shared with the ingestion scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', '..', '01-docker-terraform', 'self-develop', 'ingestion'))
+from download_cache import shared_cache
+from parquet_footer import read_footer, validate_schema
+from telemetry import Telemetry, peak_rss_mb
+from gcs_uploader import get_uploader
+from lake import month_dir, write_month
 
 """
 Pre-reqs: 
@@ -16,23 +29,67 @@ init_url = 'https://d37ci6vzurychx.cloudfront.net/trip-data/'
 # switch out the bucketname
 BUCKET = os.environ.get("GCP_GCS_BUCKET", "de_zoomcamp_03_nyc_taxi_csv")
 
+# rows decoded and written at a time by the streaming export
+EXPORT_BATCH_ROWS = 64 * 1024
+# gzip's own default; Arrow's gzip stream is fixed at 9, several times slower for ~4% smaller files
+GZIP_LEVEL = 6
+
+
+def parquet_to_csv_gz(src, stem, shard_bytes=None, batch_rows=EXPORT_BATCH_ROWS):
+    """
+    Stream a parquet file into gzipped CSV one batch at a time through
+    pyarrow's CSV writer, so memory stays at roughly one decoded batch no
+    matter how big the month is. Writes <stem>.csv.gz, or with `shard_bytes`
+    <stem>-000.csv.gz, <stem>-001.csv.gz, ... of about that many compressed
+    bytes each, every one with its own header, for BigQuery to load in
+    parallel. Returns (rows, files).
+    """
+    write_options = pv.WriteOptions(quoting_style='needed')
+    rows, files = 0, []
+    shard = None
+
+    def close(shard):
+        for stream in shard:
+            stream.close()
+
+    try:
+        for batch in pq.ParquetFile(src).iter_batches(batch_size=batch_rows):
+            if shard is None:
+                path = f"{stem}-{len(files):03d}.csv.gz" if shard_bytes else f"{stem}.csv.gz"
+                raw = open(path, 'wb')
+                sink = gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=GZIP_LEVEL)
+                shard = (pv.CSVWriter(sink, batch.schema, write_options=write_options), sink, raw)
+                files.append(path)
+            shard[0].write_batch(batch)
+            rows += batch.num_rows
+            # compressed bytes reach the file as gzip flushes, so a shard overshoots by at most a batch
+            if shard_bytes and raw.tell() >= shard_bytes:
+                close(shard)
+                shard = None
+    finally:
+        if shard is not None:
+            close(shard)
+    return rows, files
+
 
 def upload_to_gcs(bucket, object_name, local_file):
     """
     Ref: https://cloud.google.com/storage/docs/uploading-objects#storage-upload-object-python
+    Reuses one client per bucket; chunking, skipping and parallel parts live in gcs_uploader.
     """
-    # # WORKAROUND to prevent timeout for files > 6 MB on 800 kbps upload speed.
-    # # (Ref: https://github.com/googleapis/python-storage/issues/74)
-    storage.blob._MAX_MULTIPART_SIZE = 10 * 1024 * 1024  # 10 MB
-    storage.blob._DEFAULT_CHUNKSIZE = 10 * 1024 * 1024  # 10 MB
+    return get_uploader(bucket).upload(object_name, local_file)
 
-    client = storage.Client(project = 'de-zoomcamp-terraform-demo')
-    bucket = client.bucket(bucket)
-    blob = bucket.blob(object_name)
-    blob.upload_from_filename(local_file)
 
-
-def nyc_data_to_gcs(year, service):
+def nyc_data_to_gcs(year, service, streaming=True, shard_mb=None, lake=False, by_day=False):
+    """
+    Convert a year of one service to csv.gz, one file per month (or shards of
+    about `shard_mb` MB); with `lake`, rewrite the months into the
+    Hive-partitioned parquet lake instead (see lake.py), by day too with
+    `by_day`. `streaming=False` is the old whole-month pandas export.
+    """
+    telemetry = Telemetry('csv_nyc_to_gcs', service=service, year=year)
+    # all twelve months download (or revalidate) at once over the cache's pooled connections
+    local_files = shared_cache().fetch_many([f"{init_url}{service}_tripdata_{year}-{i:02d}.parquet" for i in range(1, 13)])
     for i in range(12):
         
         # sets the month part of the file_name string
@@ -42,27 +99,67 @@ def nyc_data_to_gcs(year, service):
         # csv file_name
         file_name = f"{service}_tripdata_{year}-{month}.parquet"
 
-        # download it using requests
-        request_url = f"{init_url}{file_name}"
-        r = requests.get(request_url)
-        open(file_name, 'wb').write(r.content)
-        # print(f"Local: {file_name}")
-
-        # get row count
-        df = pd.read_parquet(file_name)
-        # print(f"Row count: {len(df)}")
+        # wait for this month's download
+        with telemetry.stage('download', chunk=file_name) as step:
+            local_file = next(local_files)
+            step['bytes'] = os.path.getsize(local_file)
+        # print(f"Local: {local_file}")
+
+        # row count and schema check from the footer, without decoding the file
+        metadata = read_footer(local_file)
+        validate_schema(metadata, service)
+        print(f"Row count: {metadata.num_rows}")
+
+        if lake:
+            with telemetry.stage('decode', chunk=file_name, rows=metadata.num_rows):
+                table = pq.read_table(local_file)
+            with telemetry.stage('lake', chunk=file_name, rows=table.num_rows) as step:
+                files = write_month(table, service, year, month, by_day=by_day)
+                step['bytes'] = sum(os.path.getsize(path) for _, path in files)
+            del table
+            print(f"Lake: {len(files)} file(s) under {month_dir(service, year, month)}")
+
+            # upload it to gcs, under the same layout
+            # for object_name, status in get_uploader(BUCKET).upload_many(
+            #         (f"lake/{object_name}", path) for object_name, path in files):
+            #     print(f"GCS: {object_name} ({status})")
+            continue
+
+        if streaming:
+            start = time.perf_counter()
+            with telemetry.stage('transform', chunk=file_name) as step:
+                rows, csv_files = parquet_to_csv_gz(local_file, file_name.replace('.parquet', ''),
+                                                    shard_bytes=shard_mb and shard_mb * 1024 * 1024)
+                step['rows'] = rows
+                step['bytes'] = sum(os.path.getsize(path) for path in csv_files)
+            seconds = max(time.perf_counter() - start, 1e-9)
+            print(f"CSV: {len(csv_files)} file(s), {step['bytes'] / 1024 ** 2:.1f} MB gzipped "
+                  f"({rows / seconds:,.0f} rows/s, peak RSS {peak_rss_mb():.0f} MB)")
+
+            # upload it to gcs
+            # for object_name, status in get_uploader(BUCKET).upload_many(
+            #         (f"{service}/{os.path.basename(path)}", path) for path in csv_files):
+            #     print(f"GCS: {object_name} ({status})")
+            for path in csv_files:
+                os.remove(path)
+            continue
 
         # transform to csv
+        with telemetry.stage('decode', chunk=file_name, rows=metadata.num_rows):
+            df = pd.read_parquet(local_file)
         csv_file_name = file_name.replace('.parquet', '.csv')
-        df.to_csv(csv_file_name, index=False)
+        with telemetry.stage('transform', chunk=file_name, rows=len(df)) as step:
+            df.to_csv(csv_file_name, index=False)
+            step['bytes'] = os.path.getsize(csv_file_name)
         print(f"CSV: {csv_file_name}")
 
         # upload it to gcs 
         # upload_to_gcs(BUCKET, f"{service}/{csv_file_name}", csv_file_name)
         # print(f"GCS: {service}/{csv_file_name}")    
-        os.remove(file_name)
         os.remove(csv_file_name)
 
+    telemetry.close()
+
 
 # nyc_data_to_gcs('2019', 'green')
 # nyc_data_to_gcs('2020', 'green')
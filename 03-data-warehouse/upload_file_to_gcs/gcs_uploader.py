@@ -0,0 +1,216 @@
+import base64
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import google_crc32c
+from google.cloud import storage
+
+"""
+One storage.Client shared by every upload, instead of a fresh client per file.
+
+- files are uploaded concurrently from a thread pool (`upload_many`)
+- small files go through a chunked resumable upload with a crc32c check
+- files above `composite_threshold` are split into parts that upload in
+  parallel and are then stitched together with a server-side compose
+- an object whose crc32c already matches the local file is skipped (composite
+  objects have no md5, but GCS still reports their crc32c)
+
+Point STORAGE_EMULATOR_HOST at fake-gcs-server (or any emulator) to test locally.
+"""
+
+PROJECT = 'de-zoomcamp-terraform-demo'
+# resumable chunks must be a multiple of 256 KB
+CHUNK_SIZE = 10 * 1024 * 1024
+COMPOSITE_THRESHOLD = 128 * 1024 * 1024
+COMPOSITE_PART_SIZE = 32 * 1024 * 1024
+# GCS compose accepts at most 32 source objects
+MAX_COMPOSE_PARTS = 32
+
+_uploaders = {}
+
+
+def crc32c_of(path):
+    """Base64 crc32c of a local file, in the form GCS reports for blobs."""
+    checksum = google_crc32c.Checksum()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+            checksum.update(block)
+    return base64.b64encode(checksum.digest()).decode()
+
+
+class FileSlice(io.RawIOBase):
+    """Read-only view of `length` bytes of a file starting at `offset`, positioned at 0."""
+
+    def __init__(self, path, offset, length):
+        self._f = open(path, 'rb')
+        self._offset = offset
+        self._length = length
+        self._f.seek(offset)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._f.tell() - self._offset
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            pos += self.tell()
+        elif whence == io.SEEK_END:
+            pos += self._length
+        self._f.seek(self._offset + max(0, min(pos, self._length)))
+        return self.tell()
+
+    def read(self, size=-1):
+        remaining = self._length - self.tell()
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        return self._f.read(size)
+
+    def close(self):
+        self._f.close()
+        super().close()
+
+
+class TailReader:
+    """
+    Forward-only wrapper over a stream (e.g. an HTTP body) that remembers its
+    last `keep` bytes: `tail` for a footer check, and a window to seek back
+    into when a resumable upload resends a chunk the server didn't keep. Keep
+    at least one upload chunk; seeking before the window is refused.
+    """
+
+    def __init__(self, raw, keep=CHUNK_SIZE):
+        self._raw = raw
+        self._keep = keep
+        self._window = bytearray()
+        # bytes read from `raw` so far, and the position the next read starts at
+        self._end = 0
+        self._pos = 0
+
+    @property
+    def tail(self):
+        return bytes(self._window)
+
+    def read(self, size=-1):
+        start = len(self._window) - (self._end - self._pos)
+        whole = size is None or size < 0
+        # bytes already read from `raw` first (after a seek back), then new ones
+        data = bytes(self._window[start:] if whole else self._window[start:start + size])
+        if whole or len(data) < size:
+            fresh = self._raw.read(-1 if whole else size - len(data))
+            self._window += fresh
+            del self._window[:max(0, len(self._window) - self._keep)]
+            self._end += len(fresh)
+            data += fresh
+        self._pos += len(data)
+        return data
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            pos += self._pos
+        elif whence == io.SEEK_END:
+            raise io.UnsupportedOperation("a stream's end isn't known until it is read")
+        if not self._end - len(self._window) <= pos <= self._end:
+            raise io.UnsupportedOperation(f"can only seek within the last {len(self._window)} bytes read")
+        self._pos = pos
+        return pos
+
+
+class GCSUploader:
+
+    def __init__(self, bucket, project=PROJECT, workers=8, composite=True,
+                 composite_threshold=COMPOSITE_THRESHOLD):
+        self.client = storage.Client(project=project)
+        self.bucket = self.client.bucket(bucket)
+        self.workers = workers
+        self.composite = composite
+        self.composite_threshold = composite_threshold
+
+    def upload(self, object_name, local_file):
+        """Upload one file; returns 'skipped' when the bucket already has identical bytes."""
+        existing = self.bucket.get_blob(object_name)
+        if existing is not None and existing.crc32c == crc32c_of(local_file):
+            return 'skipped'
+
+        size = os.path.getsize(local_file)
+        if self.composite and size >= self.composite_threshold:
+            self._upload_composite(object_name, local_file, size)
+        else:
+            blob = self.bucket.blob(object_name, chunk_size=CHUNK_SIZE)
+            blob.upload_from_filename(local_file, checksum='crc32c')
+        return 'uploaded'
+
+    def upload_stream(self, object_name, stream, size=None):
+        """
+        Pipe a readable stream into a chunked resumable upload, CHUNK_SIZE bytes
+        at a time, without staging it on disk. No skip check: the stream's
+        crc32c is only known once it has been read. A forward-only stream
+        should come wrapped in a TailReader, so a chunk can be resent.
+        """
+        blob = self.bucket.blob(object_name, chunk_size=CHUNK_SIZE)
+        blob.upload_from_file(stream, size=size, checksum='crc32c')
+        return 'uploaded'
+
+    def _upload_composite(self, object_name, local_file, size):
+        part_size = max(COMPOSITE_PART_SIZE, -(-size // MAX_COMPOSE_PARTS))
+        part_size = -(-part_size // CHUNK_SIZE) * CHUNK_SIZE
+        offsets = range(0, size, part_size)
+
+        uploaded = []
+
+        def upload_part(index, offset):
+            part = self.bucket.blob(f'{object_name}.part-{index:02d}', chunk_size=CHUNK_SIZE)
+            length = min(part_size, size - offset)
+            with FileSlice(local_file, offset, length) as f:
+                part.upload_from_file(f, size=length, checksum='crc32c')
+            uploaded.append(part)
+            return part
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                parts = list(pool.map(upload_part, range(len(offsets)), offsets))
+            self.bucket.blob(object_name).compose(parts)
+        finally:
+            # also the parts that made it before another part (or the compose) failed
+            for part in uploaded:
+                part.delete()
+
+    def upload_many(self, files, telemetry=None):
+        """
+        Upload (object_name, local_file) pairs concurrently and yield
+        (object_name, status) as each finishes. `files` may be a generator:
+        uploads start as soon as each pair is produced, so they overlap with
+        whatever work produces the next file. Each upload is recorded as an
+        'upload' step when a Telemetry is given.
+        """
+        def timed_upload(object_name, local_file):
+            if telemetry is None:
+                return self.upload(object_name, local_file)
+            with telemetry.stage('upload', chunk=object_name) as step:
+                status = self.upload(object_name, local_file)
+                step['bytes'] = os.path.getsize(local_file) if status == 'uploaded' else 0
+            return status
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = [(object_name, pool.submit(timed_upload, object_name, local_file))
+                       for object_name, local_file in files]
+            for object_name, future in futures:
+                yield object_name, future.result()
+
+
+def get_uploader(bucket, project=PROJECT, **kwargs):
+    """Uploader (and client) shared per bucket for the lifetime of the process."""
+    if bucket not in _uploaders:
+        _uploaders[bucket] = GCSUploader(bucket, project=project, **kwargs)
+    return _uploaders[bucket]
@@ -1,8 +1,16 @@
 import io
 import os
-import requests
-import pandas as pd
-from google.cloud import storage
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+# the TLC download cache is shared with the ingestion scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', '..', '01-docker-terraform', 'self-develop', 'ingestion'))
+from download_cache import shared_cache
+from manifest import JsonManifest, plan
+from parquet_footer import footer_from_tail, read_footer, validate_schema
+from telemetry import Telemetry
+from gcs_uploader import TailReader, get_uploader
 
 """
 Pre-reqs: 
@@ -20,44 +28,133 @@ BUCKET = os.environ.get("GCP_GCS_BUCKET", "de_zoomcamp_03_nyc_taxi")
 def upload_to_gcs(bucket, object_name, local_file):
     """
     Ref: https://cloud.google.com/storage/docs/uploading-objects#storage-upload-object-python
+    Reuses one client per bucket; chunking, skipping and parallel parts live in gcs_uploader.
+    """
+    return get_uploader(bucket).upload(object_name, local_file)
+
+
+def gcs_manifest(bucket, service):
+    """Incremental-sync manifest of a service's files, kept beside them as <service>/_manifest.json."""
+    blob = get_uploader(bucket).bucket.blob(f"{service}/_manifest.json")
+    return JsonManifest(lambda: blob.download_as_text() if blob.exists() else None,
+                        lambda document: blob.upload_from_string(document, content_type='application/json'))
+
+
+def download_months(year, service, telemetry, months=range(1, 13), rows=None, versions=None):
+    """
+    Yield (object_name, local_file) per month; `rows` and `versions`, if
+    given, collect each file's row count and the source version it came from.
+    """
+    file_names = [f"{service}_tripdata_{year}-{month:02d}.parquet" for month in months]
+    # all of them download (or revalidate) at once over the cache's pooled connections
+    local_files = shared_cache().fetch_many([f"{init_url}{file_name}" for file_name in file_names])
+    for file_name in file_names:
+
+        # wait for this month's file
+        with telemetry.stage('download', chunk=file_name) as step:
+            local_file = next(local_files)
+            step['bytes'] = os.path.getsize(local_file)
+        print(f"Local: {local_file}")
+
+        # row count and schema check from the footer, without decoding the file
+        metadata = read_footer(local_file)
+        validate_schema(metadata, service)
+        print(f"Row count: {metadata.num_rows}")
+        if rows is not None:
+            rows[f"{service}/{file_name}"] = metadata.num_rows
+        if versions is not None:
+            versions[f"{service}/{file_name}"] = shared_cache().version(f"{init_url}{file_name}")
+
+        yield f"{service}/{file_name}", local_file
+
+
+def stream_month(year, service, month):
+    """
+    Pipe one month from the TLC site straight into GCS: nothing is written to
+    local disk. The footer is range-read and validated first, and the footer
+    at the tail of the uploaded stream must agree with it, else the object is
+    deleted again. Returns the object name, its rows and the version (size,
+    etag, last_modified) streamed.
     """
-    # # WORKAROUND to prevent timeout for files > 6 MB on 800 kbps upload speed.
-    # # (Ref: https://github.com/googleapis/python-storage/issues/74)
-    storage.blob._MAX_MULTIPART_SIZE = 5 * 1024 * 1024  # 5 MB
-    storage.blob._DEFAULT_CHUNKSIZE = 5 * 1024 * 1024  # 5 MB
+    file_name = f"{service}_tripdata_{year}-{month:02d}.parquet"
+    object_name = f"{service}/{file_name}"
+    request_url = f"{init_url}{file_name}"
 
-    client = storage.Client(project = 'de-zoomcamp-terraform-demo')
-    bucket = client.bucket(bucket)
-    blob = bucket.blob(object_name)
-    blob.upload_from_filename(local_file)
+    session = shared_cache().fetcher.session
+    metadata = read_footer(request_url, session=session)
+    validate_schema(metadata, service)
 
+    uploader = get_uploader(BUCKET)
+    with session.get(request_url, stream=True, timeout=30) as r:
+        r.raise_for_status()
+        size = int(r.headers['Content-Length']) if 'Content-Length' in r.headers else None
+        version = {'size': size or 0, 'etag': r.headers.get('ETag'), 'last_modified': r.headers.get('Last-Modified')}
+        # keeps the chunk in flight, so a resent chunk can be read again
+        body = TailReader(r.raw)
+        uploader.upload_stream(object_name, body, size=size)
 
-def nyc_data_to_gcs(year, service):
-    for i in range(12):
-        
-        # sets the month part of the file_name string
-        month = '0'+str(i+1)
-        month = month[-2:]
+    try:
+        rows = footer_from_tail(body.tail).num_rows
+        if rows != metadata.num_rows:
+            raise ValueError(f"{object_name}: uploaded {rows} rows, footer said {metadata.num_rows}")
+    except ValueError:
+        # the month changed under the stream (or was cut short): don't leave it in the bucket
+        uploader.bucket.blob(object_name).delete()
+        raise
+    return object_name, rows, version
+
+
+def nyc_data_to_gcs(year, service, passthrough=False, incremental=False):
+    """
+    Copy a year of one service to GCS. With `incremental`, the months are
+    HEADed first and only the ones new or changed since the last run (see
+    gcs_manifest) are transferred.
+    """
+    telemetry = Telemetry('parquet_nyc_to_gcs', service=service, year=year)
+    months = range(1, 13)
+    manifest = None
+    if incremental:
+        manifest = gcs_manifest(BUCKET, service)
+        file_names = {month: f"{service}_tripdata_{year}-{month:02d}.parquet" for month in months}
+        with telemetry.stage('probe'):
+            todo, unchanged, missing = plan(manifest, [(name, f"{init_url}{name}") for name in file_names.values()])
+        names = {name for name, _, _ in todo}
+        months = [month for month, name in file_names.items() if name in names]
+        print(f"{len(months)} new or changed, {len(unchanged)} unchanged, {len(missing)} not published")
 
-        # parquet file_name
-        file_name = f"{service}_tripdata_{year}-{month}.parquet"
+    def record(object_name, rows, version):
+        # the version transferred, not plan()'s probe: the month may have been republished in between
+        if manifest is not None:
+            manifest.put(os.path.basename(object_name), version, rows)
 
-        # download it using requests
-        request_url = f"{init_url}{file_name}"
-        r = requests.get(request_url)
-        open(file_name, 'wb').write(r.content)
-        print(f"Local: {file_name}")
+    if passthrough:
+        def timed_stream(month):
+            with telemetry.stage('stream', chunk=month) as step:
+                object_name, rows, version = stream_month(year, service, month)
+                step['rows'] = rows
+            return object_name, rows, version
 
-        # get row count
-        df = pd.read_parquet(file_name)
-        print(f"Row count: {len(df)}")
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            for object_name, rows, version in pool.map(timed_stream, months):
+                print(f"GCS: {object_name} (streamed, {rows} rows)")
+                record(object_name, rows, version)
+        telemetry.close()
+        return
 
-        # upload it to gcs 
-        upload_to_gcs(BUCKET, f"{service}/{file_name}", file_name)
-        print(f"GCS: {service}/{file_name}")    
-        os.remove(file_name)
+    # months upload in parallel while the next ones are still downloading
+    rows, versions = {}, {}
+    uploads = get_uploader(BUCKET).upload_many(download_months(year, service, telemetry, months, rows, versions),
+                                               telemetry=telemetry)
+    for object_name, status in uploads:
+        print(f"GCS: {object_name} ({status})")
+        record(object_name, rows[object_name], versions[object_name])
+    telemetry.close()
 
 
-nyc_data_to_gcs('2024', 'green')
-nyc_data_to_gcs('2024', 'yellow')
+if __name__ == '__main__':
+    nyc_data_to_gcs('2024', 'green')
+    nyc_data_to_gcs('2024', 'yellow')
+    # a scheduled refresh can opt in to moving only the months TLC has added or republished
+    # (against <service>/_manifest.json in the bucket):
+    # nyc_data_to_gcs('2024', 'green', incremental=True)
 
@@ -1,8 +1,20 @@
 import io
 import os
+import sys
 import requests
 import pandas as pd
-from google.cloud import storage
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+
+# the TLC download cache is shared with the ingestion scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', '..', '01-docker-terraform', 'self-develop', 'ingestion'))
+from download_cache import shared_cache
+from gcs_uploader import get_uploader
+from lake import month_dir, write_month
+from schemas import compact, compact_schema, csv_column_types
+from telemetry import Telemetry, peak_rss_mb
 
 """
 Pre-reqs: 
@@ -17,22 +29,51 @@ init_url = 'https://github.com/DataTalksClub/nyc-tlc-data/releases/download/'
 BUCKET = os.environ.get("GCP_GCS_BUCKET", "de_zoomcamp_03_nyc_taxi")
 
 
+def csv_gz_to_parquet(src, dest, service, block_size=64 * 1024 * 1024):
+    """
+    Convert a gzipped TLC csv to parquet one block at a time, so memory stays
+    at roughly one decoded block no matter how big the month is.
+    Returns the row count.
+    """
+    read_options = pv.ReadOptions(block_size=block_size)
+    # registry column types, so every month lands with the same compact parquet
+    # schema whatever would have been inferred from that month's values
+    convert_options = pv.ConvertOptions(column_types=csv_column_types(service))
+
+    rows = 0
+    with pa.input_stream(src, compression='gzip') as f:
+        reader = pv.open_csv(f, read_options=read_options, convert_options=convert_options)
+        with pq.ParquetWriter(dest, compact_schema(reader.schema, service)) as writer:
+            for batch in reader:
+                writer.write_batch(compact(batch, service))
+                rows += batch.num_rows
+    return rows
+
+
+def read_csv_gz(src, service):
+    """A whole gzipped TLC csv as one Arrow table with the registry's types."""
+    convert_options = pv.ConvertOptions(column_types=csv_column_types(service))
+    with pa.input_stream(src, compression='gzip') as f:
+        return pv.read_csv(f, convert_options=convert_options)
+
+
 def upload_to_gcs(bucket, object_name, local_file):
     """
     Ref: https://cloud.google.com/storage/docs/uploading-objects#storage-upload-object-python
+    Reuses one client per bucket; chunking, skipping and parallel parts live in gcs_uploader.
     """
-    # # WORKAROUND to prevent timeout for files > 6 MB on 800 kbps upload speed.
-    # # (Ref: https://github.com/googleapis/python-storage/issues/74)
-    storage.blob._MAX_MULTIPART_SIZE = 10 * 1024 * 1024  # 5 MB
-    storage.blob._DEFAULT_CHUNKSIZE = 10 * 1024 * 1024  # 5 MB
-
-    client = storage.Client(project = 'de-zoomcamp-terraform-demo')
-    bucket = client.bucket(bucket)
-    blob = bucket.blob(object_name)
-    blob.upload_from_filename(local_file)
+    return get_uploader(bucket).upload(object_name, local_file)
 
 
-def web_to_gcs(year, service):
+def web_to_gcs(year, service, streaming=True, lake=False, by_day=False):
+    """
+    Convert a year of one service to parquet, one file per month; with
+    `lake`, into the Hive-partitioned lake instead (see lake.py), by day
+    too with `by_day`.
+    """
+    telemetry = Telemetry('web_to_gcs', service=service, year=year)
+    # all twelve months download (or revalidate) at once over the cache's pooled connections
+    local_files = shared_cache().fetch_many([f"{init_url}{service}/{service}_tripdata_{year}-{i:02d}.csv.gz" for i in range(1, 13)])
     for i in range(12):
         
         # sets the month part of the file_name string
@@ -42,25 +83,51 @@ def web_to_gcs(year, service):
         # csv file_name
         file_name = f"{service}_tripdata_{year}-{month}.csv.gz"
 
-        # download it using requests via a pandas df
-        request_url = f"{init_url}{service}/{file_name}"
-        r = requests.get(request_url)
-        open(file_name, 'wb').write(r.content)
-        print(f"Local: {file_name}")
+        # wait for this month's download
+        with telemetry.stage('download', chunk=file_name) as step:
+            local_file = next(local_files)
+            step['bytes'] = os.path.getsize(local_file)
+        print(f"Local: {local_file}")
+
+        if lake:
+            # the month is sorted by pickup time as a whole, so it is read whole
+            with telemetry.stage('decode', chunk=file_name) as step:
+                table = read_csv_gz(local_file, service)
+                step['rows'] = table.num_rows
+            with telemetry.stage('lake', chunk=file_name, rows=table.num_rows) as step:
+                files = write_month(table, service, year, month, by_day=by_day)
+                step['bytes'] = sum(os.path.getsize(path) for _, path in files)
+            rows = table.num_rows
+            del table
+            print(f"Row count: {rows}")
+            print(f"Lake: {len(files)} file(s) under {month_dir(service, year, month)} (peak RSS {peak_rss_mb():.0f} MB)")
+
+            # upload it to gcs, under the same layout
+            # for object_name, status in get_uploader(BUCKET).upload_many(
+            #         (f"lake/{object_name}", path) for object_name, path in files):
+            #     print(f"GCS: {object_name} ({status})")
+            continue
 
         # read it back into a parquet file
-        df = pd.read_csv(file_name, compression='gzip')
-        print(f"Row count: {len(df)}")
-        os.remove(file_name)
         file_name = file_name.replace('.csv.gz', '.parquet')
-        df.to_parquet(file_name, engine='pyarrow')
-        print(f"Parquet: {file_name}")
+        with telemetry.stage('decode', chunk=file_name) as step:
+            if streaming:
+                rows = csv_gz_to_parquet(local_file, file_name, service)
+            else:
+                df = pd.read_csv(local_file, compression='gzip')
+                rows = len(df)
+                df.to_parquet(file_name, engine='pyarrow')
+            step['rows'] = rows
+        print(f"Row count: {rows}")
+        print(f"Parquet: {file_name} (peak RSS {peak_rss_mb():.0f} MB)")
 
         # upload it to gcs 
         # upload_to_gcs(BUCKET, f"{service}/{file_name}", file_name)
         # print(f"GCS: {service}/{file_name}")
         # os.remove(file_name)
 
+    telemetry.close()
+
 
 # web_to_gcs('2019', 'green')
 # web_to_gcs('2020', 'green')